@@ -15,6 +15,8 @@ __contact__   = __author__
 
 import os, sys
 import argparse
+import multiprocessing
+import collections
 import Tkinter, tkFileDialog
 from urllib2 import URLError, HTTPError
 import logging
@@ -29,37 +31,148 @@ import nwispy_logging
 def process_files(file_list, arguments):
     """    
     Process a list of files according to options contained in arguments parameter.
+    If arguments.jobs is greater than 1, files are processed in parallel by a pool
+    of worker processes. Either way, a file that fails is logged and skipped, and 
+    a summary of the processed and failed files is printed.
 
     Parameters
     ----------
-    file_list : list of str
-        List of files to parse, process, and plot.        
+    file_list : iterable of str
+        List (or generator) of files to parse, process, and plot. Files are processed 
+        as the iterable produces them.
     arguments : argparse object
         An argparse object containing user options.                    
     """
-    for f in file_list:
+    failures = []
+    num_files = 0
+    
+    if arguments.jobs <= 1:
+        for f in file_list:
+            failures.append(_process_file_safely(filepath = f, arguments = arguments))
+            num_files += 1
+            
+    else:
+        if arguments.showplot:
+            logging.warn("Plots are not shown when processing files in parallel; plots are only saved.")
+            
+        pool = multiprocessing.Pool(processes = arguments.jobs, initializer = _initialize_worker)
+        pending = collections.deque()
+        
+        for f in file_list:
+            # wait on the oldest file when enough files are queued so files are not taken faster than they are processed
+            if len(pending) >= 2 * arguments.jobs:
+                failures.append(pending.popleft().get())
                 
-        filedir, filename = nwispy_helpers.get_file_info(f)
-          
-        # create output directory     
-        outputdirpath = nwispy_helpers.make_directory(path = filedir, directory_name = '-'.join([filename.split(".txt")[0], "output"]))      
+            pending.append(pool.apply_async(_process_file_worker, (f, arguments)))
+            num_files += 1
+            
+        pool.close()
         
-        # initialize error logging
-        nwispy_logging.initialize_loggers(output_dir = outputdirpath)        
+        failures.extend([result.get() for result in pending])
+        pool.join()
         
-        # read data
-        data = nwispy_filereader.read_file(f)  
+    failures = [failure for failure in failures if failure]
+    print_summary(num_files = num_files, failures = failures)
 
-        # plot data                            
-        nwispy_viewer.plot_data(data, is_visible = arguments.showplot, save_path = outputdirpath)             
-                
-        # print data
-        if arguments.verbose: 
-            nwispy_viewer.print_info(data)  
+def process_file(filepath, arguments):
+    """    
+    Process a single file according to options contained in arguments parameter.
+    Plots and an error log are saved to an output directory next to the file.
+    Each site of a file containing data for several sites is processed in turn.
+
+    Parameters
+    ----------
+    filepath : str
+        String path to file to parse, process, and plot.        
+    arguments : argparse object
+        An argparse object containing user options.                    
+    """
+    filedir, filename = nwispy_helpers.get_file_info(filepath)
+      
+    # create output directory     
+    outputdirpath = nwispy_helpers.make_directory(path = filedir, directory_name = '-'.join([filename.split(".txt")[0], "output"]))      
+    
+    # initialize error logging
+    nwispy_logging.initialize_loggers(output_dir = outputdirpath)        
+    
+    try:
+        # read data of each site
+        sites = nwispy_filereader.read_sites(filepath, use_cache = arguments.cache)  
 
+        for data in sites.values():
+            # plot data                            
+            nwispy_viewer.plot_data(data, is_visible = arguments.showplot, save_path = outputdirpath)             
+            
+            # plot flow duration curves of discharge
+            if arguments.flowduration:
+                nwispy_viewer.plot_flow_duration(data, is_visible = arguments.showplot, save_path = outputdirpath)
+                    
+            # print data
+            if arguments.verbose: 
+                nwispy_viewer.print_info(data)  
+
+    finally:
         # close error logging
         nwispy_logging.remove_loggers()
 
+def _initialize_worker():
+    """ Initialize a worker process; workers only save plots, so use a non-interactive plotting backend """
+    
+    nwispy_viewer.use_noninteractive_backend()
+
+def _process_file_worker(filepath, arguments):
+    """ Process a single file in a worker process, where plots are only saved; see _process_file_safely() """
+    
+    arguments.showplot = False
+    
+    return _process_file_safely(filepath = filepath, arguments = arguments)
+
+def _process_file_safely(filepath, arguments):
+    """    
+    Process a single file. Errors are logged to the file's error log and returned 
+    instead of raised so that one bad file does not stop the other files from 
+    being processed.
+    
+    Returns
+    -------
+    failure : {tuple, None}
+        Tuple of the file path and the error message, or None if file was processed.
+    """
+    try:
+        process_file(filepath = filepath, arguments = arguments)
+        
+    except Exception as error:
+        # log to the error log in the file's output directory
+        filedir, filename = nwispy_helpers.get_file_info(filepath)
+        outputdirpath = nwispy_helpers.make_directory(path = filedir, directory_name = '-'.join([filename.split(".txt")[0], "output"]))
+        nwispy_logging.initialize_loggers(output_dir = outputdirpath)
+        logging.exception("Error processing {0}: {1}".format(filepath, error))
+        nwispy_logging.remove_loggers()
+        
+        return (filepath, "{0}: {1}".format(type(error).__name__, error))
+        
+    return None
+
+def print_summary(num_files, failures):
+    """    
+    Print a summary of processed files.
+
+    Parameters
+    ----------
+    num_files : int
+        Number of files processed.        
+    failures : list of tuples
+        List of tuples of file path and error message of each file that failed.
+    """
+    print("--- PROCESSING SUMMARY ---")
+    print("Processed: {0} of {1} file(s)".format(num_files - len(failures), num_files))
+    
+    if failures:
+        print("Failed:")
+        for filepath, error in failures:
+            print("  {0}".format(filepath))
+            print("      {0}".format(error))
+
 def process_webrequest(request_file, arguments):
     """    
     Process a web request file and download requests.
@@ -81,30 +194,192 @@ def process_webrequest(request_file, arguments):
     
     # read the request data file
     request_data = nwispy_webservice.read_webrequest(filepath = request_file)                         
-              
-    for request in request_data["requests"]:    
-        # encode a url based on request
-        request_url = nwispy_webservice.encode_url(request) 
-        
-        # name each file by date tagging it to current date and time and its site number
+    
+    requests = request_data["requests"]
+    
+    # in incremental mode, request only the data missing from each request's store
+    stores = {}
+    state_filepath = os.path.join(web_filedir, nwispy_webservice.STATE_FILENAME)
+    state = nwispy_webservice.read_state(filepath = state_filepath) if arguments.incremental else {}
+    if arguments.incremental:
+        requests = [nwispy_webservice.get_incremental_request(request = request, state = state) for request in requests]
+    
+    # keep downloaded files gzip compressed if requested
+    file_ext = ".txt.gz" if arguments.compress else ".txt"
+    
+    # name each file by date tagging it to current date and time and its site number; number repeated names
+    filenames = set()
+    for request, original in zip(requests, request_data["requests"]):
         date_time_str = nwispy_helpers.now()
-        web_filename = "_".join([request["site number"], request["data type"], date_time_str]) + ".txt"
+        web_filename = "_".join([request["site number"], request["data type"], date_time_str])
+        if web_filename in filenames:
+            web_filename = "_".join([web_filename, str(len(filenames))])
+        filenames.add(web_filename)
+        request["filename"] = web_filename + file_ext
+        
+        # a request for all of its data replaces its store; otherwise the store keeps its start date
+        if arguments.incremental and request["start date"]:
+            store_name = nwispy_webservice.get_store_name(request)
+            start_date = state[store_name]["start date"] if request is not original else nwispy_webservice.normalize_date(request["start date"])
+            stores[os.path.join(web_filedir, request["filename"])] = (store_name, start_date, request is original)
+    
+    # coalesce requests into the fewest downloads
+    plans = nwispy_webservice.plan_requests(requests = requests)
+    
+    downloads = []
+    splits = {}
+    for i, plan in enumerate(plans):    
+        # encode a url based on the planned request
+        request_url = nwispy_webservice.encode_url(plan) 
         
-        # download the files
-        nwispy_webservice.download_file(user_parameters_url = request_url, 
-                                        data_type = request["data type"], 
-                                        filename = web_filename,
-                                        file_destination = web_filedir)
+        # a coalesced download is split into a file for each original request once downloaded
+        if len(plan["requests"]) == 1:
+            web_filename = plan["requests"][0]["filename"]
+        else:
+            web_filename = "_".join(["coalesced", plan["data type"], str(i), nwispy_helpers.now()]) + ".rdb" + file_ext[len(".txt"):]
+            splits[os.path.join(web_filedir, web_filename)] = (plan["requests"], [os.path.join(web_filedir, request["filename"]) for request in plan["requests"]])
+        
+        downloads.append({"url": request_url, "data type": plan["data type"], "filename": web_filename})
+
+    # journal each download; when resuming, skip the downloads that completed in the previous run
+    journal_filepath = os.path.join(web_filedir, nwispy_webservice.JOURNAL_FILENAME)
+    journal = nwispy_webservice.read_journal(filepath = journal_filepath) if arguments.resume else {}
+    if arguments.resume:
+        num_downloads = len(downloads)
+        downloads = [download for download in downloads if journal.get(nwispy_webservice.get_journal_key(download), {}).get("status") != "done"]
+        logging.info("Resuming; {0} of {1} download(s) remain".format(len(downloads), num_downloads))
 
-    # close error logging
+    # close error logging; each processed file logs to its own output directory
     nwispy_logging.remove_loggers()
-    
 
-    # process the downloaded file(s)
-    file_list = nwispy_helpers.get_file_paths(directory = web_filedir, file_ext = ".txt")
+    # cache responses next to the request file
+    cache = None
+    if arguments.web_cache or arguments.offline:
+        cache = nwispy_webservice.ResponseCache(directory = os.path.join(request_filedir, nwispy_webservice.RESPONSE_CACHE_DIRECTORY), offline = arguments.offline)
 
+    # rate limit and retry requests
+    scheduler = nwispy_webservice.RequestScheduler(max_retries = arguments.retries)
+
+    # download the files concurrently and process each file as soon as its download completes
+    results = nwispy_webservice.iter_downloads(downloads = downloads, file_destination = web_filedir, max_workers = arguments.downloads, cache = cache, scheduler = scheduler)
+    results = _journaled_results(results = results, downloads = downloads, journal = journal, journal_filepath = journal_filepath)
+    
+    download_failures = []
+    file_list = _downloaded_files(results = results, splits = splits, failures = download_failures)
+    
+    # in incremental mode, append each download to its store and process the store
+    if arguments.incremental:
+        file_list = _stored_files(file_list = file_list, stores = stores, state = state, state_filepath = state_filepath)
+        
     process_files(file_list = file_list, arguments = arguments)   
 
+    # log download errors
+    if download_failures:
+        nwispy_logging.initialize_loggers(output_dir = web_filedir)
+        for filepath, error in download_failures:
+            logging.error("Error downloading {0}: {1}".format(filepath, error))
+        logging.info("{0} download(s) failed; rerun with -r to retry only the failed download(s)".format(len(download_failures)))
+        nwispy_logging.remove_loggers()
+
+def _journaled_results(results, downloads, journal, journal_filepath):
+    """    
+    Record each download result in the journal of a batch of downloads, and yield
+    the result. The journal is saved after each result so that a batch that stops
+    can be resumed.
+    
+    Parameters
+    ----------
+    results : iterable of tuples
+        Iterable of (filepath, error) tuples from nwispy_webservice.iter_downloads().
+    downloads : list of dictionaries
+        List of download dictionaries.
+    journal : dictionary
+        Dictionary returned by nwispy_webservice.read_journal().
+    journal_filepath : str
+        String path to the journal file.
+    """
+    keys = dict((download["filename"], nwispy_webservice.get_journal_key(download)) for download in downloads)
+    
+    for filepath, error in results:
+        journal[keys[os.path.basename(filepath)]] = {
+            "status": "done" if error is None else "failed", 
+            "filename": os.path.basename(filepath), 
+            "error": None if error is None else str(error)
+        }
+        nwispy_webservice.write_journal(filepath = journal_filepath, journal = journal)
+        
+        yield filepath, error
+
+def _downloaded_files(results, splits, failures):
+    """    
+    Yield the path of each successful download from download results, and collect 
+    failed downloads. Downloads of coalesced requests are split into a file for 
+    each original request, and the path of each of those files is yielded instead.
+    
+    Parameters
+    ----------
+    results : iterable of tuples
+        Iterable of (filepath, error) tuples from nwispy_webservice.iter_downloads().
+    splits : dictionary
+        Dictionary of coalesced download file paths to a tuple of the original 
+        requests and the paths of their files.
+    failures : list
+        List to append (filepath, error) tuples of failed downloads to.
+    """
+    for filepath, error in results:
+        if error is not None:
+            failures.append((filepath, error))
+            
+        elif filepath in splits:
+            requests, filepaths = splits[filepath]
+            found = nwispy_webservice.split_file(filepath = filepath, requests = requests, filepaths = filepaths)
+            os.remove(filepath)
+            
+            for path, has_data in zip(filepaths, found):
+                if has_data:
+                    yield path
+                else:
+                    failures.append((path, "No data found for request in coalesced response"))
+        else:
+            yield filepath
+
+def _stored_files(file_list, stores, state, state_filepath):
+    """    
+    Append each downloaded file to its store, and yield the path of the store. 
+    The state of incremental retrievals is saved after each file is appended.
+    
+    Parameters
+    ----------
+    file_list : iterable of str
+        Iterable of paths of downloaded files.
+    stores : dictionary
+        Dictionary of downloaded file paths to a tuple of their store file name, the 
+        first date requested for the store, and whether the file replaces the store.
+    state : dictionary
+        Dictionary returned by nwispy_webservice.read_state().
+    state_filepath : str
+        String path to the state file.
+    """
+    for filepath in file_list:
+        if filepath not in stores:
+            yield filepath
+            continue
+        
+        store_name, start_date, replace = stores[filepath]
+        store_filepath = os.path.join(os.path.dirname(filepath), store_name)
+        if filepath.endswith(".gz"):
+            store_filepath += ".gz"
+        
+        last = nwispy_webservice.append_file(store_filepath = store_filepath, filepath = filepath, last = None if replace else state[store_name]["last"])
+        
+        if last is not None:
+            state[store_name] = {"start date": start_date, "last": last}
+        else:
+            state.pop(store_name, None)
+        nwispy_webservice.write_state(filepath = state_filepath, state = state)
+        
+        yield store_filepath
+
 def main():  
     """
     Run program based on user input arguments. Program will automatically process file(s) supplied or downloaded,
@@ -119,8 +394,18 @@ def main():
     group.add_argument('-fd', '--filedialog', action = 'store_true', help = 'Open a file dialog window to select data file(s).')
     parser.add_argument('-v', '--verbose', action = 'store_true',  help = 'Print general information about data file(s)')
     parser.add_argument('-p', '--showplot', action = 'store_true',  help = 'Show plots of parameters contained in data file(s)')
+    parser.add_argument('-fdc', '--flowduration', action = 'store_true', help = 'Plot flow duration curves of discharge parameters contained in data file(s)')
+    parser.add_argument('-c', '--cache', action = 'store_true',  help = 'Cache parsed data file(s) in binary form to speed up reprocessing unchanged file(s)')
+    parser.add_argument('-j', '--jobs', type = int, default = 1, help = 'Number of data files to process in parallel; default is 1')
     parser.add_argument('-web', '--webservice', nargs = '+',  help = 'List a web service request file to be processed')
     parser.add_argument('-webfd', '--webservice_dialog', action = 'store_true',  help = 'Open a file dialog window to select a web service request file')
+    parser.add_argument('-i', '--incremental', action = 'store_true', help = 'Download only data that is newer than the data already downloaded for web service requests, and append it to a store for each request')
+    parser.add_argument('-wc', '--web_cache', action = 'store_true', help = 'Cache web service responses to speed up repeated requests')
+    parser.add_argument('-offline', '--offline', action = 'store_true', help = 'Use only cached web service responses; no requests are made')
+    parser.add_argument('-z', '--compress', action = 'store_true', help = 'Keep downloaded data files gzip compressed')
+    parser.add_argument('-r', '--resume', action = 'store_true', help = 'Resume the previous run of a web service request file; download only the requests that did not complete')
+    parser.add_argument('--retries', type = int, default = nwispy_webservice.MAX_RETRIES, help = 'Number of times a failed web service request is retried; default is {0}'.format(nwispy_webservice.MAX_RETRIES))
+    parser.add_argument('-d', '--downloads', type = int, default = nwispy_webservice.MAX_WORKERS, help = 'Number of concurrent downloads for web service requests; default is {0}'.format(nwispy_webservice.MAX_WORKERS))
     args = parser.parse_args()  
 
     try:
@@ -154,6 +439,9 @@ def main():
             data = nwispy_filereader.read_file_in(sys.stdin) 
             outputdirpath = nwispy_helpers.make_directory(path = os.getcwd(), directory_name = args.outputdir)
             nwispy_viewer.plot_data(data, is_visible = args.showplot, save_path = outputdirpath) 
+            
+            if args.flowduration:
+                nwispy_viewer.plot_flow_duration(data, is_visible = args.showplot, save_path = outputdirpath)
                     
             if args.verbose: 
                 nwispy_viewer.print_info(data)
@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+"""
+:Module: nwispy_dataset.py
+
+:Author: Jeremiah Lant, jlant@usgs.gov, U.S. Geological Survey, Kentucky Water Science Center, http://www.usgs.gov/
+
+:Synopsis: Compact columnar container for data found in U.S. Geological Survey (USGS) National Water Information System (NWIS) data files; http://waterdata.usgs.gov/nwis
+"""
+
+__author__   = "Jeremiah Lant, jlant@usgs.gov, U.S. Geological Survey, Kentucky Water Science Center."
+__copyright__ = "http://www.usgs.gov/visual-id/credit_usgs.html#copyright"
+__license__   = __copyright__
+__contact__   = __author__
+
+import numpy as np
+import datetime
+
+# my modules
+import nwispy_helpers
+import nwispy_stats
+
+class NwisDataset(object):
+    """
+    Columnar container for the data found in an NWIS data file. The values of
+    all parameters are held in one 2-D float array (time x parameter) stored
+    column major, so that each parameter's data is a contiguous view into the
+    shared array rather than a copy. All parameters share one array of dates.
+
+    A dataset can be used like the data dictionary returned by earlier versions
+    of nwispy_filereader.read_file_in(); e.g. dataset["gage_name"] and
+    dataset["parameters"][0]["data"].
+
+    Parameters
+    ----------
+    dates : array
+        Array of datetime64 values (or datetime objects).
+    values : array
+        2-D array of float values with a column for each parameter.
+    parameters : list of dictionaries
+        List of parameter dictionaries with "code", "description", and "index" keys,
+        and an optional "qualifiers" key; one for each column of values.
+    date_retrieved : str
+        String date the data file was retrieved.
+    gage_name : str
+        String gage name.
+    site_no : str
+        String site number.
+    column_names : list of str
+        List of column names found in the data file.
+    timestep : str
+        String timestep; "daily" or "instantaneous".
+    step : timedelta64
+        Interval between every pair of consecutive dates if the dates are 
+        regular, otherwise None. The dates of a regular dataset are an implicit 
+        index (first date + row * step), so rows are found by date with 
+        arithmetic instead of searching the dates.
+    gaps : dictionary
+        Dictionary of arrays with the date before ("start") and after ("end") 
+        each gap in the dates and the number of timesteps missing in each gap 
+        ("missing"); see nwispy_helpers.find_timestep.
+    tz_cd : dictionary
+        Categorical dictionary of time zone codes or None.
+    qualification_codes : dictionary
+        Dictionary of the data-value qualification codes described in the data
+        file and their descriptions; e.g. {"A": "Approved for publication ..."}
+    """
+    __slots__ = ("date_retrieved", "gage_name", "site_no", "column_names", "parameters", "dates", "timestep", "step", "gaps", "tz_cd", "qualification_codes", "values")
+
+    def __init__(self, dates, values, parameters, date_retrieved = None, gage_name = None, site_no = None, column_names = None, timestep = None, tz_cd = None,
+                 qualification_codes = None, step = None, gaps = None):
+        self.date_retrieved = date_retrieved
+        self.gage_name = gage_name
+        self.site_no = site_no
+        self.column_names = column_names
+        self.dates = dates
+        self.timestep = timestep
+        self.step = step
+        self.gaps = gaps
+        self.tz_cd = tz_cd
+        self.qualification_codes = qualification_codes if qualification_codes is not None else {}
+        self.values = np.asfortranarray(np.asarray(values, dtype = np.float64).reshape(len(dates), len(parameters)))
+
+        self.parameters = []
+        for column, parameter in enumerate(parameters):
+            self.parameters.append(NwisParameter(dataset = self, column = column, code = parameter["code"],
+                                                 description = parameter["description"], index = parameter["index"],
+                                                 qualifiers = parameter.get("qualifiers")))
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __repr__(self):
+        return "NwisDataset(gage_name = {!r}, timestep = {!r}, parameters = {!r}, rows = {})".format(self.gage_name, self.timestep, self.codes, len(self))
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def get(self, key, default = None):
+        if key in self.__slots__:
+            return getattr(self, key)
+        else:
+            return default
+
+    @property
+    def codes(self):
+        """ List of parameter codes in column order """
+        return [parameter.code for parameter in self.parameters]
+
+    def get_parameter(self, code):
+        """
+        Get a parameter by its code.
+
+        Parameters
+        ----------
+        code : str
+            String parameter code; e.g. "02_00065"
+
+        Returns
+        -------
+        parameter : NwisParameter
+
+        Raises
+        ------
+        KeyError
+            If there is no parameter with the code.
+        """
+        for parameter in self.parameters:
+            if parameter.code == code:
+                return parameter
+
+        raise KeyError(code)
+
+    def aggregate(self, by = "month", percentiles = None):
+        """
+        Compute statistics of the values of all parameters in each group of 
+        dates, such as each calendar month or water year.
+
+        Parameters
+        ----------
+        by : {"month", "season", "day_of_year", "year", "water_year", "climatic_year", "year_month"}
+            String group of dates (see nwispy_stats.get_group_keys).
+        percentiles : list of float
+            List of percentiles (0 - 100) to compute for each group.
+
+        Returns
+        -------
+        aggregation : dictionary
+            Dictionary of the group keys and statistics; each statistic has a 
+            row for each group and a column for each parameter.
+
+        See Also
+        --------
+        nwispy_stats.aggregate : Compute statistics of groups of values
+        """
+        return nwispy_stats.aggregate(dates = self.dates, values = self.values, by = by, percentiles = percentiles)
+
+    def resample(self, freq = "daily", tz = None, min_fraction = None):
+        """
+        Compute statistics of the values of all parameters in each hour, day, 
+        or month; e.g. daily mean, min, and max values of an instantaneous 
+        dataset.
+
+        Parameters
+        ----------
+        freq : {"hourly", "daily", "monthly"}
+            String period to resample to.
+        tz : str
+            String time zone code (e.g. "EST") to convert the dates to with 
+            the time zone codes of the dataset before they are resampled; 
+            None resamples the local dates as they are in the data file.
+        min_fraction : float
+            Minimum fraction (0 - 1) of the expected values of a period that 
+            must be valid; the statistics of periods with fewer values are nan.
+
+        Returns
+        -------
+        resampled : dictionary
+            Dictionary of the period dates and statistics; each statistic has 
+            a row for each period and a column for each parameter.
+
+        See Also
+        --------
+        nwispy_stats.resample : Resample values to hourly, daily, or monthly periods
+        nwispy_helpers.convert_time_zone : Convert local dates to a single time zone
+        """
+        dates = self.dates
+        if tz is not None:
+            if self.tz_cd is None:
+                raise ValueError("Dataset has no time zone codes to convert the dates with")
+            dates = nwispy_helpers.convert_time_zone(dates, self.tz_cd, tz)
+
+        step = self.step
+        if step is None:
+            step = nwispy_helpers.find_timestep(dates)["step"]
+
+        return nwispy_stats.resample(dates = dates, values = self.values, freq = freq, step = step, min_fraction = min_fraction)
+
+    def get_index(self, date):
+        """
+        Get the row of a date. The row of a regular dataset is computed from the
+        first date and the step; otherwise the dates are searched.
+
+        Parameters
+        ----------
+        date : {datetime, datetime64}
+            Date to find.
+
+        Returns
+        -------
+        index : int
+            Row of the date.
+
+        Raises
+        ------
+        KeyError
+            If the date is not one of the dates of the dataset.
+        """
+        date = np.datetime64(date, "m")
+        dates = nwispy_helpers.to_datetime64(self.dates)
+
+        if self.step is not None and len(dates) > 0:
+            index, remainder = divmod(int((date - dates[0]) / np.timedelta64(1, "m")), int(self.step / np.timedelta64(1, "m")))
+            if remainder == 0 and 0 <= index < len(dates):
+                return index
+        else:
+            index = int(np.searchsorted(dates, date))
+            if index < len(dates) and dates[index] == date:
+                return index
+
+        raise KeyError(date)
+
+    def get_slice(self, start_date = None, end_date = None):
+        """
+        Get a slice of the rows with dates from start_date to end_date 
+        inclusive. Slicing the values or a parameter's data with the slice 
+        gives a view rather than a copy. The slice of a regular dataset is 
+        computed from the first date and the step; otherwise the dates are 
+        searched.
+
+        Parameters
+        ----------
+        start_date : {datetime, datetime64}
+            First date of the rows; from the first row if None.
+        end_date : {datetime, datetime64}
+            Last date of the rows; to the last row if None.
+
+        Returns
+        -------
+        rows : slice
+            Slice of the rows.
+        """
+        dates = nwispy_helpers.to_datetime64(self.dates)
+
+        if len(dates) == 0:
+            return slice(0, 0)
+
+        start, end = 0, len(dates)
+
+        if self.step is not None:
+            step = int(self.step / np.timedelta64(1, "m"))
+
+            if start_date is not None:
+                start = -(-int((np.datetime64(start_date, "m") - dates[0]) / np.timedelta64(1, "m")) // step)
+            if end_date is not None:
+                end = int((np.datetime64(end_date, "m") - dates[0]) / np.timedelta64(1, "m")) // step + 1
+
+            start, end = min(max(start, 0), len(dates)), min(max(end, 0), len(dates))
+        else:
+            start, end = nwispy_helpers.find_date_indices(dates, start_dates = start_date, end_dates = end_date)
+
+        return slice(start, max(start, end))
+
+
+class NwisParameter(object):
+    """
+    A parameter of an NwisDataset. The parameter's data is a view of a column
+    of the dataset's shared 2-D array of values; no data is copied. Can be used
+    like a parameter dictionary; e.g. parameter["data"] and parameter["mean"].
+
+    Parameters
+    ----------
+    dataset : NwisDataset
+        Dataset that holds the parameter's data.
+    column : int
+        Column of the dataset's values array holding the parameter's data.
+    code : str
+        String parameter code.
+    description : str
+        String parameter description.
+    index : int
+        Column index of the parameter in the data file.
+    qualifiers : dictionary
+        Categorical dictionary of the parameter's qualification codes (see 
+        nwispy_helpers.encode_categorical) or None if the data file has no 
+        qualification code column for the parameter.
+    """
+    __slots__ = ("dataset", "column", "code", "description", "index", "qualifiers", "mean", "max", "min")
+
+    # keys of the parameter dictionary
+    _keys = ("code", "description", "index", "data", "qualifiers", "mean", "max", "min")
+
+    def __init__(self, dataset, column, code, description, index, qualifiers = None):
+        self.dataset = dataset
+        self.column = column
+        self.code = code
+        self.description = description
+        self.index = index
+        self.qualifiers = qualifiers
+        self.mean = None
+        self.max = None
+        self.min = None
+
+    @property
+    def data(self):
+        """ Array view of the parameter's data """
+        return self.dataset.values[:, self.column]
+
+    @data.setter
+    def data(self, value):
+        self.dataset.values[:, self.column] = value
+
+    def get_qualifier_mask(self, include = None, exclude = None):
+        """
+        Get a boolean mask of the parameter's data values whose qualification 
+        codes match a query; e.g. approved values only (include = ["A"]) or 
+        values that are not estimated (exclude = ["e"]). Values of a parameter 
+        without qualification codes carry no codes.
+
+        Parameters
+        ----------
+        include : list of str
+            List of qualification codes; a value is selected if it carries any of them.
+        exclude : list of str
+            List of qualification codes; a value is not selected if it carries any of them.
+
+        Returns
+        -------
+        mask : array
+            Boolean array that is True for each selected data value.
+
+        See Also
+        --------
+        nwispy_helpers.get_qualifier_mask : Get a mask of a categorical array of qualification codes
+        """
+        qualifiers = self.qualifiers
+        if qualifiers is None:
+            qualifiers = {"codes": np.zeros(len(self.dataset), dtype = np.int8), "categories": [""]}
+
+        return nwispy_helpers.get_qualifier_mask(qualifiers = qualifiers, include = include, exclude = exclude)
+
+    def rolling(self, window, statistic = "mean", min_count = None):
+        """
+        Compute a statistic of the moving window of the parameter's data 
+        ending at each value; e.g. a 7-day mean (window = 7 values of a daily 
+        dataset or window = np.timedelta64(7, "D")).
+
+        Parameters
+        ----------
+        window : {int, timedelta64, timedelta}
+            Number of values in each window, or length of time of each window.
+        statistic : {"count", "sum", "mean", "min", "max"}
+            String statistic of each window.
+        min_count : int
+            Minimum number of valid values of a window; the statistic of 
+            windows with fewer values is nan.
+
+        Returns
+        -------
+        rolled : array
+            Array of the statistic of the window ending at each value.
+
+        See Also
+        --------
+        nwispy_stats.rolling : Compute a statistic of moving windows of values
+        """
+        return nwispy_stats.rolling(values = self.data, window = window, statistic = statistic, min_count = min_count, dates = self.dataset.dates)
+
+    def compute_low_flows(self, days = 7, by = "climatic_year"):
+        """
+        Compute the annual minimum n-day mean values of the parameter's daily 
+        data; e.g. the annual 7-day low flows of daily discharge.
+
+        Parameters
+        ----------
+        days : int
+            Number of days of each moving mean.
+        by : {"climatic_year", "water_year", "year"}
+            String year to find the minimum of.
+
+        Returns
+        -------
+        low_flows : dictionary
+            Dictionary of the year "keys", the "low_flows" of each year, and 
+            the number of valid n-day means of each year ("count").
+
+        See Also
+        --------
+        nwispy_stats.compute_low_flows : Compute annual minimum n-day mean values
+        nwispy_stats.compute_low_flow_frequency : Compute a low flow with a recurrence interval (e.g. the 7Q10)
+        """
+        return nwispy_stats.compute_low_flows(dates = self.dataset.dates, values = self.data, days = days, by = by)
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._keys:
+            raise KeyError(key)
+
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __repr__(self):
+        return "NwisParameter(code = {!r}, description = {!r})".format(self.code, self.description)
+
+    def keys(self):
+        return list(self._keys)
+
+    def get(self, key, default = None):
+        if key in self._keys:
+            return getattr(self, key)
+        else:
+            return default
+
+
+def _create_test_data():
+    """ Create test data for tests """
+
+    dates = np.array([datetime.datetime(2014, 03, 01, 8, 0) + datetime.timedelta(i) for i in range(10)], dtype = "datetime64[m]")
+
+    values = np.column_stack([np.arange(10, dtype = float), np.arange(100, 110, dtype = float)])
+
+    parameters = [
+        {"code": "03_00010", "description": "Temperature, water, degrees Celsius", "index": 4},
+        {"code": "02_00065", "description": "Gage height, feet", "index": 6}
+    ]
+
+    dataset = NwisDataset(dates = dates, values = values, parameters = parameters,
+                          date_retrieved = "2014-03-20 22:28:47",
+                          gage_name = "USGS 03401385 DAVIS BRANCH AT HIGHWAY 988 NEAR MIDDLESBORO, KY",
+                          timestep = "daily")
+
+    return dataset
+
+def test_dataset():
+    """ Test NwisDataset functionality """
+
+    print("--- Testing NwisDataset ---")
+
+    dataset = _create_test_data()
+
+    print(dataset)
+    print("    gage name: {}".format(dataset["gage_name"]))
+
+    for parameter in dataset["parameters"]:
+        print("    {}: {}".format(parameter["description"], parameter["data"]))
+
+    print("    parameter data is a view of the shared values: {}".format(np.may_share_memory(dataset["parameters"][1]["data"], dataset.values)))
+    print("")
+
+def main():
+    """ Test functionality of NwisDataset """
+
+    test_dataset()
+
+if __name__ == "__main__":
+    main()
@@ -12,43 +12,296 @@ __copyright__ = "http://www.usgs.gov/visual-id/credit_usgs.html#copyright"
 __license__   = __copyright__
 __contact__   = __author__
 
+import os
 import re
+import json
 import numpy as np
 import datetime
 import logging
+import collections
 from StringIO import StringIO
 
 # my modules
 import nwispy_helpers
+import nwispy_dataset
+import nwispy_stats
 
-def read_file(filepath):
+# regular expression patterns in the header of a data file; compiled once when the module is imported
+# the column_names pattern has 5 groups which is used to distinguish a daily file from an 
+# instanteous file; if 4th group (tz_cd) is None, then data file is daily, otherwise it is an 
+# instantaneous file. Data rows are not searched with a pattern; the data block is parsed in bulk.
+PATTERNS = {
+    "date_retrieved": re.compile("(.+): ([0-9]{4}-[0-9]{2}-[0-9]{2}\s[0-9]{2}:[0-9]{2}:[0-9]{2})(.+)"),  
+    "gage_name": re.compile("(#.+)(USGS [0-9]+\s.+)"),
+    "parameters": re.compile("(#)\D+([0-9]{2})\D+([0-9]{5})(\D+[0-9]{5})?(.+)"),
+    "column_names": re.compile("(agency_cd)\t(site_no)\t(datetime)\t(tz_cd)?(.+)"),
+    "site": re.compile("#\s+Data provided for site ([0-9]+)"),
+    "qualification_codes": re.compile("#\s+Data-value qualification codes"),
+    "qualification_code": re.compile("#\s+(\S+)\s+(\S.*?)\s*$")
+}
+
+# name of the directory holding cached parsed data files; created next to the data files
+CACHE_DIRECTORY = ".nwispy-cache"
+
+# version of the cache layout; cached files with a different version are ignored
+CACHE_VERSION = 4
+
+def read_file(filepath, as_datetime = False, use_cache = False):
     """    
     Open NWIS file, create a file object for read_file_in(filestream) to process.
     This function is responsible to opening the file, removing the file opening  
     responsibility from read_file_in(filestream) so that read_file_in(filestream)  
-    can be unit tested.
+    can be unit tested. Files compressed with gzip (.gz), bzip2 (.bz2), or xz (.xz) 
+    are decompressed while they are read.
     
     Parameters
     ----------
-    filestream : file object        
-        A file object that contains an open data file.
+    filepath : str        
+        String path to the data file.
+    as_datetime : bool
+        Return dates as datetime objects instead of datetime64 values.
+    use_cache : bool
+        Load the parsed data from a binary cache if the file has not changed
+        since it was cached; otherwise parse the file and cache it.
                 
     Returns
     -------
-    data : dictionary     
-        Returns a dictionary containing data found in data file. 
+    data : NwisDataset     
+        Returns a dataset containing data found in data file. 
 
+    Raises
+    ------
+    ValueError
+        If the data file contains data for more than one site.
 
     See Also
     --------
     read_file_in : Read data file object           
+    read_sites : Read a data file containing data for one or more sites
+    read_cache : Read a cached data file
+    """    
+    sites = read_sites(filepath, as_datetime = as_datetime, use_cache = use_cache)
+    
+    if len(sites) > 1:
+        raise ValueError("{} contains data for {} sites; read it with read_sites()".format(filepath, len(sites)))
+        
+    return sites.values()[0]
+
+def read_sites(filepath, as_datetime = False, use_cache = False):
+    """    
+    Open NWIS file containing data for one or more sites, such as a response 
+    to a web service request for several sites, and create a file object for 
+    read_sites_in(filestream) to process. Only files with data for a single 
+    site are cached.
+    
+    Parameters
+    ----------
+    filepath : str        
+        String path to the data file.
+    as_datetime : bool
+        Return dates as datetime objects instead of datetime64 values.
+    use_cache : bool
+        Load the parsed data from a binary cache if the file has not changed
+        since it was cached; otherwise parse the file and cache it.
+                
+    Returns
+    -------
+    sites : OrderedDict
+        Ordered dictionary of site numbers and datasets containing the data 
+        found in data file for each site; in the order the sites are found.
+
+    See Also
+    --------
+    read_sites_in : Read data file object           
+    """    
+    sites = None
+    if use_cache:
+        data = read_cache(filepath)
+        if data is not None:
+            sites = collections.OrderedDict([(data["site_no"], data)])
+        
+    if sites is None:
+        with nwispy_helpers.open_file(filepath, "r") as f:
+            sites = read_sites_in(f)
+            
+        if use_cache and len(sites) == 1:
+            write_cache(filepath, sites.values()[0])
+
+    if as_datetime:
+        for data in sites.values():
+            data["dates"] = nwispy_helpers.to_datetime(data["dates"])
+        
+    return sites
+
+def get_cache_paths(filepath):
+    """    
+    Get the paths of the binary cache files of a data file. The cache files are
+    placed in a directory named CACHE_DIRECTORY next to the data file.
+    
+    Parameters
+    ----------
+    filepath : str
+        String path to data file.
+                
+    Returns
+    -------
+    cache_paths : dictionary     
+        Dictionary of string paths to the "metadata" (json), "dates" (npy), 
+        "values" (npy), "tz_cd" (npy), and "qualifiers" (npy) cache files.
+    """
+    filedir, filename = nwispy_helpers.get_file_info(filepath)
+    cache_dir = os.path.join(filedir, CACHE_DIRECTORY)
+    
+    cache_paths = {
+        "metadata": os.path.join(cache_dir, filename + ".json"),
+        "dates": os.path.join(cache_dir, filename + ".dates.npy"),
+        "values": os.path.join(cache_dir, filename + ".values.npy"),
+        "tz_cd": os.path.join(cache_dir, filename + ".tz_cd.npy"),
+        "qualifiers": os.path.join(cache_dir, filename + ".qualifiers.npy")
+    }
+    
+    return cache_paths
+    
+def _get_file_key(filepath):
+    """ Return the key identifying the current contents of a file; its absolute path, size, and modification time """
+    
+    stat = os.stat(filepath)
+    
+    return {"path": os.path.abspath(filepath), "size": stat.st_size, "mtime": stat.st_mtime}
+
+def read_cache(filepath):
     """    
-    with open(filepath, "r") as f:
-        data = read_file_in(f)
+    Read the cached parsed data of a data file. The dates and values arrays 
+    are memory mapped copy-on-write, so they are loaded from disk without 
+    copying as they are used, and changing them changes only the dataset in 
+    memory, not the cache. The cache is only used if the data file's path, size, and 
+    modification time match those stored in the cache.
+    
+    Parameters
+    ----------
+    filepath : str
+        String path to data file.
+                
+    Returns
+    -------
+    data : {NwisDataset, None}     
+        Returns a dataset containing data found in data file, or None if the 
+        file is not cached or the cache is out of date.
+    """
+    cache_paths = get_cache_paths(filepath)
+    
+    try:
+        with open(cache_paths["metadata"], "r") as f:
+            metadata = json.load(f)
+            
+        if metadata["version"] != CACHE_VERSION or metadata["file"] != _get_file_key(filepath):
+            return None
+        
+        dates = np.load(cache_paths["dates"], mmap_mode = "c")
+        values = np.load(cache_paths["values"], mmap_mode = "c")
+
+        tz_cd = None
+        if metadata["tz_cd_categories"] is not None:
+            tz_cd = {"codes": np.load(cache_paths["tz_cd"], mmap_mode = "c"), "categories": metadata["tz_cd_categories"]}
+        
+        # the qualification codes of the parameters that have them are the columns of one array
+        qualifier_codes = None
+        if any(parameter["qualifier_categories"] is not None for parameter in metadata["parameters"]):
+            qualifier_codes = np.load(cache_paths["qualifiers"], mmap_mode = "c")
+            
+        column = 0
+        for parameter in metadata["parameters"]:
+            parameter["qualifiers"] = None
+            if parameter["qualifier_categories"] is not None:
+                parameter["qualifiers"] = {"codes": qualifier_codes[:, column], "categories": parameter["qualifier_categories"]}
+                column += 1
+        
+    except (IOError, OSError, ValueError, KeyError) as error:
+        logging.debug("Cache of {} not used: {}".format(filepath, error))
+        return None
+
+    data = nwispy_dataset.NwisDataset(dates = dates, 
+                                      values = values, 
+                                      parameters = metadata["parameters"],
+                                      date_retrieved = metadata["date_retrieved"],
+                                      gage_name = metadata["gage_name"],
+                                      site_no = metadata["site_no"],
+                                      column_names = metadata["column_names"],
+                                      timestep = metadata["timestep"],
+                                      step = np.timedelta64(metadata["step"], "m") if metadata["step"] is not None else None,
+                                      gaps = {"start": np.array(metadata["gaps"]["start"], dtype = np.int64).astype("datetime64[m]"),
+                                              "end": np.array(metadata["gaps"]["end"], dtype = np.int64).astype("datetime64[m]"),
+                                              "missing": np.array(metadata["gaps"]["missing"], dtype = np.int64)},
+                                      tz_cd = tz_cd,
+                                      qualification_codes = collections.OrderedDict(metadata["qualification_codes"]))
+    
+    for parameter, cached_parameter in zip(data["parameters"], metadata["parameters"]):
+        parameter["mean"] = cached_parameter["mean"]
+        parameter["max"] = cached_parameter["max"]
+        parameter["min"] = cached_parameter["min"]
         
     return data
 
-def read_file_in(filestream):
+def write_cache(filepath, data):
+    """    
+    Write the parsed data of a data file to binary cache files; the dates and 
+    values arrays are saved in numpy .npy format and the remaining 
+    information in a json metadata file. The metadata file is written last, 
+    so an interrupted write leaves an out of date cache that is ignored.
+    
+    Parameters
+    ----------
+    filepath : str
+        String path to data file.
+    data : NwisDataset
+        Dataset containing data found in data file. 
+    """
+    cache_paths = get_cache_paths(filepath)
+    
+    metadata = {
+        "version": CACHE_VERSION,
+        "file": _get_file_key(filepath),
+        "date_retrieved": data["date_retrieved"],
+        "gage_name": data["gage_name"],
+        "site_no": data["site_no"],
+        "column_names": data["column_names"],
+        "timestep": data["timestep"],
+        "step": int(data["step"] / np.timedelta64(1, "m")) if data["step"] is not None else None,
+        "gaps": {key: data["gaps"][key].astype(np.int64).tolist() for key in ["start", "end", "missing"]},
+        "tz_cd_categories": None,
+        "qualification_codes": data["qualification_codes"].items(),
+        "parameters": []
+    }
+
+    if data["tz_cd"]:
+        metadata["tz_cd_categories"] = data["tz_cd"]["categories"]
+    
+    for parameter in data["parameters"]:
+        metadata["parameters"].append({"code": parameter["code"], "description": parameter["description"], "index": parameter["index"],
+                                       "mean": parameter["mean"], "max": parameter["max"], "min": parameter["min"],
+                                       "qualifier_categories": parameter["qualifiers"]["categories"] if parameter["qualifiers"] else None})
+
+    qualifier_codes = [parameter["qualifiers"]["codes"] for parameter in data["parameters"] if parameter["qualifiers"]]
+
+    try:
+        nwispy_helpers.make_directory(path = os.path.dirname(cache_paths["metadata"]), directory_name = "")
+        
+        np.save(cache_paths["dates"], nwispy_helpers.to_datetime64(data["dates"]))
+        np.save(cache_paths["values"], data["values"])
+        
+        if data["tz_cd"]:
+            np.save(cache_paths["tz_cd"], data["tz_cd"]["codes"])
+            
+        if qualifier_codes:
+            np.save(cache_paths["qualifiers"], np.column_stack(qualifier_codes).astype(np.result_type(*qualifier_codes), order = "F"))
+
+        with open(cache_paths["metadata"], "w") as f:
+            json.dump(metadata, f)
+            
+    except (IOError, OSError) as error:
+        logging.warn("*Cache error* Could not cache {}: {}".format(filepath, error))
+
+def read_file_in(filestream, as_datetime = False):
     """    
     Read and process an USGS NWIS data file. Find all parameters and their respective data. 
     Missing data values are replaced with a NAN value. A dictionary is returned
@@ -58,11 +311,20 @@ def read_file_in(filestream):
     ----------
     filestream : file object
         A python file object that contains an open data file.
+    as_datetime : bool
+        Return dates as an array of datetime objects instead of an array of 
+        datetime64 values (minute resolution).
         
     Returns
     -------
-    data : dictionary 
-        Returns a dictionary containing data found in data file. 
+    data : NwisDataset 
+        Returns a dataset containing data found in data file. The dataset can
+        be accessed like a dictionary (see nwispy_dataset.NwisDataset).
+
+    Raises
+    ------
+    ValueError
+        If the data file contains data for more than one site.
 
     Notes
     -----
@@ -72,17 +334,37 @@ def read_file_in(filestream):
         
         "gage_name": None,
         
+        "site_no": None,
+        
         "column_names": None,
         
         "parameters": [],
         
         "dates": [],
         
-        "timestep": None   
+        "timestep": None,
+        
+        "step": None,
+        
+        "gaps": None,
+        
+        "tz_cd": None,
+        
+        "qualification_codes": {}
     }      
+    
+    The "dates" key contains a datetime64[m] array (or an array of datetime objects if
+    as_datetime is True). The "tz_cd" key contains the time zone column of an 
+    instantaneous file as a categorical dictionary (see nwispy_helpers.encode_categorical);
+    it is None for daily files. The "timestep" is found from the most common interval 
+    between dates; "step" is that interval if every interval is the same (see 
+    NwisDataset.get_slice) and "gaps" reports the intervals that are longer (see 
+    nwispy_helpers.find_timestep). The "qualification_codes" key contains the data-value 
+    qualification codes described in the header of the data file and their descriptions.
             
-    The "parameters" key in the data dictionary contains a list of dictionaries containing
-    the parameters found in the data file. For example:
+    The "parameters" key in the dataset contains a list of parameters found in the data 
+    file that can be accessed like dictionaries; each parameter's data is a view of a 
+    column of the dataset's shared 2-D "values" array. For example:
     
     parameters[0] = {
     
@@ -94,6 +376,8 @@ def read_file_in(filestream):
         
         "data": numpy array of data values,
         
+        "qualifiers": categorical dictionary of the qualification codes of the data values or None,
+        
         "mean": mean of data values,
         
         "max": max of data values,
@@ -101,95 +385,501 @@ def read_file_in(filestream):
         "min": min of data values
     }         
     """  
-    data_file = filestream.readlines()
-
-    # regular expression patterns in data file 
-    # column_names and data_row patterns have 5 groups which is used to 
-    # distinguish a daily file from an instanteous file; if 4th group is None, 
-    # then data file is daily, otherwise it is an instantaneous file.
-    patterns = {
-        "date_retrieved": "(.+): ([0-9]{4}-[0-9]{2}-[0-9]{2}\s[0-9]{2}:[0-9]{2}:[0-9]{2})(.+)",  
-        "gage_name": "(#.+)(USGS [0-9]+\s.+)",
-        "parameters": "(#)\D+([0-9]{2})\D+([0-9]{5})(\D+[0-9]{5})?(.+)",
-        "column_names": "(agency_cd)\t(site_no)\t(datetime)\t(tz_cd)?(.+)",
-        "data_row": "(USGS)\t([0-9]+)\t([0-9]{4}-[0-9]{1,2}-[0-9]{1,2})\s?([0-9]{2}:[0-9]{2}\t[A-Z]{3})?(.+)"
-    }    
+    sites = read_sites_in(filestream = filestream, as_datetime = as_datetime)
     
-    # initialize a dictionary to hold all the data of interest
-    data = {
+    if len(sites) > 1:
+        raise ValueError("Data file contains data for {} sites; read it with read_sites_in()".format(len(sites)))
+        
+    return sites.values()[0]
+
+def read_sites_in(filestream, as_datetime = False):
+    """    
+    Read and process an USGS NWIS data file containing data for one or more 
+    sites in a single pass. Each site has its own header block and column 
+    layout; the data of each site is collected into its own dataset as soon 
+    as the next site begins, so only one site is held as chunks at a time.
+    
+    Parameters
+    ----------
+    filestream : file object
+        A python file object that contains an open data file.
+    as_datetime : bool
+        Return dates as an array of datetime objects instead of an array of 
+        datetime64 values (minute resolution).
+        
+    Returns
+    -------
+    sites : OrderedDict
+        Ordered dictionary of site numbers and datasets containing the data 
+        found in data file for each site (see read_file_in); in the order the 
+        sites are found. Contains at least one dataset.
+    """  
+    sites = collections.OrderedDict()
+    
+    site_chunks = []
+    for chunk in read_chunks_in(filestream = filestream):
+        if site_chunks and chunk["site_no"] != site_chunks[0]["site_no"]:
+            data = _create_dataset(chunks = site_chunks, as_datetime = as_datetime)
+            sites[data["site_no"]] = data
+            site_chunks = []
+            
+        site_chunks.append(chunk)
+        
+    data = _create_dataset(chunks = site_chunks, as_datetime = as_datetime)
+    sites[data["site_no"]] = data
+    
+    return sites
+
+def _create_dataset(chunks, as_datetime = False):
+    """    
+    Create a dataset from the chunks of a site for read_sites_in(). The header 
+    information is the same in every chunk of a site.
+    
+    Parameters
+    ----------
+    chunks : list of dictionaries
+        List of chunk dictionaries of a site (see read_chunks_in).
+    as_datetime : bool
+        Return dates as an array of datetime objects.
+        
+    Returns
+    -------
+    data : NwisDataset 
+        Dataset containing the data of the site.
+    """  
+    # join the dates and float values of each chunk 
+    if len(chunks) == 1:
+        dates, tz_cd, values = chunks[0]["dates"], chunks[0]["tz_cd"], chunks[0]["values"]
+        
+    else:
+        dates = np.concatenate([chunk["dates"] for chunk in chunks])
+        
+        tz_cd = None
+        if chunks[0]["tz_cd"] is not None:
+            tz_cd = nwispy_helpers.concatenate_categorical([chunk["tz_cd"] for chunk in chunks])
+        
+        values = np.empty((len(dates), len(chunks[0]["parameters"])), order = "F")
+        start = 0
+        for chunk in chunks:
+            values[start:start + len(chunk["dates"])] = chunk["values"]
+            start += len(chunk["dates"])
+
+        # join the qualification codes of each parameter
+        for i, parameter in enumerate(chunks[-1]["parameters"]):
+            if parameter["qualifiers"] is not None:
+                parameter["qualifiers"] = nwispy_helpers.concatenate_categorical([chunk["parameters"][i]["qualifiers"] for chunk in chunks])
+
+    # create a dataset holding all the data of interest; all parameters share the values array
+    data = nwispy_dataset.NwisDataset(dates = dates, 
+                                      values = values, 
+                                      parameters = chunks[-1]["parameters"],
+                                      date_retrieved = chunks[-1]["date_retrieved"],
+                                      gage_name = chunks[-1]["gage_name"],
+                                      site_no = chunks[-1]["site_no"],
+                                      column_names = chunks[-1]["column_names"],
+                                      tz_cd = tz_cd,
+                                      qualification_codes = chunks[-1]["qualification_codes"])
+
+    # find timestep from all the dates; a file with less than two dates is instantaneous if it has a time zone column
+    timestep = nwispy_helpers.find_timestep(dates = data["dates"])
+    
+    if timestep["step"] is not None:
+        is_daily = timestep["step"] == np.timedelta64(1, "D")
+    else:
+        is_daily = tz_cd is None
+        
+    data["timestep"] = "daily" if is_daily else "instantaneous"
+    data["step"] = timestep["step"] if timestep["regular"] else None
+    data["gaps"] = timestep["gaps"]
+    
+    # compute mean, max, and min of each parameter by merging the statistics of each chunk
+    stats = chunks[0]["stats"]
+    for chunk in chunks[1:]:
+        stats = nwispy_stats.merge_stats(stats, chunk["stats"])
+        
+    for i, parameter in enumerate(data["parameters"]):
+        if stats["count"][i] == 0:
+            logging.warn("*Bad data* All values are NaN. Please check data")
+            raise ValueError("All values of parameter {} are NaN".format(parameter["code"]))
+        
+        parameter["mean"] = stats["mean"][i]
+        parameter["max"] = stats["max"][i]
+        parameter["min"] = stats["min"][i]
+
+    if as_datetime:
+        data["dates"] = nwispy_helpers.to_datetime(data["dates"])
+
+    return data
+
+def read_chunks_in(filestream, chunk_size = 50000):
+    """    
+    Lazily read and process an USGS NWIS data file in chunks of data rows. The 
+    file is iterated line by line and never held in memory as a whole, so long 
+    records can be processed with bounded memory. Works with any file object 
+    that can be iterated over, including sys.stdin. The header information of 
+    a site, such as its column names, is reset at the header block of each new
+    site, and a chunk never holds the data rows of more than one site.
+    
+    Parameters
+    ----------
+    filestream : file object
+        A python file object that contains an open data file.
+    chunk_size : int
+        Maximum number of data rows in each chunk.
+        
+    Yields
+    ------
+    chunk : dictionary 
+        A dictionary containing the header information found in the data file 
+        and the parsed data of the rows in the chunk. At least one chunk is 
+        yielded for each site, even if the site has no data rows.
+
+    Notes
+    -----
+    chunk = {
+    
+        "date_retrieved": string of date retrieved,
+        
+        "gage_name": string of gage name,
+        
+        "site_no": string of site number,
+        
+        "column_names": list of column names,
+        
+        "parameters": list of parameter dictionaries ("code", "description", "index", "data", "qualifiers"),
+        
+        "qualification_codes": ordered dictionary of qualification codes and their descriptions,
+        
+        "dates": datetime64 array of dates in the chunk,
+        
+        "tz_cd": categorical dictionary of time zone codes in the chunk or None,
+        
+        "values": 2-D array of float values; each parameter's "data" is a column of this array,
+        
+        "stats": dictionary of statistics of each column of values (see nwispy_stats.compute_stats)
+    }    
+    """
+    # initialize a dictionary to hold the header information
+    header = {
         "date_retrieved": None,
         "gage_name": None,
+        "site_no": None,
         "column_names": None,
         "parameters": [],
-        "dates": [],
-        "timestep": None
-    }      
+        "qualification_codes": collections.OrderedDict()
+    }
     
-    # process file; find matches and add to data dictionary
-    for line in data_file: 
-        match_date_retrieved = re.search(pattern = patterns["date_retrieved"], string = line)
-        match_gage_name = re.search(pattern = patterns["gage_name"], string = line)
-        match_parameters = re.search(pattern = patterns["parameters"], string = line)
-        match_column_names = re.search(pattern = patterns["column_names"], string = line)
-        match_data_row = re.search(pattern = patterns["data_row"], string = line)
-     
-        # if match is found add it to data dictionary; date is in second group of the match
-        if match_date_retrieved:
-            data["date_retrieved"] = match_date_retrieved.group(2)
-        
-        # get the gage name which is the second group in the pattern
-        if match_gage_name:
-            data["gage_name"] = match_gage_name.group(2)
-        
-        # get the parameters available in the file and create a dictionary for each parameter
-        if match_parameters:
-            code, description = get_parameter_code(match = match_parameters)  
-            
-            data["parameters"].append({"code": code, "description": description, "index": None, "data": [],
-                                       "mean": None, "max": None, "min": None
-            })
+    # gage names of all sites are listed at the top of the file
+    gage_names = {}
+    
+    # the qualification codes are listed one per line below their heading
+    in_qualification_codes = False
+    
+    # data rows are collected and parsed in bulk one chunk at a time; chunks are counted per site
+    rows = []
+    num_chunks = 0
+    
+    # process file; classify each line once and only search it with the pattern(s) that apply to it
+    for line in filestream: 
+        line_type = classify_line(line)
+
+        # data rows are by far the most common line so check them first
+        if line_type == "data_row":
+            rows.append(line.lstrip().rstrip("\r\n"))
             
-        # get the column names and indices of existing parameter(s) 
-        if match_column_names:
-            data["column_names"] = match_column_names.group(0).split("\t")
+            if len(rows) == chunk_size:
+                yield _create_chunk(header = header, rows = rows)
+                num_chunks += 1
+                rows = []
 
-            for parameter in data["parameters"]:
-                parameter["index"] = data["column_names"].index(parameter["code"])           
+        elif line_type == "comment":
+            if in_qualification_codes:
+                match_qualification_code = PATTERNS["qualification_code"].search(line)
+                if match_qualification_code:
+                    header["qualification_codes"][match_qualification_code.group(1)] = match_qualification_code.group(2)
+                    continue
+                
+                # a blank comment line ends the list of codes
+                in_qualification_codes = False
 
-         # get date and float value
-        if match_data_row:
-            date = get_date(daily = match_data_row.group(3), instantaneous = match_data_row.group(4))
-            data["dates"].append(date)
+            if PATTERNS["qualification_codes"].search(line):
+                in_qualification_codes = True
+                continue
             
-            for parameter in data["parameters"]:
-                value = match_data_row.group(0).split("\t")[parameter["index"]]
+            # the header block of a new site; finish the previous site and reset the header information of a site
+            match_site = PATTERNS["site"].search(line)
+            if match_site:
+                if header["column_names"] is not None and (rows or num_chunks == 0):
+                    yield _create_chunk(header = header, rows = rows)
                 
-                value = nwispy_helpers.convert_to_float(value = value, helper_str = "parameter {} on {}".format(parameter["code"], date.strftime("%Y-%m-%d_%H.%M")))
-                                       
-                parameter["data"].append(value)
+                rows = []
+                num_chunks = 0
+                
+                header["site_no"] = match_site.group(1)
+                header["gage_name"] = gage_names.get(header["site_no"], header["gage_name"])
+                header["column_names"] = None
+                header["parameters"] = []
+                header["qualification_codes"] = collections.OrderedDict()
+                continue
+            
+            match_date_retrieved = PATTERNS["date_retrieved"].search(line)
+            match_gage_name = PATTERNS["gage_name"].search(line)
+            match_parameters = PATTERNS["parameters"].search(line)
+         
+            # if match is found add it to header dictionary; date is in second group of the match
+            if match_date_retrieved:
+                header["date_retrieved"] = match_date_retrieved.group(2)
+            
+            # get the gage name which is the second group in the pattern
+            if match_gage_name:
+                header["gage_name"] = match_gage_name.group(2)
+                gage_names[header["gage_name"].split()[1]] = header["gage_name"]
+            
+            # get the parameters available in the file and create a dictionary for each parameter
+            if match_parameters:
+                code, description = get_parameter_code(match = match_parameters)  
+                
+                header["parameters"].append({"code": code, "description": description, "index": None})
+            
+        # get the column names and indices of existing parameter(s) 
+        elif line_type == "column_names":
+            match_column_names = PATTERNS["column_names"].search(line)
+            if match_column_names:
+                header["column_names"] = match_column_names.group(0).split("\t")
+    
+                for parameter in header["parameters"]:
+                    parameter["index"] = header["column_names"].index(parameter["code"])           
+
+    if rows or num_chunks == 0:
+        yield _create_chunk(header = header, rows = rows)
+
+def _create_chunk(header, rows):
+    """    
+    Create a chunk dictionary from the header information and a list of data 
+    rows for read_chunks_in(). 
+    
+    Parameters
+    ----------
+    header : dictionary
+        Dictionary of the header information found in the data file.
+    rows : list of str
+        List of data row strings without line endings.
+        
+    Returns
+    -------
+    chunk : dictionary
+        Dictionary containing the header information and the parsed data rows.
+    """
+    dates, tz_cd, values, qualifiers = parse_data_block(rows = rows, column_names = header["column_names"], parameters = header["parameters"])
+    
+    # files without a header block for each site take the site number from the data rows
+    site_no = header["site_no"]
+    if site_no is None and rows:
+        site_no = rows[0].split("\t")[header["column_names"].index("site_no")]
+    
+    chunk = {
+        "date_retrieved": header["date_retrieved"],
+        "gage_name": header["gage_name"],
+        "site_no": site_no,
+        "column_names": header["column_names"],
+        "qualification_codes": header["qualification_codes"],
+        "parameters": [],
+        "dates": dates,
+        "tz_cd": tz_cd,
+        "values": values,
+        "stats": nwispy_stats.compute_stats(values)
+    }
+    
+    for i, parameter in enumerate(header["parameters"]):
+        chunk["parameters"].append({"code": parameter["code"], "description": parameter["description"], "index": parameter["index"], 
+                                    "data": values[:, i], "qualifiers": qualifiers[i]})
+
+    return chunk
+
+def parse_data_block(rows, column_names, parameters):
+    """   
+    Parse the data block of an NWIS data file in bulk. The data block is a 
+    rectangular tab-delimited table, so all rows are split at once into a 2-D 
+    string array and each parameter column is converted to floats in a single 
+    vectorized step. Missing and bad values are replaced with a NAN value and 
+    logged.
     
-    # convert the date list to a numpy array
-    data["dates"] = np.array(data["dates"])    
+    Parameters
+    ----------
+    rows : list of str
+        List of data row strings without line endings.
+    column_names : list of str
+        List of column names found in the data file.
+    parameters : list of dictionaries
+        List of parameter dictionaries; the "code" and "index" keys are used.
+        
+    Returns
+    -------
+    (dates, tz_cd, values, qualifiers) : tuple
+        Tuple of a datetime64 array of dates, a categorical dictionary of time 
+        zone codes (None if there is no tz_cd column), a 2-D array of float 
+        values with a column for each parameter (column major so that each 
+        parameter is contiguous in memory), and a list with a categorical 
+        dictionary of the qualification codes of each parameter (None if the 
+        parameter has no qualification code column).
+    """
+    if column_names is None:
+        raise ValueError("No column names found in data file")
 
-    # find timestep 
-    timestep = data["dates"][1] - data["dates"][0]
-    if timestep.days == 1:
-        data["timestep"] = "daily"
+    table = split_rows(rows = rows, num_columns = len(column_names))
+
+    dates = parse_dates(date_strings = table[:, column_names.index("datetime")])
+    
+    if "tz_cd" in column_names:
+        tz_cd = nwispy_helpers.encode_categorical(table[:, column_names.index("tz_cd")])
     else:
-        data["timestep"] = "instantaneous"
+        tz_cd = None
     
-    # convert each parameter data list in data["parameter"] to a numpy array and
-    # compute mean, max, and min
-    for parameter in data["parameters"]:
-        parameter["data"] = np.array(parameter["data"])
+    values = np.empty((len(rows), len(parameters)), order = "F")
+    qualifiers = []
+    for i, parameter in enumerate(parameters):
+        values[:, i] = convert_column(column = table[:, parameter["index"]], code = parameter["code"], dates = dates)
+        
+        # the qualification codes of a parameter are in the column following its data
+        qualifier_name = parameter["code"] + "_cd"
+        if qualifier_name in column_names:
+            qualifiers.append(nwispy_helpers.encode_categorical(table[:, column_names.index(qualifier_name)]))
+        else:
+            qualifiers.append(None)
+
+    return dates, tz_cd, values, qualifiers
+
+def parse_dates(date_strings):
+    """   
+    Parse an array of date strings from the datetime column of a data file into 
+    a datetime64 array with minute resolution. The whole column is parsed at 
+    once; dates that are not zero padded (e.g. 2013-6-5) fall back to being 
+    parsed one at a time with get_date().
+    
+    Parameters
+    ----------
+    date_strings : array
+        Array of date strings; e.g. 2013-06-25 or 2013-06-25 00:15
+        
+    Returns
+    -------
+    dates : array
+        Array of datetime64[m] values.
+    """
+    try:
+        dates = date_strings.astype("datetime64[m]")
         
-        param_mean, param_max, param_min = nwispy_helpers.compute_simple_stats(data = parameter["data"])
+    except ValueError:
+        dates = []
+        for date_str in date_strings:
+            daily, _, instantaneous = date_str.partition(" ")
+            dates.append(get_date(daily = daily, instantaneous = instantaneous))
+        dates = nwispy_helpers.to_datetime64(dates)
         
-        parameter["mean"] = param_mean
-        parameter["max"] = param_max
-        parameter["min"] = param_min
+    return dates
 
-    return data
+def split_rows(rows, num_columns):
+    """   
+    Split tab-delimited data rows into a 2-D string array. All rows are joined 
+    and split with a single call; rows are only split one at a time if the 
+    table is ragged, in which case short rows are padded with empty strings.
+    
+    Parameters
+    ----------
+    rows : list of str
+        List of tab-delimited row strings.
+    num_columns : int
+        Number of columns in the table.
+        
+    Returns
+    -------
+    table : array
+        2-D array of strings with shape (number of rows, num_columns).
+    """
+    if not rows:
+        return np.empty((0, num_columns), dtype = str)
+        
+    fields = "\t".join(rows).split("\t")
+    
+    if len(fields) == len(rows) * num_columns:
+        table = np.array(fields).reshape(len(rows), num_columns)
+
+        # every row begins with an agency code; a shifted row means the table is ragged
+        if np.all(table[:, 0] == table[0, 0]):
+            return table
+
+    table = np.array([(row.split("\t") + [""] * num_columns)[:num_columns] for row in rows]).reshape(len(rows), num_columns)
+    
+    return table
+
+def convert_column(column, code, dates):
+    """   
+    Convert a column of strings to an array of floats. The whole column is 
+    converted at once. Missing and bad values are replaced with a NAN value and 
+    logged in one summary per kind of error for the parameter with their count 
+    and the dates of the first and last of them.
+    
+    Parameters
+    ----------
+    column : array
+        Array of strings.
+    code : str
+        String parameter code used in the error log.
+    dates : array
+        Array of datetime64 dates corresponding to the column used in the error log.
+        
+    Returns
+    -------
+    values : array
+        Array of float values; the missing and bad values are the nan values, 
+        so the mask of them returned by nwispy_helpers.convert_to_floats() is 
+        not kept.
+    """
+    values, _ = nwispy_helpers.convert_to_floats(values = column, helper_str = "parameter {}".format(code), dates = dates)
+    
+    return values
+
+def classify_line(line):
+    """   
+    Classify a line from an NWIS data file by checking how it starts. Lines are 
+    classified once so that each line is only searched with the regular expression 
+    pattern(s) that can apply to it; e.g. the header patterns are never tried on
+    data rows.
+    
+    Parameters
+    ----------
+    line : str
+        String line from an NWIS data file.
+        
+    Returns
+    -------
+    line_type : {"data_row", "comment", "column_names", "format_row", None}
+        String type of line; None if line is blank.
+    
+    Examples
+    --------
+    >>> import nwispy_filereader
+    >>> nwispy_filereader.classify_line("USGS\t03290500\t2012-07-01\t171\tA")
+    'data_row'
+    >>> nwispy_filereader.classify_line("# retrieved: 2013-07-02 22:08:51 EDT")
+    'comment'
+    >>> nwispy_filereader.classify_line("5s\t15s\t20d\t14n\t10s")
+    'format_row'
+    """
+    stripped = line.lstrip()
+    
+    if stripped.startswith("USGS"):
+        line_type = "data_row"
+    elif stripped.startswith("#"):
+        line_type = "comment"
+    elif stripped.startswith("agency_cd"):
+        line_type = "column_names"
+    elif stripped:
+        line_type = "format_row"
+    else:
+        line_type = None
+        
+    return line_type
 
 def get_parameter_code(match):
     """   
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+:Module: nwispy_flowduration.py
+
+:Author: Jeremiah Lant, jlant@usgs.gov, U.S. Geological Survey, Kentucky Water Science Center, http://www.usgs.gov/
+
+:Synopsis: Flow duration curves and exceedance probabilities of discharge found in U.S. Geological Survey (USGS) National Water Information System (NWIS) data files; http://waterdata.usgs.gov/nwis
+"""
+
+__author__   = "Jeremiah Lant, jlant@usgs.gov, U.S. Geological Survey, Kentucky Water Science Center."
+__copyright__ = "http://www.usgs.gov/visual-id/credit_usgs.html#copyright"
+__license__   = __copyright__
+__contact__   = __author__
+
+import numpy as np
+
+# my modules
+import nwispy_stats
+
+# parameter code of discharge, cubic feet per second
+DISCHARGE_CODE = "00060"
+
+# default exceedance probabilities (percent of time a flow is equaled or exceeded) of a flow duration table
+EXCEEDANCE_PROBABILITIES = [0.1, 1, 2, 5, 10, 20, 25, 30, 40, 50, 60, 70, 75, 80, 90, 95, 98, 99, 99.9]
+
+def is_discharge(code):
+    """
+    Return True if a parameter code is a discharge parameter code; e.g.
+    "06_00060_00003" of a daily file or "02_00060" of an instantaneous file.
+
+    Parameters
+    ----------
+    code : str
+        String parameter code.
+
+    Returns
+    -------
+    is_discharge : bool
+    """
+    return DISCHARGE_CODE in code.split("_")
+
+def compute_exceedance_curve(values):
+    """
+    Compute the flow duration curve of an array of flows; the flows in
+    descending order and the exceedance probability of each flow, the
+    percent of time that it is equaled or exceeded. Probabilities are
+    Weibull plotting positions; the flow of rank i (largest is 1) of n flows
+    is exceeded 100 * i / (n + 1) percent of the time.
+
+    Parameters
+    ----------
+    values : array
+        1-D array of flows; nan values are ignored.
+
+    Returns
+    -------
+    curve : dictionary
+        Dictionary of the "flows" in descending order and their exceedance
+        "probabilities" in percent.
+
+    Examples
+    --------
+    >>> import nwispy_flowduration
+    >>> curve = nwispy_flowduration.compute_exceedance_curve([1.0, 4.0, 2.0])
+    >>> curve["flows"], curve["probabilities"]
+    (array([4., 2., 1.]), array([25., 50., 75.]))
+    """
+    values = np.asarray(values, dtype = np.float64)
+    values = values[~np.isnan(values)]
+
+    flows = np.sort(values)[::-1]
+    probabilities = 100.0 * np.arange(1, len(flows) + 1) / (len(flows) + 1)
+
+    return {"flows": flows, "probabilities": probabilities}
+
+def compute_flow_duration(values, probabilities = None):
+    """
+    Compute the flows equaled or exceeded a percent of the time (a flow
+    duration table) for all requested exceedance probabilities. Each column
+    of values is sorted once and the flows of all probabilities are then
+    interpolated between the Weibull plotting positions (see
+    compute_exceedance_curve) in one step; flows beyond the first or last
+    plotting position are the largest or smallest flow.
+
+    Parameters
+    ----------
+    values : array
+        1-D array of flows or 2-D array with a column of flows for each
+        parameter or gage (e.g. flows of several files padded with nan
+        values); nan values are ignored.
+    probabilities : list of float
+        List of exceedance probabilities in percent; default is
+        EXCEEDANCE_PROBABILITIES.
+
+    Returns
+    -------
+    flow_duration : dictionary
+        Dictionary of the exceedance "probabilities", the "flows" of each
+        probability (an array with a row for each probability and a column
+        for each column of a 2-D array of values; nan for columns without
+        flows), and the "count" of flows of each column.
+
+    Examples
+    --------
+    >>> import nwispy_flowduration
+    >>> import numpy as np
+    >>> flow_duration = nwispy_flowduration.compute_flow_duration(np.arange(1.0, 100.0), probabilities = [10, 50, 90])
+    >>> flow_duration["flows"]
+    array([90., 50., 10.])
+    """
+    probabilities = np.asarray(probabilities if probabilities is not None else EXCEEDANCE_PROBABILITIES, dtype = np.float64)
+
+    values = np.asarray(values, dtype = np.float64)
+    is_1d = values.ndim == 1
+    if is_1d:
+        values = values[:, np.newaxis]
+
+    # nan values sort last in each column
+    values = np.sort(values, axis = 0)
+    count = np.sum(~np.isnan(values), axis = 0)
+
+    # each column is a segment of flows that starts at the first row
+    num_columns = values.shape[1]
+    flows = _interpolate_flows(values, np.zeros(num_columns, dtype = np.int64), np.arange(num_columns), count, probabilities)
+
+    if is_1d:
+        flows, count = flows[:, 0], count[0]
+
+    return {"probabilities": probabilities, "flows": flows, "count": count}
+
+def compute_flow_duration_by(dates, values, by = "month", probabilities = None):
+    """
+    Compute a flow duration table of each group of dates; e.g. of each
+    calendar month or of each water year. The flows of a column are sorted
+    once, and then stable sorted by group so that the flows of every group
+    are in order; the flows of all groups and probabilities are then
+    interpolated in one step.
+
+    Parameters
+    ----------
+    dates : array
+        Array of datetime64 values (or datetime objects).
+    values : array
+        1-D array of flows or 2-D array with a column of flows for each
+        parameter; nan values are ignored.
+    by : {"month", "season", "day_of_year", "year", "water_year", "climatic_year", "year_month"}
+        String group of dates (see nwispy_stats.get_group_keys).
+    probabilities : list of float
+        List of exceedance probabilities in percent; default is
+        EXCEEDANCE_PROBABILITIES.
+
+    Returns
+    -------
+    flow_duration : dictionary
+        Dictionary of the group "keys", the exceedance "probabilities", the
+        "flows" of each group and probability (an array with a row for each
+        group, a column for each probability, and a third axis for each
+        column of a 2-D array of values), and the "count" of flows of each
+        group.
+    """
+    probabilities = np.asarray(probabilities if probabilities is not None else EXCEEDANCE_PROBABILITIES, dtype = np.float64)
+
+    values = np.asarray(values, dtype = np.float64)
+    is_1d = values.ndim == 1
+    if is_1d:
+        values = values[:, np.newaxis]
+
+    if len(dates) != len(values):
+        raise ValueError("Lengths of dates and values are not equal!")
+
+    keys = nwispy_stats.get_group_keys(dates, by = by)
+    group_keys, starts = np.unique(np.sort(keys, kind = "mergesort"), return_index = True)
+
+    num_groups, num_columns = len(group_keys), values.shape[1]
+    flows = np.full((num_groups, len(probabilities), num_columns), np.nan)
+    count = np.zeros((num_groups, num_columns), dtype = np.int64)
+
+    for i in range(num_columns):
+        # sort the flows, then stable sort them by group so that they are sorted within each group; nan values sort last
+        order = np.argsort(values[:, i])
+        order = order[np.argsort(keys[order], kind = "mergesort")]
+        column = values[order, i]
+
+        count[:, i] = np.add.reduceat(~np.isnan(column), starts, dtype = np.int64) if num_groups > 0 else 0
+        flows[:, :, i] = _interpolate_flows(column[:, np.newaxis], starts, np.zeros(num_groups, dtype = np.int64), count[:, i], probabilities).T
+
+    if by == "year_month":
+        group_keys = group_keys.astype("datetime64[M]")
+
+    if is_1d:
+        flows, count = flows[:, :, 0], count[:, 0]
+
+    return {"by": by, "keys": group_keys, "probabilities": probabilities, "flows": flows, "count": count}
+
+def compute_flow_durations(datasets, probabilities = None):
+    """
+    Compute the flow duration tables of the discharge parameters of many
+    datasets (e.g. of a network of gages) at once. The discharge of all
+    datasets is padded with nan values into a single 2-D array so that the
+    tables of every gage are computed with one sort and one interpolation.
+
+    Parameters
+    ----------
+    datasets : list of NwisDataset
+        List of datasets; e.g. from nwispy_filereader.read_file() or
+        nwispy_filereader.read_sites().
+    probabilities : list of float
+        List of exceedance probabilities in percent; default is
+        EXCEEDANCE_PROBABILITIES.
+
+    Returns
+    -------
+    flow_durations : dictionary
+        Dictionary of the "site_no", "gage_name", and "code" of each
+        discharge parameter, the exceedance "probabilities", the "flows" of
+        each probability (an array with a row for each probability and a
+        column for each discharge parameter), and the "count" of flows of
+        each discharge parameter.
+    """
+    columns = {"site_no": [], "gage_name": [], "code": [], "data": []}
+    for dataset in datasets:
+        for parameter in dataset["parameters"]:
+            if is_discharge(parameter["code"]):
+                columns["site_no"].append(dataset.get("site_no"))
+                columns["gage_name"].append(dataset.get("gage_name"))
+                columns["code"].append(parameter["code"])
+                columns["data"].append(parameter["data"])
+
+    num_rows = max([len(data) for data in columns["data"]] + [0])
+    values = np.full((num_rows, len(columns["data"])), np.nan)
+    for i, data in enumerate(columns["data"]):
+        values[:len(data), i] = data
+
+    flow_duration = compute_flow_duration(values, probabilities = probabilities)
+    flow_duration.update({key: columns[key] for key in ["site_no", "gage_name", "code"]})
+
+    return flow_duration
+
+def _interpolate_flows(values, starts, columns, count, probabilities):
+    """ Interpolate the flows of exceedance probabilities of segments of ascending sorted flows; each segment starts at a row of a column of values """
+
+    flows = np.full((len(probabilities), len(count)), np.nan)
+
+    has_flows = count > 0
+    if not np.any(has_flows):
+        return flows
+
+    starts, columns, count = starts[has_flows], columns[has_flows], count[has_flows]
+
+    # descending rank (1 is the largest) of each probability in each segment; clamped to the ranks of the flows
+    ranks = np.clip(probabilities[:, np.newaxis] / 100.0 * (count + 1), 1, count)
+
+    # position of the rank in the ascending sorted segment
+    positions = count - ranks
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.ceil(positions).astype(np.int64)
+
+    lower_flows = values[starts + lower, columns]
+    upper_flows = values[starts + upper, columns]
+
+    flows[:, has_flows] = lower_flows + (upper_flows - lower_flows) * (positions - lower)
+
+    return flows
+
+
+def test_compute_flow_duration():
+    """ Test compute_flow_duration() and compute_flow_duration_by() """
+
+    print("--- Testing compute_flow_duration() ---")
+
+    dates = np.arange("2000-10-01", "2010-10-01", dtype = "datetime64[D]").astype("datetime64[m]")
+    values = np.exp(np.random.randn(len(dates)))
+
+    flow_duration = compute_flow_duration(values)
+    for probability, flow in zip(flow_duration["probabilities"], flow_duration["flows"]):
+        print("    {}%: {}".format(probability, flow))
+
+    print("--- Testing compute_flow_duration_by() ---")
+
+    flow_duration = compute_flow_duration_by(dates, values, by = "month", probabilities = [10, 50, 90])
+    for key, flows in zip(flow_duration["keys"], flow_duration["flows"]):
+        print("    month {}: {}".format(key, flows))
+    print("")
+
+def main():
+    """ Test functionality of flow duration """
+
+    test_compute_flow_duration()
+
+if __name__ == "__main__":
+    main()
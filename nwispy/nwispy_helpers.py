@@ -13,11 +13,46 @@ __license__   = __copyright__
 __contact__   = __author__
 
 import os
+import io
+import gzip
+import bz2
 import numpy as np
 import datetime
 import re
 import logging
 
+# lzma is optional; it is needed only to open .xz files
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# my modules
+import nwispy_stats
+
+# sides of a binary search (np.searchsorted) for the start and end of a date window that is closed on its left, right, both, or neither bounds
+INTERVAL_SIDES = {
+    "both": ("left", "right"),
+    "left": ("left", "left"),
+    "right": ("right", "right"),
+    "neither": ("right", "left")
+}
+
+# offsets from UTC in minutes of the time zone codes (tz_cd) found in instantaneous data files
+TIME_ZONE_OFFSETS = {
+    "UTC": 0, "GMT": 0,
+    "AST": -240, "ADT": -180,
+    "EST": -300, "EDT": -240,
+    "CST": -360, "CDT": -300,
+    "MST": -420, "MDT": -360,
+    "PST": -480, "PDT": -420,
+    "AKST": -540, "AKDT": -480,
+    "HST": -600, "HDT": -540
+}
+
 def now():
     """    
     Return current date and time in a format that can be used as a file name. 
@@ -109,6 +144,50 @@ def make_directory(path, directory_name):
     
     return directory_path
 
+def open_file(filepath, mode = "rb"):
+    """    
+    Open a file that may be compressed. Files ending in .gz, .bz2, or .xz are 
+    decompressed while they are read and compressed while they are written; other
+    files are opened as is.
+    
+    Parameters
+    ----------
+    filepath : string
+        String path to file.
+    mode : string
+        String mode to open file with; e.g. "rb" or "wb"
+      
+    Returns
+    -------
+    fileobj : file object
+        An open file object.
+        
+    Raises
+    ------
+    IOError
+        If the file ends in .xz and the lzma module is not available.
+    """    
+    if filepath.endswith(".gz"):
+        fileobj = gzip.open(filepath, mode)
+        
+        # reading lines through a buffer is several times faster than reading lines from gzip directly
+        if "r" in mode:
+            fileobj = io.BufferedReader(fileobj, buffer_size = 64 * 1024)
+            
+        return fileobj
+    
+    elif filepath.endswith(".bz2"):
+        return bz2.BZ2File(filepath, mode)
+        
+    elif filepath.endswith(".xz"):
+        if lzma is None:
+            raise IOError("The lzma module is needed to open .xz files: {0}".format(filepath))
+        
+        return lzma.open(filepath, mode)
+        
+    else:
+        return open(filepath, mode)
+
 def isfloat(value):
     """   
     Determine if string value can be converted to a float. Return True if
@@ -209,6 +288,337 @@ def convert_to_float(value, helper_str = None):
             
     return value
 
+def convert_to_floats(values, helper_str = None, dates = None):
+    """   
+    Convert an array of string values to an array of floats. The whole array is 
+    converted at once; if it contains missing or bad values, special characters 
+    are removed from each distinct value once and mapped back onto the array. 
+    Missing and bad values are replaced with nan values and logged in one summary
+    each, with their count and the dates of the first and last of them, rather
+    than one message per value.
+    
+    Parameters
+    ----------
+    values : array
+        Array of string values to convert.
+    helper_str : string
+        String message to be placed in error log if values can not be converted to floats; e.g. parameter code.
+    dates : array
+        Array of dates (datetime64 or datetime) corresponding to the values used in the error log.
+        
+    Returns
+    -------
+    floats : array
+        Array of float values with nan values for missing and bad values.
+    mask : array
+        Boolean array that is True for missing and bad values.
+    """
+    values = np.asarray(values)
+    
+    try:
+        floats = values.astype(np.float64)
+        return floats, np.zeros(len(floats), dtype = bool)
+        
+    except ValueError:
+        distinct, inverse = np.unique(values, return_inverse = True)
+        
+        # remove any special characters present in the distinct values, then convert them in bulk if possible
+        cleaned = np.array([rmspecialchars(value) for value in distinct], dtype = object)
+        try:
+            converted = cleaned.astype(np.float64)
+            is_bad = np.zeros(len(cleaned), dtype = bool)
+        except ValueError:
+            is_bad = np.array([not isfloat(value) for value in cleaned], dtype = bool)
+            converted = np.where(is_bad, "nan", cleaned).astype(np.float64)
+            
+        is_missing = is_bad & (cleaned == "")
+        
+        floats = converted[inverse]
+        mask = is_bad[inverse]
+        
+        _log_conversion_errors("*Missing value*", is_missing[inverse], helper_str, dates)
+        _log_conversion_errors("*Bad value*", (is_bad & ~is_missing)[inverse], helper_str, dates)
+        
+        return floats, mask
+
+def _log_conversion_errors(error_type, is_error, helper_str, dates):
+    """ Log one summary warning of the values that could not be converted to floats """
+    
+    indices = np.flatnonzero(is_error)
+    if len(indices) == 0:
+        return
+    
+    error_str = "{} {}: {} value(s)".format(error_type, helper_str, len(indices))
+    
+    if dates is not None:
+        first, last = to_datetime(np.asarray(dates)[[indices[0], indices[-1]]])
+        error_str += " from {:%Y-%m-%d_%H.%M} to {:%Y-%m-%d_%H.%M}".format(first, last)
+    
+    logging.warn(error_str + ". *Solution* - Replacing with NaN value")
+
+def to_datetime64(dates, unit = "m"):
+    """   
+    Convert dates to a numpy datetime64 array. Arrays that are already 
+    datetime64 with the requested unit are returned without copying them.
+    
+    Parameters
+    ----------
+    dates : {list, array}
+        List or array of datetime objects or datetime64 values.
+    unit : str
+        String datetime64 unit; default is minutes ("m").
+        
+    Returns
+    -------
+    dates : array
+        Array of datetime64 values.
+        
+    Examples
+    --------
+    >>> import nwispy_helpers
+    >>> import datetime
+    >>> nwispy_helpers.to_datetime64([datetime.datetime(2014, 3, 12, 1, 15)])
+    array(['2014-03-12T01:15'], dtype='datetime64[m]')
+    """
+    return np.asarray(dates).astype("datetime64[{}]".format(unit), copy = False)
+
+def to_datetime(dates):
+    """   
+    Convert dates to an array of datetime objects; e.g. for plotting or for 
+    callers that expect datetime objects. Arrays of datetime objects are 
+    returned as is.
+    
+    Parameters
+    ----------
+    dates : {list, array}
+        List or array of datetime64 values or datetime objects.
+        
+    Returns
+    -------
+    dates : array
+        Array of datetime objects.
+    """
+    dates = np.asarray(dates)
+    
+    if dates.dtype.kind == "M":
+        # datetime64 with a unit of a day or longer converts to date objects, so use minutes
+        dates = dates.astype("datetime64[m]").astype(datetime.datetime)
+        
+    return dates
+
+def convert_time_zone(dates, tz_cd, to_tz):
+    """   
+    Convert the local dates of an instantaneous data file, each in the time 
+    zone of its time zone code, to the dates of a single time zone. Dates 
+    recorded in daylight saving time (e.g. "EDT") and in standard time 
+    (e.g. "EST") are converted to one continuous clock, so days and hours do 
+    not shift or repeat across daylight saving time changes. The offset of 
+    each time zone code is looked up once and the dates are converted with 
+    one vectorized subtraction.
+    
+    Parameters
+    ----------
+    dates : array
+        Array of datetime64 values (or datetime objects).
+    tz_cd : dictionary
+        Categorical dictionary of the time zone code of each date.
+    to_tz : str
+        String time zone code to convert the dates to; one of TIME_ZONE_OFFSETS.
+        
+    Returns
+    -------
+    dates : array
+        Array of datetime64[m] values in the to_tz time zone.
+        
+    Examples
+    --------
+    >>> import nwispy_helpers
+    >>> import numpy as np
+    >>> dates = np.array(["2014-03-09T01:45", "2014-03-09T03:00"], dtype = "datetime64[m]")
+    >>> tz_cd = nwispy_helpers.encode_categorical(["EST", "EDT"])
+    >>> nwispy_helpers.convert_time_zone(dates, tz_cd, "EST")
+    array(['2014-03-09T01:45', '2014-03-09T02:00'], dtype='datetime64[m]')
+    """
+    unknown = [code for code in list(tz_cd["categories"]) + [to_tz] if code not in TIME_ZONE_OFFSETS]
+    if unknown:
+        raise ValueError("Unknown time zone code(s): {}".format(", ".join(unknown)))
+
+    offsets = np.array([TIME_ZONE_OFFSETS[code] for code in tz_cd["categories"]], dtype = np.int64)
+    shifts = TIME_ZONE_OFFSETS[to_tz] - offsets[np.asarray(tz_cd["codes"])]
+
+    return to_datetime64(dates) + shifts.astype("timedelta64[m]")
+
+def encode_categorical(values):
+    """   
+    Encode an array of repetitive values (e.g. time zone or qualification codes)
+    as a compact categorical array; an array of small integer codes that index 
+    into a list of the distinct values (categories).
+    
+    Parameters
+    ----------
+    values : array
+        Array of values to encode.
+        
+    Returns
+    -------
+    categorical : dictionary
+        Dictionary with "codes", an integer array, and "categories", a sorted
+        list of the distinct values such that categories[codes[i]] == values[i].
+        
+    Examples
+    --------
+    >>> import nwispy_helpers
+    >>> nwispy_helpers.encode_categorical(["EST", "EST", "EDT"])
+    {'categories': ['EDT', 'EST'], 'codes': array([1, 1, 0], dtype=int8)}
+    """
+    categories, codes = np.unique(np.asarray(values), return_inverse = True)
+    
+    if len(categories) <= np.iinfo(np.int8).max:
+        codes = codes.astype(np.int8)
+    elif len(categories) <= np.iinfo(np.int16).max:
+        codes = codes.astype(np.int16)
+
+    categorical = {"codes": codes, "categories": list(categories)}
+    
+    return categorical
+
+def concatenate_categorical(categoricals):
+    """   
+    Concatenate a list of categorical dictionaries (see encode_categorical) 
+    that may each have different categories; e.g. chunks of a data file where 
+    only later chunks contain daylight saving time zone codes.
+    
+    Parameters
+    ----------
+    categoricals : list of dictionaries
+        List of categorical dictionaries.
+        
+    Returns
+    -------
+    categorical : dictionary
+        Categorical dictionary with the union of all categories.
+    """
+    categories = sorted(set().union(*[categorical["categories"] for categorical in categoricals]))
+    
+    codes = []
+    for categorical in categoricals:
+        # map the codes of each categorical onto the combined categories
+        lookup = np.searchsorted(categories, categorical["categories"])
+        codes.append(lookup[categorical["codes"]])
+    
+    categorical = {"codes": np.concatenate(codes).astype(categoricals[0]["codes"].dtype), "categories": categories}
+    
+    if len(categories) > np.iinfo(categorical["codes"].dtype).max:
+        categorical["codes"] = np.concatenate(codes)
+    
+    return categorical
+
+def get_qualifier_mask(qualifiers, include = None, exclude = None):
+    """
+    Get a boolean mask of the values whose qualification codes match a query.
+    A value may carry several qualification codes (e.g. "A:e" or "P Ice"), so
+    each distinct category is split into its codes and tested once; the
+    per-category results are then looked up with the integer codes of the
+    categorical array in a single vectorized step.
+
+    Parameters
+    ----------
+    qualifiers : dictionary
+        Categorical dictionary of qualification codes (see encode_categorical).
+    include : list of str
+        List of qualification codes; a value is selected if it carries any of
+        them. All values are selected if None.
+    exclude : list of str
+        List of qualification codes; a value is not selected if it carries any
+        of them.
+
+    Returns
+    -------
+    mask : array
+        Boolean array that is True for each selected value.
+
+    Examples
+    --------
+    >>> import nwispy_helpers
+    >>> qualifiers = nwispy_helpers.encode_categorical(["A", "A:e", "P", "P:e"])
+    >>> nwispy_helpers.get_qualifier_mask(qualifiers, include = ["A"])
+    array([ True,  True, False, False], dtype=bool)
+    >>> nwispy_helpers.get_qualifier_mask(qualifiers, exclude = ["e"])
+    array([ True, False,  True, False], dtype=bool)
+    """
+    lookup = np.ones(len(qualifiers["categories"]), dtype = bool)
+
+    for i, category in enumerate(qualifiers["categories"]):
+        codes = set(re.split("[:,\s]+", category.strip()))
+
+        if include is not None and codes.isdisjoint(include):
+            lookup[i] = False
+
+        if exclude is not None and not codes.isdisjoint(exclude):
+            lookup[i] = False
+
+    mask = lookup[qualifiers["codes"]]
+
+    return mask
+
+def find_timestep(dates):
+    """
+    Find the timestep of an array of dates from all of its intervals rather
+    than from its first two dates. The timestep is the most common (modal)
+    interval between consecutive dates; intervals longer than the timestep are
+    gaps in the dates. The dates are regular if every interval is the timestep.
+
+    Parameters
+    ----------
+    dates : array
+        Sorted array of datetime64 values (or datetime objects).
+
+    Returns
+    -------
+    timestep : dictionary
+        Dictionary with "step", a timedelta64[m] of the modal interval (None if
+        there are fewer than two dates), "regular", True if every interval is
+        the step, and "gaps", a dictionary of arrays with the date before
+        ("start") and after ("end") each gap and the number of timesteps
+        missing in each gap ("missing").
+
+    Examples
+    --------
+    >>> import nwispy_helpers
+    >>> import numpy as np
+    >>> dates = np.array(["2014-01-01", "2014-01-02", "2014-01-05"], dtype = "datetime64[m]")
+    >>> timestep = nwispy_helpers.find_timestep(dates)
+    >>> timestep["step"], timestep["regular"], timestep["gaps"]["missing"]
+    (numpy.timedelta64(1440,'m'), False, array([2]))
+    """
+    dates = to_datetime64(dates)
+
+    timestep = {
+        "step": None,
+        "regular": False,
+        "gaps": {"start": dates[:0], "end": dates[:0], "missing": np.zeros(0, dtype = np.int64)}
+    }
+
+    intervals = np.diff(dates)
+    intervals = intervals[intervals > np.timedelta64(0, "m")]
+
+    if len(intervals) == 0:
+        return timestep
+
+    steps, counts = np.unique(intervals, return_counts = True)
+    step = steps[np.argmax(counts)]
+
+    intervals = np.diff(dates)
+    is_gap = intervals > step
+
+    timestep["step"] = step
+    timestep["regular"] = bool(np.all(intervals == step))
+    timestep["gaps"]["start"] = dates[:-1][is_gap]
+    timestep["gaps"]["end"] = dates[1:][is_gap]
+    timestep["gaps"]["missing"] = intervals[is_gap].astype(np.int64) // step.astype(np.int64) - 1
+
+    return timestep
+
 def create_monthly_dict():
     """
     Create a dictionary containing monthly keys and empty lists as initial values
@@ -247,6 +657,7 @@ def compute_simple_stats(data):
     """   
     Compute simple statistics (mean, max, min) on a data array. Can handle nan values.
     If the entire data array consists of only nan values, then log the error and raise a ValueError.
+    The statistics are computed with nwispy_stats.compute_stats().
     
     Parameters
     ----------
@@ -273,13 +684,11 @@ def compute_simple_stats(data):
     >>> watertxt.compute_simple_stats([2, np.nan, 6, 1])
     (3.0, 6.0, 1.0)
     """    
+    stats = nwispy_stats.compute_stats(np.ravel(data))
+    
     # check if all values are nan
-    if not np.isnan(data).all():
-        param_mean = np.nanmean(data)
-        param_max = np.nanmax(data)
-        param_min = np.nanmin(data)
-        
-        return param_mean, param_max, param_min
+    if stats["count"] > 0:
+        return stats["mean"], stats["max"], stats["min"]
     else:
         error_str = "*Bad data* All values are NaN. Please check data"
         logging.warn(error_str)
@@ -287,23 +696,127 @@ def compute_simple_stats(data):
         raise ValueError
 
     
-def subset_data(dates, values, start_date, end_date):
+def find_date_indices(dates, start_dates = None, end_dates = None, closed = "both"):
+    """   
+    Find the start and end indices of one or more date windows in a sorted 
+    array of dates with a binary search, so that dates[start:end] holds the 
+    dates of each window. The window bounds do not need to be dates in the 
+    array. The dates must be sorted in non-decreasing order (repeated dates
+    are fine); the local dates of an instantaneous data file are not sorted 
+    where the hour after clocks fall back repeats, so convert them to a single 
+    time zone with convert_time_zone() first.
+            
+    Parameters 
+    ----------
+    dates : array 
+        Sorted (non-decreasing) array of datetime64 values or datetime objects.
+    start_dates : {datetime, datetime64, array}
+        Start date of a window or an array of start dates of many windows; 
+        windows start at the first date if None.
+    end_dates : {datetime, datetime64, array}
+        End date of a window or an array of end dates of many windows; windows
+        end at the last date if None.
+    closed : {"both", "left", "right", "neither"}
+        String of which bounds of the windows are included in the windows.
+        
+    Returns
+    -------
+    (start_indices, end_indices) : tuple 
+        Tuple of the start and end index of the window or arrays of the start 
+        and end indices of the windows.
+
+    Examples
+    --------
+    >>> import nwispy_helpers
+    >>> import numpy as np
+    >>> dates = np.array(["2014-01-01", "2014-01-02", "2014-01-03", "2014-01-04"], dtype = "datetime64[m]")
+    >>> nwispy_helpers.find_date_indices(dates, "2014-01-01T12:00", "2014-01-03")
+    (1, 3)
+    >>> nwispy_helpers.find_date_indices(dates, ["2014-01-01", "2014-01-03"], ["2014-01-02", "2014-01-04"], closed = "left")
+    (array([0, 2]), array([1, 3]))
+    """ 
+    if closed not in INTERVAL_SIDES:
+        raise ValueError("closed must be one of {}".format(", ".join(sorted(INTERVAL_SIDES))))
+        
+    start_side, end_side = INTERVAL_SIDES[closed]
+    
+    dates = to_datetime64(dates)
+    
+    start_indices = 0
+    if start_dates is not None:
+        start_indices = np.searchsorted(dates, to_datetime64(start_dates), side = start_side)
+        
+    end_indices = len(dates)
+    if end_dates is not None:
+        end_indices = np.searchsorted(dates, to_datetime64(end_dates), side = end_side)
+        
+    # an empty window ends where it starts
+    end_indices = np.maximum(start_indices, end_indices)
+    
+    if np.ndim(end_indices) == 0:
+        return int(start_indices), int(end_indices)
+        
+    return tuple(np.broadcast_arrays(start_indices, end_indices))
+
+def subset_windows(dates, values, start_dates, end_dates, closed = "both"):
+    """   
+    Subset the dates and values arrays to each of many date windows in one 
+    call. The subsets are views of the arrays rather than copies.
+            
+    Parameters 
+    ----------
+    dates : array 
+        Sorted array of datetime64 values or datetime objects.
+    values : array
+        Array of numbers; the first axis matches the dates.
+    start_dates : array
+        Array of start dates of the windows.
+    end_dates : array
+        Array of end dates of the windows.
+    closed : {"both", "left", "right", "neither"}
+        String of which bounds of the windows are included in the windows.
+        
+    Returns
+    -------
+    subsets : list of tuples
+        List of tuples of arrays of dates and values of each window.
+        
+    See Also
+    --------
+    find_date_indices : Find the indices of date windows
+    """ 
+    if len(dates) != len(values):
+        raise ValueError("Lengths of dates and values are not equal!")
+
+    start_indices, end_indices = find_date_indices(dates, start_dates = np.atleast_1d(start_dates), end_dates = np.atleast_1d(end_dates), closed = closed)
+    
+    subsets = [(dates[start:end], values[start:end]) for start, end in zip(start_indices, end_indices)]
+    
+    return subsets
+
+def subset_data(dates, values, start_date, end_date, closed = "both"):
     """   
     Subset the dates and values arrays to match the range of the start_date
     and end_date. If start_date and end_date are not within the range of dates
     specified in dates, then the start_date and end_date are set to the
-    first and last dates in the array dates.
+    first and last dates in the array dates. The start_date and end_date do 
+    not need to be dates in the array; the range is found with a binary search
+    when the dates are sorted in non-decreasing order, and with a mask of the 
+    dates in the range when they are not; e.g. the local dates of an 
+    instantaneous data file where the hour after clocks fall back repeats.
             
     Parameters 
     ----------
     dates : array 
-        Array of dates as datetime objects. 
+        Array of dates as datetime objects or datetime64 values. 
     data : array
         Array of numbers.
     start_date : datetime object
         A date as a datetime object.
     end_date : datetime object
         A date as a datetime object.
+    closed : {"both", "left", "right", "neither"}
+        String of which of start_date and end_date are included in the range.
         
     Returns
     -------
@@ -316,61 +829,188 @@ def subset_data(dates, values, start_date, end_date):
     else:
         # if start_date or end_date are not within dates, set them to the 
         # first and last elements in dates
-        if start_date < dates[0] or start_date > dates[-1]:
-            start_date = dates[0]  
+        dates64 = to_datetime64(dates)
+        start_date, end_date = np.datetime64(start_date, "m"), np.datetime64(end_date, "m")
+        
+        is_sorted = np.all(dates64[1:] >= dates64[:-1])
+        first_date, last_date = (dates64[0], dates64[-1]) if is_sorted else (dates64.min(), dates64.max())
         
-        if end_date > dates[-1] or end_date < dates[0]:
-            end_date = dates[-1] 
+        if start_date < first_date or start_date > last_date:
+            start_date = first_date  
+        
+        if end_date > last_date or end_date < first_date:
+            end_date = last_date 
+
+        if not is_sorted:
+            # a binary search needs sorted dates; select the dates in the range instead
+            if closed not in INTERVAL_SIDES:
+                raise ValueError("closed must be one of {}".format(", ".join(sorted(INTERVAL_SIDES))))
+            
+            start_side, end_side = INTERVAL_SIDES[closed]
+            is_in_range = (dates64 >= start_date if start_side == "left" else dates64 > start_date) & (dates64 <= end_date if end_side == "right" else dates64 < end_date)
+            
+            return np.asarray(dates)[is_in_range], np.asarray(values)[is_in_range]
 
-        # find start and ending indices; have to convert idx from array to int to slice
-        start_idx = int(np.where(dates == start_date)[0])
-        end_idx = int(np.where(dates == end_date)[0])
+        start_idx, end_idx = find_date_indices(dates64, start_dates = start_date, end_dates = end_date, closed = closed)
         
         # subset variable and date range; 
-        date_subset = dates[start_idx:end_idx + 1] 
-        values_subset = values[start_idx:end_idx + 1] 
+        date_subset = dates[start_idx:end_idx] 
+        values_subset = values[start_idx:end_idx] 
         
         return date_subset, values_subset
 
 def find_start_end_dates(dates1, dates2):
     """  
     Find start and end dates between two different sized arrays of datetime
-    objects.
+    objects. The dates are only compared within the range where the arrays 
+    overlap, by a binary search (np.searchsorted) of the sorted dates of one 
+    array for each date of the other; no sets of dates are built.
 
     Parameters 
     ----------
     dates1 : list
-        List of datetime objects.
+        Sorted list or array of datetime objects or datetime64 values.
         
     dates2 : list 
-        List of datetime objects.
+        Sorted list or array of datetime objects or datetime64 values.
     
     Returns
     -------
     (start_date, end_date) : tuple 
-        Tuple of datetime objects.
+        Tuple of datetime objects (or datetime64 values).
+
+    Raises
+    ------
+    ValueError
+        If the arrays have no dates in common.
     """
-    # make sure that dates overlap
-    date1_set = set(dates1)    
-    date2_set = set(dates2)
-       
-    if date1_set.intersection(date2_set):
-        # pick later of two dates for start date; pick earlier of two dates for end date
-        if dates2[0] > dates1[0]: 
-            start_date = dates2[0]         
-        else:
-            start_date = dates1[0]
+    dates1_64, dates2_64 = to_datetime64(dates1), to_datetime64(dates2)
+    
+    # make sure that dates overlap; first by their end points, then by a common date within the overlap
+    if len(dates1_64) > 0 and len(dates2_64) > 0 and max(dates1_64[0], dates2_64[0]) <= min(dates1_64[-1], dates2_64[-1]):
+        start_idx1, end_idx1 = find_date_indices(dates1_64, start_dates = dates2_64[0], end_dates = dates2_64[-1])
+        start_idx2, end_idx2 = find_date_indices(dates2_64, start_dates = dates1_64[0], end_dates = dates1_64[-1])
         
-        if dates2[-1] > dates1[-1]: 
-            end_date = dates1[-1]        
-        else:
-            end_date = dates2[-1]
+        _, is_found = _search_sorted_dates(dates1_64[start_idx1:end_idx1], dates2_64[start_idx2:end_idx2])
+        
+        if is_found.any():
+            # pick later of two dates for start date; pick earlier of two dates for end date
+            if dates2_64[0] > dates1_64[0]: 
+                start_date = dates2[0]         
+            else:
+                start_date = dates1[0]
+            
+            if dates2_64[-1] > dates1_64[-1]: 
+                end_date = dates1[-1]        
+            else:
+                end_date = dates2[-1]
+    
+            return start_date, end_date
+
+    raise ValueError("No matching dates for find_start_end_dates()") 
 
-        return start_date, end_date
+def align_dates(dates_list, how = "inner"):
+    """  
+    Align several sorted arrays of dates, such as the dates of discharge, stage, 
+    and temperature records at different gages, on a common index of dates. 
+    Each array of dates is searched for the dates of the common index, so the
+    alignment takes O(n log n) time and allocates no sets.
+
+    Parameters 
+    ----------
+    dates_list : list of arrays
+        List of sorted arrays of unique datetime objects or datetime64 values.
+    how : {"inner", "outer"}
+        String join; "inner" keeps the dates found in every array and "outer" 
+        keeps the dates found in any array.
+    
+    Returns
+    -------
+    (index, indexers) : tuple 
+        Tuple of the datetime64 array of common dates and a list with an integer
+        array for each array of dates holding the position of each common date
+        in that array; -1 where an outer join date is missing from the array.
+        
+    See Also
+    --------
+    reindex_values : Reindex values to the common dates
 
+    Examples
+    --------
+    >>> import nwispy_helpers
+    >>> import numpy as np
+    >>> dates1 = np.array(["2014-01-01", "2014-01-02", "2014-01-03"], dtype = "datetime64[m]")
+    >>> dates2 = np.array(["2014-01-02", "2014-01-03", "2014-01-04"], dtype = "datetime64[m]")
+    >>> index, indexers = nwispy_helpers.align_dates([dates1, dates2], how = "outer")
+    >>> indexers
+    [array([ 0,  1,  2, -1]), array([-1,  0,  1,  2])]
+    """
+    if how not in ["inner", "outer"]:
+        raise ValueError("how must be inner or outer")
+        
+    dates_list = [to_datetime64(dates) for dates in dates_list]
+    
+    if how == "inner":
+        index = dates_list[0]
+        for dates in dates_list[1:]:
+            positions, is_found = _search_sorted_dates(index, dates)
+            index = index[is_found]
     else:
-       raise ValueError("No matching dates for find_start_end_dates()") 
+        # merge sort is fast for a concatenation of sorted runs
+        index = np.concatenate(dates_list)
+        index.sort(kind = "mergesort")
+        if len(index) > 0:
+            index = index[np.concatenate([[True], index[1:] != index[:-1]])]
+            
+    indexers = []
+    for dates in dates_list:
+        positions, is_found = _search_sorted_dates(index, dates)
+        indexers.append(np.where(is_found, positions, -1))
+            
+    return index, indexers
+
+def reindex_values(values, indexer, fill_value = np.nan):
+    """  
+    Reindex an array of values to the common dates found by align_dates().
+
+    Parameters 
+    ----------
+    values : array
+        Array of values; the first axis matches the dates that were aligned.
+    indexer : array
+        Integer array of the positions of the common dates in the values; -1 
+        where a date is missing.
+    fill_value : float
+        Value for the missing dates.
+    
+    Returns
+    -------
+    reindexed_values : array 
+        Array of float values with the first axis matching the common dates.
+    """
+    values = np.asarray(values, dtype = np.float64)
+    indexer = np.asarray(indexer)
+    
+    # there are no values to take when every date is missing from an empty array
+    if len(values) == 0:
+        return np.full((len(indexer),) + values.shape[1:], fill_value)
+    
+    reindexed_values = values.take(np.maximum(indexer, 0), axis = 0)
+    reindexed_values[indexer < 0] = fill_value
+    
+    return reindexed_values
 
+def _search_sorted_dates(values, dates):
+    """ Return the positions of values in a sorted datetime64 array of dates and whether each value was found at its position """
+    
+    positions = np.searchsorted(dates, values)
+    
+    if len(dates) == 0:
+        return positions, np.zeros(len(values), dtype = bool)
+        
+    is_found = dates[np.minimum(positions, len(dates) - 1)] == values
+    
+    return positions, is_found
 
 def _print_test_info(expected, actual):
     """   
@@ -473,6 +1113,21 @@ def test_convert_to_float():
     # print results
     _print_test_info(actual, expected)
     
+def test_convert_to_floats():
+    """ Test convert_to_floats() """
+
+    print("--- Testing convert_to_floats() ---")
+
+    # expected values
+    expected = {"floats": np.array([4.2, np.nan, np.nan, 6.5]), "mask": np.array([False, True, True, False])}
+
+    # actual values
+    floats, mask = convert_to_floats(values = np.array(["4.2", "", "Ice", "*6.5_"]), helper_str = "My help message")
+    actual = {"floats": floats, "mask": mask}
+
+    # print results
+    _print_test_info(actual, expected)
+
 def test_rmspecialchars():
     """ Test rmspecialchars() """
 
@@ -594,6 +1249,8 @@ def main():
 
     test_convert_to_float()
 
+    test_convert_to_floats()
+
     test_rmspecialchars()
 
     test_create_monthly_dict()
@@ -0,0 +1,801 @@
+# -*- coding: utf-8 -*-
+"""
+:Module: nwispy_stats.py
+
+:Author: Jeremiah Lant, jlant@usgs.gov, U.S. Geological Survey, Kentucky Water Science Center, http://www.usgs.gov/
+
+:Synopsis: Statistics of the data found in U.S. Geological Survey (USGS) National Water Information System (NWIS) data files; http://waterdata.usgs.gov/nwis
+"""
+
+__author__   = "Jeremiah Lant, jlant@usgs.gov, U.S. Geological Survey, Kentucky Water Science Center."
+__copyright__ = "http://www.usgs.gov/visual-id/credit_usgs.html#copyright"
+__license__   = __copyright__
+__contact__   = __author__
+
+import numpy as np
+
+# groups of dates that values can be aggregated by (see aggregate)
+GROUPS = ["month", "season", "day_of_year", "year", "water_year", "climatic_year", "year_month"]
+
+# names of the seasons of the "season" group; the season key is the index of its name
+SEASONS = ["DJF", "MAM", "JJA", "SON"]
+
+# datetime64 units of the periods that values can be resampled to (see resample)
+FREQUENCIES = {"hourly": "h", "daily": "D", "monthly": "M"}
+
+# statistics of moving windows of values (see rolling)
+ROLLING_STATISTICS = ["count", "sum", "mean", "min", "max"]
+
+def compute_stats(values, percentiles = None):
+    """
+    Compute the count, mean, standard deviation, min, and max of an array of
+    values ignoring nan values. A 2-D array is reduced along its first axis,
+    so the statistics of every parameter of a dataset (each column of its
+    values) are computed in one call. The columns are reduced one at a time;
+    the columns of a dataset's values are contiguous, so each reduction is a
+    sequential scan of one column. The sum of a column, which is needed for 
+    the mean, also reveals whether it has nan values; only then are its valid
+    values gathered, and the mean, the sum of squared differences from the 
+    mean (a second pass, which is more accurate than a sum of squares), the 
+    min, and the max are computed from them with plain reductions rather 
+    than nan-aware ones.
+
+    Parameters
+    ----------
+    values : array
+        1-D array of values or 2-D array with a column of values for each parameter.
+    percentiles : list of float
+        List of percentiles (0 - 100) to compute; percentiles need all the values
+        at once so they are not kept by merge_stats().
+
+    Returns
+    -------
+    stats : dictionary
+        Dictionary of the "count", "mean", "std" (population standard deviation),
+        "min", "max", and "m2" (sum of squared differences from the mean; used to
+        merge statistics) of the values and a "percentiles" dictionary of each
+        percentile. Each statistic is a scalar for a 1-D array or an array with a
+        value for each column of a 2-D array; the statistics of a column without
+        values are nan and its count is 0.
+
+    See Also
+    --------
+    merge_stats : Merge the statistics of two parts of the values
+
+    Examples
+    --------
+    >>> import nwispy_stats
+    >>> import numpy as np
+    >>> stats = nwispy_stats.compute_stats([2, np.nan, 6, 1])
+    >>> stats["count"], stats["mean"], stats["max"], stats["min"]
+    (3, 3.0, 6.0, 1.0)
+    """
+    values = np.asarray(values, dtype = np.float64)
+    is_1d = values.ndim == 1
+    if is_1d:
+        values = values[:, np.newaxis]
+
+    num_columns = values.shape[1]
+    
+    stats = {
+        "count": np.zeros(num_columns, dtype = np.int64),
+        "mean": np.full(num_columns, np.nan),
+        "m2": np.full(num_columns, np.nan),
+        "min": np.full(num_columns, np.nan),
+        "max": np.full(num_columns, np.nan),
+        "percentiles": {}
+    }
+
+    for percentile in percentiles or []:
+        stats["percentiles"][percentile] = np.full(num_columns, np.nan)
+
+    for i in range(num_columns):
+        column = values[:, i]
+        total = column.sum()
+        
+        # a nan sum means the column has nan values (or infinite values of both signs)
+        if np.isnan(total):
+            column = column[~np.isnan(column)]
+            total = column.sum()
+
+        if len(column) == 0:
+            continue
+
+        deviations = column - total / len(column)
+
+        stats["count"][i] = len(column)
+        stats["mean"][i] = total / len(column)
+        stats["m2"][i] = np.dot(deviations, deviations)
+        stats["min"][i] = column.min()
+        stats["max"][i] = column.max()
+
+        for percentile in stats["percentiles"]:
+            stats["percentiles"][percentile][i] = np.percentile(column, percentile)
+
+    _compute_std(stats)
+
+    if is_1d:
+        stats = _to_scalars(stats)
+
+    return stats
+
+def merge_stats(stats1, stats2):
+    """
+    Merge the statistics of two parts of an array of values, such as the
+    chunks of a data file as they are read, into the statistics of all of the
+    values without looking at the values again. The means and sums of squared
+    differences are combined with the pairwise update of Chan et al.
+    (1979). Percentiles are not merged.
+
+    Parameters
+    ----------
+    stats1 : dictionary
+        Dictionary of statistics of the first part of the values (see compute_stats).
+    stats2 : dictionary
+        Dictionary of statistics of the second part of the values.
+
+    Returns
+    -------
+    stats : dictionary
+        Dictionary of statistics of all the values.
+
+    Examples
+    --------
+    >>> import nwispy_stats
+    >>> stats = nwispy_stats.merge_stats(nwispy_stats.compute_stats([1, 2]), nwispy_stats.compute_stats([3, 4, 5]))
+    >>> stats["count"], stats["mean"], stats["max"]
+    (5, 3.0, 5.0)
+    """
+    count1, count2 = np.asarray(stats1["count"]), np.asarray(stats2["count"])
+    count = count1 + count2
+
+    # statistics of parts without values are nan; treat them as zeros
+    mean1 = np.where(count1 > 0, stats1["mean"], 0.0)
+    mean2 = np.where(count2 > 0, stats2["mean"], 0.0)
+    m2_1 = np.where(count1 > 0, stats1["m2"], 0.0)
+    m2_2 = np.where(count2 > 0, stats2["m2"], 0.0)
+
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        delta = mean2 - mean1
+        mean = np.where(count > 0, mean1 + delta * count2 / count, np.nan)
+        m2 = np.where(count > 0, m2_1 + m2_2 + delta ** 2 * count1 * count2 / count, np.nan)
+
+    stats = {
+        "count": count,
+        "mean": mean,
+        "m2": m2,
+        "min": np.fmin(stats1["min"], stats2["min"]),
+        "max": np.fmax(stats1["max"], stats2["max"]),
+        "percentiles": {}
+    }
+
+    _compute_std(stats)
+
+    if np.ndim(count) == 0:
+        stats = _to_scalars(stats)
+
+    return stats
+
+def get_group_keys(dates, by = "month"):
+    """
+    Get the integer key of the group of each date. Keys are computed from the 
+    datetime64 values with integer arithmetic; no dates are converted to 
+    datetime objects.
+
+    Parameters
+    ----------
+    dates : array
+        Array of datetime64 values or datetime objects.
+    by : {"month", "season", "day_of_year", "year", "water_year", "climatic_year", "year_month"}
+        String group; calendar month (1 - 12), season (index of SEASONS; 
+        December is in winter), day of year (1 - 366), calendar year, water 
+        year (October through September, named by the year it ends), climatic 
+        year (April through March, named by the year it begins), or month of 
+        each year (number of months since 1970-01).
+
+    Returns
+    -------
+    keys : array
+        Integer array of the group key of each date.
+
+    Examples
+    --------
+    >>> import nwispy_stats
+    >>> import numpy as np
+    >>> dates = np.array(["2013-09-30", "2013-10-01", "2013-12-31"], dtype = "datetime64[m]")
+    >>> nwispy_stats.get_group_keys(dates, by = "water_year")
+    array([2013, 2014, 2014])
+    """
+    if by not in GROUPS:
+        raise ValueError("by must be one of {}".format(", ".join(GROUPS)))
+
+    dates = np.asarray(dates).astype("datetime64[m]", copy = False)
+
+    months = dates.astype("datetime64[M]").astype(np.int64)
+
+    if by == "year_month":
+        return months
+
+    month = months % 12 + 1
+    year = months // 12 + 1970
+
+    if by == "month":
+        keys = month
+    elif by == "season":
+        keys = month % 12 // 3
+    elif by == "year":
+        keys = year
+    elif by == "water_year":
+        keys = year + (month >= 10)
+    elif by == "climatic_year":
+        keys = year - (month < 4)
+    else:
+        keys = (dates.astype("datetime64[D]") - dates.astype("datetime64[Y]")).astype(np.int64) + 1
+
+    return keys
+
+def aggregate(dates, values, by = "month", percentiles = None):
+    """
+    Compute the count, mean, standard deviation, min, max, and percentiles of 
+    the values in each group of dates (e.g. each calendar month) for all 
+    columns of values at once. The rows are ordered by their group key once 
+    (not at all if the keys are already in order, as they are for years of 
+    sorted dates), and each statistic of all groups and all columns is then a 
+    single reduction over the segments of the ordered values.
+
+    Parameters
+    ----------
+    dates : array
+        Array of datetime64 values or datetime objects.
+    values : array
+        1-D array of values or 2-D array with a column of values for each 
+        parameter; nan values are ignored.
+    by : {"month", "season", "day_of_year", "year", "water_year", "climatic_year", "year_month"}
+        String group of dates (see get_group_keys).
+    percentiles : list of float
+        List of percentiles (0 - 100) to compute for each group.
+
+    Returns
+    -------
+    aggregation : dictionary
+        Dictionary of the group "keys" found in the dates (sorted; datetime64 
+        months for "year_month") and the "count", "mean", "std", "min", and 
+        "max" of each group; each an array with a row for each group (and a 
+        column for each column of a 2-D array of values). The "percentiles" 
+        key is a dictionary of the percentiles of each group.
+
+    Examples
+    --------
+    >>> import nwispy_stats
+    >>> import numpy as np
+    >>> dates = np.array(["2014-01-01", "2014-01-02", "2014-02-01"], dtype = "datetime64[m]")
+    >>> aggregation = nwispy_stats.aggregate(dates, [1.0, 3.0, 5.0], by = "month")
+    >>> aggregation["keys"], aggregation["mean"]
+    (array([1, 2]), array([2., 5.]))
+    """
+    keys = get_group_keys(dates, by = by)
+
+    aggregation = _aggregate_keys(keys, values, percentiles)
+    aggregation["by"] = by
+    if by == "year_month":
+        aggregation["keys"] = aggregation["keys"].astype("datetime64[M]")
+
+    return aggregation
+
+def resample(dates, values, freq = "daily", step = None, min_fraction = None):
+    """
+    Resample values to hourly, daily, or monthly periods; e.g. compute daily 
+    mean, min, and max values from 15 minute instantaneous values. The period
+    of each date is found by truncating the datetime64 dates to the unit of 
+    the period, and the statistics of all periods and all columns are 
+    computed with the same segment reductions as aggregate. Periods that are 
+    missing too many values can be set to nan with a completeness threshold.
+
+    Parameters
+    ----------
+    dates : array
+        Sorted array of datetime64 values (or datetime objects); convert the 
+        dates of an instantaneous file to one time zone first (see 
+        nwispy_helpers.convert_time_zone) so that periods do not shift across 
+        daylight saving time changes.
+    values : array
+        1-D array of values or 2-D array with a column of values for each 
+        parameter; nan values are ignored.
+    freq : {"hourly", "daily", "monthly"}
+        String period to resample to.
+    step : timedelta64
+        Timestep of the dates; needed to find the number of values expected
+        in each period.
+    min_fraction : float
+        Minimum fraction (0 - 1) of the expected values of a period that 
+        must be valid; the statistics of periods with fewer values are nan.
+
+    Returns
+    -------
+    resampled : dictionary
+        Dictionary of the "dates" of the periods found in the dates (the 
+        datetime64 start of each period), the "count", "mean", "std", "min",
+        and "max" of each period (an array with a row for each period and a 
+        column for each column of a 2-D array of values), and the "expected" 
+        number of values in each period (None if step is None).
+
+    Examples
+    --------
+    >>> import nwispy_stats
+    >>> import numpy as np
+    >>> dates = np.arange("2014-01-01", "2014-01-03", 360, dtype = "datetime64[m]")
+    >>> resampled = nwispy_stats.resample(dates, np.arange(8.0), freq = "daily")
+    >>> resampled["dates"], resampled["mean"]
+    (array(['2014-01-01', '2014-01-02'], dtype='datetime64[D]'), array([1.5, 5.5]))
+    """
+    if freq not in FREQUENCIES:
+        raise ValueError("freq must be one of {}".format(", ".join(sorted(FREQUENCIES))))
+
+    if min_fraction is not None and step is None:
+        raise ValueError("step is needed to find the completeness of each period")
+
+    unit = FREQUENCIES[freq]
+    periods = np.asarray(dates).astype("datetime64[m]", copy = False).astype("datetime64[{}]".format(unit))
+
+    resampled = _aggregate_keys(periods.astype(np.int64), values, percentiles = None)
+    resampled["freq"] = freq
+    resampled["dates"] = resampled.pop("keys").astype("datetime64[{}]".format(unit))
+    del resampled["percentiles"]
+    resampled["expected"] = None
+
+    if step is not None:
+        starts = resampled["dates"].astype("datetime64[m]")
+        ends = (resampled["dates"] + np.timedelta64(1, unit)).astype("datetime64[m]")
+        resampled["expected"] = (ends - starts).astype(np.int64) // np.timedelta64(step, "m").astype(np.int64)
+
+    if min_fraction is not None:
+        expected = resampled["expected"].reshape((-1,) + (1,) * (resampled["count"].ndim - 1))
+        is_incomplete = resampled["count"] < min_fraction * expected
+        for key in ["mean", "m2", "std", "min", "max"]:
+            resampled[key][is_incomplete] = np.nan
+
+    return resampled
+
+def rolling(values, window, statistic = "mean", min_count = None, dates = None):
+    """
+    Compute a statistic of the moving window of values ending at each value;
+    e.g. 7-day mean discharge or 24-hour max gage height. A window is either
+    a number of values or a length of time before each date. Every statistic 
+    is computed in time proportional to the number of values, independent of 
+    the length of the window; counts, sums, and means are differences of 
+    cumulative sums, and mins and maxs of windows of a fixed number of values
+    are combined from the running extremes of blocks of values (van Herk / 
+    Gil-Werman). Mins and maxs of time windows, whose number of values can 
+    vary, are combined from extremes of windows of doubling lengths.
+
+    Parameters
+    ----------
+    values : array
+        1-D array of values or 2-D array with a column of values for each 
+        parameter; nan values are ignored.
+    window : {int, timedelta64, timedelta}
+        Number of values in each window, or length of time of each window; 
+        the window of a date includes the dates after date - window.
+    statistic : {"count", "sum", "mean", "min", "max"}
+        String statistic of each window.
+    min_count : int
+        Minimum number of valid values of a window; the statistic of windows 
+        with fewer values is nan. Default is a full window for a number of 
+        values and 1 for a length of time.
+    dates : array
+        Sorted array of datetime64 values (or datetime objects) of the values;
+        needed for a length of time window.
+
+    Returns
+    -------
+    rolled : array
+        Array of the statistic of the window ending at each value; the same 
+        shape as values.
+
+    Examples
+    --------
+    >>> import nwispy_stats
+    >>> import numpy as np
+    >>> nwispy_stats.rolling([1.0, 2.0, np.nan, 4.0, 5.0], 2, statistic = "max", min_count = 1)
+    array([1., 2., 2., 4., 5.])
+    """
+    if statistic not in ROLLING_STATISTICS:
+        raise ValueError("statistic must be one of {}".format(", ".join(ROLLING_STATISTICS)))
+
+    values = np.asarray(values, dtype = np.float64)
+    is_1d = values.ndim == 1
+    if is_1d:
+        values = values[:, np.newaxis]
+
+    num_values = len(values)
+
+    is_fixed = np.asarray(window).dtype.kind in "iu"
+    if is_fixed:
+        if window < 1:
+            raise ValueError("window must be at least 1 value")
+
+        starts = np.maximum(np.arange(num_values) - window + 1, 0)
+        if min_count is None:
+            min_count = window
+    else:
+        if dates is None:
+            raise ValueError("dates are needed for a length of time window")
+
+        window = np.timedelta64(window).astype("timedelta64[m]")
+        if window <= np.timedelta64(0, "m"):
+            raise ValueError("window must be a positive length of time")
+
+        dates = np.asarray(dates).astype("datetime64[m]", copy = False)
+        if len(dates) != num_values:
+            raise ValueError("Lengths of dates and values are not equal!")
+
+        starts = np.searchsorted(dates, dates - window, side = "right")
+        if min_count is None:
+            min_count = 1
+
+    is_valid = ~np.isnan(values)
+    count = _window_sums(is_valid.astype(np.int64), starts)
+
+    if statistic == "count":
+        rolled = count
+    elif statistic in ["sum", "mean"]:
+        rolled = _window_sums(np.where(is_valid, values, 0.0), starts)
+        if statistic == "mean":
+            with np.errstate(invalid = "ignore", divide = "ignore"):
+                rolled = rolled / count
+    else:
+        ufunc = np.fmin if statistic == "min" else np.fmax
+        if is_fixed:
+            rolled = _window_extremes_fixed(values, window, ufunc)
+        else:
+            rolled = _window_extremes(values, starts, ufunc)
+
+    if statistic != "count":
+        rolled[count < min_count] = np.nan
+
+    if is_1d:
+        rolled = rolled[:, 0]
+
+    return rolled
+
+def compute_low_flows(dates, values, days = 7, by = "climatic_year"):
+    """
+    Compute the annual minimum n-day mean values of daily values; e.g. the 
+    annual 7-day low flows of a daily discharge record that the 7Q10 low 
+    flow statistic is computed from (see compute_low_flow_frequency). An 
+    n-day mean is valid only if all n days of its window have values, so 
+    missing days never shorten a window.
+
+    Parameters
+    ----------
+    dates : array
+        Sorted array of datetime64 values (or datetime objects) of daily values.
+    values : array
+        1-D array of daily values or 2-D array with a column of values for 
+        each parameter.
+    days : int
+        Number of days of each moving mean.
+    by : {"climatic_year", "water_year", "year"}
+        String year to find the minimum of; the climatic year (April through
+        March, named by the year it begins) keeps each low flow season within 
+        one year.
+
+    Returns
+    -------
+    low_flows : dictionary
+        Dictionary of the year "keys", the minimum n-day mean of each year 
+        ("low_flows"), and the number of valid n-day means of each year 
+        ("count"), so that incomplete years can be excluded.
+    """
+    dates = np.asarray(dates).astype("datetime64[m]", copy = False)
+
+    means = rolling(values, np.timedelta64(days, "D"), statistic = "mean", min_count = days, dates = dates)
+
+    aggregation = aggregate(dates, means, by = by)
+
+    return {"by": by, "keys": aggregation["keys"], "low_flows": aggregation["min"], "count": aggregation["count"]}
+
+def compute_low_flow_frequency(low_flows, recurrence = 10):
+    """
+    Compute the low flow with a recurrence interval from annual low flows by 
+    fitting a log-Pearson type III distribution (frequency factor of the 
+    Wilson-Hilferty approximation); e.g. the 7Q10 from annual 7-day low flows.
+
+    Parameters
+    ----------
+    low_flows : array
+        1-D array of annual low flows; nan values are ignored.
+    recurrence : float
+        Recurrence interval in years; the low flow has a 1 / recurrence 
+        probability of not being exceeded in a year.
+
+    Returns
+    -------
+    low_flow : float
+        Low flow of the recurrence interval.
+    """
+    low_flows = np.asarray(low_flows, dtype = np.float64)
+    low_flows = low_flows[~np.isnan(low_flows)]
+
+    if len(low_flows) < 3:
+        raise ValueError("At least 3 annual low flows are needed")
+
+    if np.any(low_flows <= 0):
+        raise ValueError("Low flows must be positive to fit a log-Pearson type III distribution")
+
+    logs = np.log10(low_flows)
+    num = len(logs)
+    mean = np.mean(logs)
+    std = np.std(logs, ddof = 1)
+    skew = num * np.sum((logs - mean) ** 3) / ((num - 1) * (num - 2) * std ** 3) if std > 0 else 0.0
+
+    z = _normal_quantile(1.0 / recurrence)
+    if abs(skew) < 1e-6:
+        factor = z
+    else:
+        factor = 2.0 / skew * ((1.0 + skew * z / 6.0 - skew ** 2 / 36.0) ** 3 - 1.0)
+
+    return 10 ** (mean + factor * std)
+
+def _window_sums(values, starts):
+    """ Sum the values of each window from starts to each row with differences of cumulative sums """
+
+    sums = np.concatenate([np.zeros((1, values.shape[1]), dtype = values.dtype), np.cumsum(values, axis = 0)])
+
+    return sums[1:] - sums[starts]
+
+def _window_extremes_fixed(values, window, ufunc):
+    """ Reduce each window of a fixed number of values with fmin or fmax from running extremes of blocks (van Herk / Gil-Werman) """
+
+    num_values, num_columns = values.shape
+    num_blocks = -(-num_values // window)
+
+    blocks = np.full((num_blocks * window, num_columns), np.nan)
+    blocks[:num_values] = values
+    blocks = blocks.reshape(num_blocks, window, num_columns)
+
+    # running extremes from the start (prefix) and from the end (suffix) of each block
+    prefix = ufunc.accumulate(blocks, axis = 1).reshape(-1, num_columns)[:num_values]
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis = 1)[:, ::-1].reshape(-1, num_columns)
+
+    # a full window spans the end of one block and the start of the next; a partial window is the start of the first block
+    extremes = prefix.copy()
+    if window <= num_values:
+        extremes[window - 1:] = ufunc(suffix[:num_values - window + 1], prefix[window - 1:])
+
+    return extremes
+
+def _window_extremes(values, starts, ufunc):
+    """ Reduce each window from starts to each row with fmin or fmax from extremes of windows of doubling lengths (sparse table) """
+
+    num_values = len(values)
+    ends = np.arange(num_values)
+    lengths = ends - starts + 1
+
+    extremes = np.full(values.shape, np.nan)
+    if num_values == 0:
+        return extremes
+
+    # a window of length l is covered by two overlapping windows of the largest power of two length <= l
+    levels = np.floor(np.log2(lengths)).astype(np.int64)
+
+    table, width, level = values, 1, 0
+    while True:
+        is_level = levels == level
+        if np.any(is_level):
+            extremes[is_level] = ufunc(table[starts[is_level]], table[ends[is_level] - width + 1])
+
+        if 2 * width > lengths.max():
+            break
+
+        table = ufunc(table[:-width], table[width:])
+        width, level = 2 * width, level + 1
+
+    return extremes
+
+def _normal_quantile(probability):
+    """ Quantile of the standard normal distribution (rational approximation of P. J. Acklam; relative error < 1.2e-9) """
+
+    a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01, -1.328068155288572e+01]
+    c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+    d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00]
+
+    if not 0 < probability < 1:
+        raise ValueError("probability must be between 0 and 1")
+
+    if 0.02425 <= probability <= 1 - 0.02425:
+        q = probability - 0.5
+        r = q * q
+        return (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q / \
+               (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1)
+
+    q = np.sqrt(-2 * np.log(min(probability, 1 - probability)))
+    quantile = (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / \
+               ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1)
+
+    return quantile if probability < 0.5 else -quantile
+
+def _aggregate_keys(keys, values, percentiles):
+    """ Compute the statistics of the values of each group of integer keys; see aggregate """
+
+    values = np.asarray(values, dtype = np.float64)
+    is_1d = values.ndim == 1
+    if is_1d:
+        values = values[:, np.newaxis]
+
+    if len(keys) != len(values):
+        raise ValueError("Lengths of dates and values are not equal!")
+
+    # order the rows by group unless they are already
+    if len(keys) > 1 and np.any(keys[1:] < keys[:-1]):
+        order = np.argsort(keys, kind = "mergesort")
+        keys = keys[order]
+        values = values[order]
+
+    # each group is a segment of the ordered rows
+    if len(keys) > 0:
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    else:
+        starts = np.zeros(0, dtype = np.int64)
+        
+    sizes = np.diff(np.append(starts, len(keys)))
+
+    aggregation = {
+        "keys": keys[starts],
+        "percentiles": {}
+    }
+
+    num_groups, num_columns = len(starts), values.shape[1]
+
+    if num_groups > 0:
+        is_valid = ~np.isnan(values)
+        filled = np.where(is_valid, values, 0.0)
+
+        count = np.add.reduceat(is_valid, starts, axis = 0, dtype = np.int64)
+
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            mean = np.add.reduceat(filled, starts, axis = 0) / count
+            deviations = np.where(is_valid, filled - np.repeat(mean, sizes, axis = 0), 0.0)
+            m2 = np.add.reduceat(deviations * deviations, starts, axis = 0)
+            m2[count == 0] = np.nan
+
+        aggregation["count"] = count
+        aggregation["mean"] = mean
+        aggregation["m2"] = m2
+        aggregation["min"] = np.fmin.reduceat(values, starts, axis = 0)
+        aggregation["max"] = np.fmax.reduceat(values, starts, axis = 0)
+    else:
+        aggregation["count"] = np.zeros((0, num_columns), dtype = np.int64)
+        for key in ["mean", "m2", "min", "max"]:
+            aggregation[key] = np.zeros((0, num_columns))
+
+    _compute_std(aggregation)
+
+    if percentiles:
+        aggregation["percentiles"] = _compute_group_percentiles(keys, values, starts, aggregation["count"], percentiles)
+
+    if is_1d:
+        for key in ["count", "mean", "m2", "std", "min", "max"]:
+            aggregation[key] = aggregation[key][:, 0]
+        for percentile in aggregation["percentiles"]:
+            aggregation["percentiles"][percentile] = aggregation["percentiles"][percentile][:, 0]
+
+    return aggregation
+
+def _compute_group_percentiles(keys, values, starts, count, percentiles):
+    """ Compute percentiles of each group of ordered values with linear interpolation (as np.percentile) """
+
+    results = {percentile: np.full(count.shape, np.nan) for percentile in percentiles}
+
+    for i in range(values.shape[1]):
+        # sort the values, then stable sort them by group so that they are sorted within each group; nan values sort last
+        order = np.argsort(values[:, i])
+        order = order[np.argsort(keys[order], kind = "mergesort")]
+        column = values[order, i]
+
+        has_values = count[:, i] > 0
+
+        for percentile in percentiles:
+            position = (count[has_values, i] - 1) * percentile / 100.0
+            lower = np.floor(position).astype(np.int64)
+            upper = np.ceil(position).astype(np.int64)
+
+            lower_values = column[starts[has_values] + lower]
+            upper_values = column[starts[has_values] + upper]
+
+            results[percentile][has_values, i] = lower_values + (upper_values - lower_values) * (position - lower)
+
+    return results
+
+def _compute_std(stats):
+    """ Compute the population standard deviation of a statistics dictionary from its count and sum of squared differences """
+
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        stats["std"] = np.sqrt(stats["m2"] / stats["count"])
+
+def _to_scalars(stats):
+    """ Return a statistics dictionary of a single column of values with scalar statistics """
+
+    scalars = {key: np.asarray(value).reshape(-1)[0] for key, value in stats.items() if key != "percentiles"}
+    scalars["count"] = int(scalars["count"])
+    scalars["percentiles"] = {percentile: np.asarray(value).reshape(-1)[0] for percentile, value in stats["percentiles"].items()}
+
+    return scalars
+
+
+def test_compute_stats():
+    """ Test compute_stats() and merge_stats() """
+
+    print("--- Testing compute_stats() ---")
+
+    values = np.array([[1.0, 10.0], [2.0, np.nan], [3.0, 30.0], [4.0, 40.0]])
+
+    stats = compute_stats(values, percentiles = [50])
+    for key in ["count", "mean", "std", "min", "max"]:
+        print("    {}: {}".format(key, stats[key]))
+    print("    median: {}".format(stats["percentiles"][50]))
+
+    print("--- Testing merge_stats() ---")
+
+    stats = merge_stats(compute_stats(values[:2]), compute_stats(values[2:]))
+    for key in ["count", "mean", "std", "min", "max"]:
+        print("    {}: {}".format(key, stats[key]))
+    print("")
+
+def test_aggregate():
+    """ Test aggregate() """
+
+    print("--- Testing aggregate() ---")
+
+    dates = np.arange("2012-01-01", "2014-01-01", dtype = "datetime64[D]").astype("datetime64[m]")
+    values = np.arange(len(dates), dtype = float)
+
+    for by in GROUPS:
+        aggregation = aggregate(dates, values, by = by)
+        print("    {}: {} group(s); first {} mean {}".format(by, len(aggregation["keys"]), aggregation["keys"][0], aggregation["mean"][0]))
+    print("")
+
+def test_resample():
+    """ Test resample() """
+
+    print("--- Testing resample() ---")
+
+    dates = np.arange("2014-01-01", "2014-01-04", 15, dtype = "datetime64[m]")
+    values = np.arange(len(dates), dtype = float)
+    values[100:150] = np.nan
+
+    resampled = resample(dates, values, freq = "daily", step = np.timedelta64(15, "m"), min_fraction = 0.9)
+    for key in ["dates", "count", "expected", "mean", "min", "max"]:
+        print("    {}: {}".format(key, resampled[key]))
+    print("")
+
+def test_rolling():
+    """ Test rolling() and compute_low_flows() """
+
+    print("--- Testing rolling() ---")
+
+    values = np.array([3.0, 1.0, 4.0, np.nan, 5.0, 9.0, 2.0, 6.0])
+    for statistic in ROLLING_STATISTICS:
+        print("    3 value {}: {}".format(statistic, rolling(values, 3, statistic = statistic, min_count = 1)))
+
+    print("--- Testing compute_low_flows() ---")
+
+    dates = np.arange("2000-04-01", "2010-04-01", dtype = "datetime64[D]").astype("datetime64[m]")
+    values = 100 + 50 * np.cos(2 * np.pi * np.arange(len(dates)) / 365.25)
+
+    low_flows = compute_low_flows(dates, values, days = 7)
+    print("    annual 7-day low flows: {}".format(low_flows["low_flows"]))
+    print("    7Q10: {}".format(compute_low_flow_frequency(low_flows["low_flows"], recurrence = 10)))
+    print("")
+
+def main():
+    """ Test functionality of statistics """
+
+    test_compute_stats()
+    test_aggregate()
+    test_resample()
+    test_rolling()
+
+if __name__ == "__main__":
+    main()
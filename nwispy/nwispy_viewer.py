@@ -20,6 +20,10 @@ import datetime
 import numpy as np
 import os
 
+# my modules
+import nwispy_helpers
+import nwispy_flowduration
+
 def print_info(nwis_data):
     """   
     Print information contained in the data dictionary. 
@@ -62,6 +66,11 @@ def print_info(nwis_data):
     print("Gage name: {0}".format(nwis_data["gage_name"]))
     print("Timestep: {0}".format(nwis_data["timestep"]))
     
+    gaps = nwis_data.get("gaps")
+    if gaps is not None and len(gaps["missing"]) > 0:
+        print("Gaps: {0} gap(s) missing {1} timestep(s); largest from {2} to {3}".format(len(gaps["missing"]), gaps["missing"].sum(), 
+              gaps["start"][gaps["missing"].argmax()], gaps["end"][gaps["missing"].argmax()]))
+    
     print("Parameters:")
     for parameter in nwis_data["parameters"]:
         print("  {0}".format(parameter["description"]))
@@ -69,6 +78,13 @@ def print_info(nwis_data):
         print("      max: {}".format(parameter["max"]))
         print("      min: {}".format(parameter["min"]))
 
+def use_noninteractive_backend():
+    """   
+    Switch matplotlib to a non-interactive backend. Used by processes that only
+    save plots to files, such as worker processes processing files in parallel.
+    """
+    plt.switch_backend("Agg")
+
 def plot_data(nwis_data, is_visible = True, save_path = None):
     """   
     Plot each parameter contained in the nwis data. Save plots to a particular
@@ -86,6 +102,9 @@ def plot_data(nwis_data, is_visible = True, save_path = None):
         String path to save plot(s) 
     """
     
+    # matplotlib plots dates as datetime objects
+    dates = nwispy_helpers.to_datetime(nwis_data["dates"])
+    
     for parameter in nwis_data["parameters"]:
         
         fig = plt.figure(figsize=(12,10))
@@ -107,8 +126,8 @@ def plot_data(nwis_data, is_visible = True, save_path = None):
         else:
             color_str = "k"
 
-        plt.plot(nwis_data["dates"], parameter["data"], color = color_str, label = ylabel) 
-        plt.fill_between(nwis_data["dates"], parameter["min"], parameter["data"], facecolor = color_str, alpha = 0.5)
+        plt.plot(dates, parameter["data"], color = color_str, label = ylabel) 
+        plt.fill_between(dates, parameter["min"], parameter["data"], facecolor = color_str, alpha = 0.5)
             
         # rotate and align the tick labels so they look better
         fig.autofmt_xdate()
@@ -157,6 +176,85 @@ def plot_data(nwis_data, is_visible = True, save_path = None):
         else:
             plt.close()
 
+def plot_flow_duration(nwis_data, is_visible = True, save_path = None):
+    """   
+    Plot the flow duration curve of each discharge parameter contained in the 
+    nwis data; the flows equaled or exceeded a percent of the time. Save plots 
+    to a particular path.
+    
+    Parameters
+    ----------
+    nwis_data : dictionary 
+        A dictionary containing data found in data file.
+
+    is_visible : bool
+        Boolean value to show plots 
+        
+    save_path : string 
+        String path to save plot(s) 
+    """
+    
+    for parameter in nwis_data["parameters"]:
+        
+        if not nwispy_flowduration.is_discharge(parameter["code"]):
+            continue
+        
+        curve = nwispy_flowduration.compute_exceedance_curve(parameter["data"])
+        
+        if len(curve["flows"]) == 0:
+            continue
+        
+        fig = plt.figure(figsize=(12,10))
+        ax = fig.add_subplot(111)
+        ax.grid(True, which = "both")
+        ax.set_title(nwis_data["gage_name"] + " (" + nwis_data["timestep"] + ")")
+        ax.set_xlabel("Percent of time flow was equaled or exceeded")
+        ylabel = "\n".join(wrap(parameter["description"], 60))
+        ax.set_ylabel(ylabel)
+        
+        plt.plot(curve["probabilities"], curve["flows"], color = "b", label = ylabel)
+        
+        # flows span orders of magnitude; use a log scale if every flow is positive
+        if curve["flows"][-1] > 0:
+            ax.set_yscale("log")
+        
+        ax.set_xlim(0, 100)
+        
+        # legend; make it transparent    
+        handles, labels = ax.get_legend_handles_labels()
+        legend = ax.legend(handles, labels, fancybox = True)
+        legend.get_frame().set_alpha(0.5)
+        legend.draggable(state=True)
+        
+        # show text of flows exceeded 10, 50, and 90 percent of the time on graph; use matplotlib.patch.Patch properies and bbox
+        flow_duration = nwispy_flowduration.compute_flow_duration(parameter["data"], probabilities = [10, 50, 90])
+        text = "Q10 = %.2f\nQ50 = %.2f\nQ90 = %.2f" % tuple(flow_duration["flows"])
+        patch_properties = {"boxstyle": "round",
+                            "facecolor": "wheat",
+                            "alpha": 0.5
+                            }
+                       
+        ax.text(0.95, 0.95, text, transform = ax.transAxes, fontsize = 14, 
+                verticalalignment = "top", horizontalalignment = "right", bbox = patch_properties)
+        
+        # save plots
+        if save_path:        
+            # set the size of the figure to be saved
+            curr_fig = plt.gcf()
+            curr_fig.set_size_inches(12, 10)
+            
+            # keep filename string short enough to be saved properly; keep only usgs gage number and parameter code
+            short_gage_name = " ".join(nwis_data["gage_name"].split()[0:2])            
+            filename = " - ".join([short_gage_name, "Flow duration", parameter["code"]])  + ".png"           
+            filepath = os.path.join(save_path, filename)
+            plt.savefig(filepath, dpi = 100)
+            
+        # show plots
+        if is_visible:
+            plt.show()
+        else:
+            plt.close()
+
 
 def _create_testdata():
     """ Create test data for tests """
@@ -216,6 +314,23 @@ def test_plot():
     
     print("Plotting completed")
     print("")
+
+def test_plot_flow_duration():
+    """ Test flow duration plotting functionality """
+    
+    print("--- Testing flow duration plot ---")    
+    
+    data = _create_testdata()
+    discharge_data = np.exp(np.random.randn(len(data["dates"])))
+    data["parameters"].append({"code": "00060",
+                               "description": "Discharge, cubic feet per second",
+                               "index": 2,
+                               "data": discharge_data})
+    
+    plot_flow_duration(nwis_data = data, is_visible = True, save_path = None)
+    
+    print("Plotting completed")
+    print("")
     
 def main():
     """ Test functionality of plotting and printing file information """
@@ -223,6 +338,8 @@ def main():
     test_print()
     
     test_plot()
+    
+    test_plot_flow_duration()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
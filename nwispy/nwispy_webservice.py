@@ -16,10 +16,70 @@ import os
 import re
 import urllib
 import urllib2
+import urlparse
+import httplib
+import socket
+import errno
+import threading
+import Queue
+import collections
+import json
+import hashlib
+import shutil
+import time
+import zlib
+import random
 from StringIO import StringIO
 import numpy as np
 import datetime
 
+# my modules
+import nwispy_helpers
+
+# base url for USGS NWIS Webservice
+BASE_URL = "http://waterservices.usgs.gov/nwis/"
+
+# number of bytes read from a response and written to disk at a time
+CHUNK_SIZE = 64 * 1024
+
+# default number of concurrent downloads
+MAX_WORKERS = 4
+
+# default number of times a failed request is retried
+MAX_RETRIES = 3
+
+# default seconds a connection waits to connect or for data before it fails
+TIMEOUT = 60.0
+
+# maximum number of redirects followed by one request
+MAX_REDIRECTS = 5
+
+# redirect statuses whose Location header is followed
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# default maximum number of requests per second to one host
+MAX_RATE = 10.0
+
+# maximum number of sites combined into one coalesced request
+MAX_SITES = 100
+
+# directory holding cached webservice responses; created next to the request file
+RESPONSE_CACHE_DIRECTORY = os.path.join(".nwispy-cache", "responses")
+
+# name of the file holding the state of incremental retrievals; saved next to the store files
+STATE_FILENAME = "incremental.json"
+
+# name of the file holding the journal of a batch of downloads; saved next to the downloaded files
+JOURNAL_FILENAME = "journal.json"
+
+# patterns used to split the response of a coalesced request
+SPLIT_PATTERNS = {
+    "site_count": re.compile("(# Data for the following )([0-9]+)( site\(s\).*)"),
+    "site_name": re.compile("#\s+USGS ([0-9]+)\s"),
+    "site_section": re.compile("# Data provided for site ([0-9]+)"),
+    "parameter": re.compile("#\s+[0-9]{2,}\s+([0-9]{5})\s")
+}
+
 def read_webrequest(filepath):
     """    
     Open web request file, create a file object for read_webrequest_in(filestream) 
@@ -67,8 +127,6 @@ def read_webrequest_in(filestream):
     
     requests[0] = {"data type": str, "site number": str, "start date": str, "end date": str, "parameters": list of str}       
     """
-    data_file = filestream.readlines()
-
     patterns = {
         "column_names": "(#)(.+)", 
         "dv_iv_row": "(dv|iv|)\t([0-9]+)\t([0-9]{4}-[0-9]{1,2}-[0-9]{1,2})\t([0-9]{4}-[0-9]{1,2}-[0-9]{1,2})\t(.+)", # match site only at the beginning of a line
@@ -81,7 +139,8 @@ def read_webrequest_in(filestream):
         "requests": [],
     } 
 
-    for line in data_file: 
+    # iterate over the file object lazily; the file is never read into memory as a whole
+    for line in filestream: 
         match_column_names = re.search(pattern = patterns["column_names"], string = line)
         match_dv_iv_row = re.search(pattern = patterns["dv_iv_row"], string = line)
         match_site_row = re.search(pattern = patterns["site_row"], string = line)  
@@ -143,10 +202,493 @@ def encode_url(data_request):
     
     return user_parameters_url
     
-def download_file(user_parameters_url, data_type, filename, file_destination):
+def plan_requests(requests, max_sites = MAX_SITES):
+    """    
+    Coalesce requests into the fewest webservice requests. Requests of the same
+    data type and site with overlapping date windows are merged into one request
+    for all of their parameters over the union of their date windows. Merged 
+    requests that ask for the same parameters over the same date window are then
+    combined into one request for up to max_sites sites.
+
+    Parameters
+    ----------
+    requests : list of dictionaries
+        List of request dictionaries returned by read_webrequest_in().
+    max_sites : int
+        Maximum number of sites in one planned request.
+    
+    Returns
+    -------
+    plans : list of dictionaries
+        List of planned request dictionaries; see Notes.
+        
+    Notes
+    -----
+    plans[0] = {"data type": str, "site number": str, "start date": str, "end date": str, "parameters": list of str, "requests": list of dictionaries}
+
+    A planned request has the same keys as a request, so encode_url() encodes it 
+    directly; "site number" is a comma separated list of sites. The "requests" key 
+    holds the original requests the planned request answers. If it holds more than
+    one request, the response must be split with split_response_in() or split_file().
+    """
+    plans = []
+    groups = {}
+    
+    for request in requests:
+        # only daily and instantaneous value requests with a date window are coalesced
+        if request["data type"] not in ("dv", "iv") or not request["start date"] or not request["end date"]:
+            plans.append(_create_plan(request["site number"], request["start date"], request["end date"], request["parameters"], [request]))
+        else:
+            groups.setdefault((request["data type"], request["site number"]), []).append(request)
+    
+    # merge requests of the same data type and site with overlapping date windows
+    merged = []
+    for key in sorted(groups):
+        group = sorted(groups[key], key = lambda request: (normalize_date(request["start date"]), normalize_date(request["end date"])))
+        
+        current = [group[0]]
+        end_date = normalize_date(group[0]["end date"])
+        for request in group[1:]:
+            if normalize_date(request["start date"]) <= end_date:
+                current.append(request)
+                end_date = max(end_date, normalize_date(request["end date"]))
+            else:
+                merged.append(current)
+                current = [request]
+                end_date = normalize_date(request["end date"])
+        merged.append(current)
+    
+    # combine merged requests with the same data type, parameters, and date window into multi-site requests
+    windows = collections.OrderedDict()
+    for group in merged:
+        if len(group) == 1:
+            start_date, end_date = group[0]["start date"], group[0]["end date"]
+        else:
+            start_date = min(normalize_date(request["start date"]) for request in group)
+            end_date = max(normalize_date(request["end date"]) for request in group)
+            
+        parameters = _union_parameters(group)
+        
+        key = (group[0]["data type"], normalize_date(start_date), normalize_date(end_date), tuple(sorted(parameters)))
+        windows.setdefault(key, []).append((start_date, end_date, parameters, group))
+        
+    for entries in windows.values():
+        for i in range(0, len(entries), max_sites):
+            start_date, end_date, parameters, group = entries[i]
+            sites = ",".join(entry[3][0]["site number"] for entry in entries[i:i + max_sites])
+            originals = [request for entry in entries[i:i + max_sites] for request in entry[3]]
+            plans.append(_create_plan(sites, start_date, end_date, parameters, originals))
+
+    return plans
+
+def _create_plan(sites, start_date, end_date, parameters, requests):
+    """ Create a planned request dictionary """
+    
+    return {
+        "data type": requests[0]["data type"],
+        "site number": sites,
+        "start date": start_date,
+        "end date": end_date,
+        "parameters": parameters,
+        "requests": requests
+    }
+
+def _union_parameters(requests):
+    """ Return the parameters of all requests in the order they first appear """
+    
+    parameters = []
+    for request in requests:
+        for parameter in request["parameters"]:
+            if parameter and parameter not in parameters:
+                parameters.append(parameter)
+                
+    return parameters
+
+def normalize_date(date_str):
+    """    
+    Return a date string that may not be zero padded; e.g. 2014-1-5, in 
+    %Y-%m-%d format so that dates compare as strings.
+
+    Parameters
+    ----------
+    date_str : str
+        String date in %Y-%m-%d format.
+    
+    Returns
+    -------
+    date_str : str
+        String date in zero padded %Y-%m-%d format; e.g. 2014-01-05
+    """
+    return datetime.datetime.strptime(date_str, "%Y-%m-%d").strftime("%Y-%m-%d")
+
+def split_file(filepath, requests, filepaths):
+    """    
+    Split a downloaded file of a coalesced request into a file for each of the 
+    original requests.
+
+    Parameters
+    ----------
+    filepath : str
+        String path to the downloaded file.
+    requests : list of dictionaries
+        List of the original request dictionaries; "requests" of a planned request.
+    filepaths : list of str
+        List of string paths to save the file of each request to.
+    
+    Returns
+    -------
+    found : list of bool
+        List of whether the response held data for each request; files of requests 
+        without data are removed.
+        
+    See Also
+    --------
+    split_response_in : Split a response file object
+    """
+    outputs = [nwispy_helpers.open_file(path, "wb") for path in filepaths]
+    
+    try:
+        with nwispy_helpers.open_file(filepath, "rb") as f:
+            found = split_response_in(filestream = f, requests = requests, outputs = outputs)
+    finally:
+        for output in outputs:
+            output.close()
+    
+    for path, has_data in zip(filepaths, found):
+        if not has_data:
+            os.remove(path)
+            
+    return found
+
+def split_response_in(filestream, requests, outputs):
+    """    
+    Split the response of a coalesced request into the response of each of the
+    original requests in a single pass over the response. Each output gets the
+    header of the response with only its own site and parameters, the columns of 
+    its own parameters, and the data rows of its own site within its own date window.
+
+    Parameters
+    ----------
+    filestream : file object
+        A file object that contains the response of a coalesced request.
+    requests : list of dictionaries
+        List of the original request dictionaries; "requests" of a planned request.
+    outputs : list of file objects
+        List of file objects to write the response of each request to.
+        
+    Returns
+    -------
+    found : list of bool
+        List of whether the response held data of any of the parameters of each request.
+    """
+    targets = []
+    for request, output in zip(requests, outputs):
+        targets.append({
+            "site": request["site number"],
+            "parameters": set(request["parameters"]),
+            "start date": normalize_date(request["start date"]),
+            "end date": normalize_date(request["end date"]),
+            "columns": None,
+            "found": False,
+            "output": output
+        })
+    
+    # site of the current site section of the response; None in the general header
+    section_site = None
+    
+    for line in filestream:
+        if line.startswith("#"):
+            match_section = SPLIT_PATTERNS["site_section"].match(line)
+            if match_section:
+                section_site = match_section.group(1)
+            
+            if section_site is None:
+                match_count = SPLIT_PATTERNS["site_count"].match(line)
+                match_name = SPLIT_PATTERNS["site_name"].match(line)
+                
+                for target in targets:
+                    if match_count:
+                        target["output"].write(match_count.expand("\\g<1>1\\g<3>") + "\n")
+                    elif not match_name or match_name.group(1) == target["site"]:
+                        target["output"].write(line)
+            else:
+                match_parameter = SPLIT_PATTERNS["parameter"].match(line)
+                
+                for target in targets:
+                    if target["site"] == section_site and (not match_parameter or match_parameter.group(1) in target["parameters"]):
+                        target["output"].write(line)
+            
+            continue
+        
+        fields = line.rstrip("\r\n").split("\t")
+        
+        if fields[0] == "agency_cd":
+            for target in targets:
+                if target["site"] == section_site:
+                    target["columns"] = _select_columns(fields, target["parameters"])
+                    target["found"] = target["found"] or any(_is_parameter_column(name, target["parameters"]) for name in fields)
+                    target["output"].write("\t".join(fields[i] for i in target["columns"]) + "\n")
+                    
+        elif fields[0] == "USGS" and len(fields) > 2:
+            date = fields[2][:10]
+            for target in targets:
+                if target["site"] == fields[1] and target["columns"] and target["start date"] <= date <= target["end date"]:
+                    target["output"].write("\t".join(fields[i] for i in target["columns"] if i < len(fields)) + "\n")
+        
+        else:
+            # format row or blank line of the current site section
+            for target in targets:
+                if target["site"] == section_site and target["columns"]:
+                    target["output"].write("\t".join(fields[i] for i in target["columns"] if i < len(fields)) + "\n")
+    
+    return [target["found"] for target in targets]
+
+def _select_columns(column_names, parameters):
+    """ Return the indices of the date and time columns and the columns of parameters; e.g. 06_00060_00003 and 06_00060_00003_cd """
+    
+    columns = []
+    for i, name in enumerate(column_names):
+        if i < 3 or name == "tz_cd" or _is_parameter_column(name, parameters):
+            columns.append(i)
+            
+    return columns
+
+def _is_parameter_column(name, parameters):
+    """ Return whether a column holds data or qualification codes of one of the parameters """
+    
+    parts = name.split("_")
+    
+    return len(parts) > 1 and parts[1] in parameters
+
+def get_store_name(request):
+    """    
+    Return the file name of the persistent store of a request's data; one store 
+    for each site, data type, and list of parameters.
+
+    Parameters
+    ----------
+    request : dictionary
+        A request dictionary.
+    
+    Returns
+    -------
+    store_name : str
+        String file name; e.g. 03284000_dv_00060-00065.txt
+    """
+    return "_".join([request["site number"], request["data type"], "-".join(parameter for parameter in request["parameters"] if parameter)]) + ".txt"
+
+def read_state(filepath):
+    """    
+    Read the state of incremental retrievals. Returns an empty state if the file 
+    does not exist.
+
+    Parameters
+    ----------
+    filepath : str
+        String path to the state file.
+    
+    Returns
+    -------
+    state : dictionary
+        Dictionary of store file names to a dictionary of the first date requested and 
+        the last date and time held in the store, in UTC for instantaneous data (see 
+        append_file()); {"start date": str, "last": str}
+    """
+    if not os.path.isfile(filepath):
+        return {}
+    
+    with open(filepath, "r") as f:
+        return json.load(f)
+
+def write_state(filepath, state):
+    """    
+    Write the state of incremental retrievals.
+
+    Parameters
+    ----------
+    filepath : str
+        String path to the state file.
+    state : dictionary
+        Dictionary returned by read_state().
+    """
+    with open(filepath, "w") as f:
+        json.dump(state, f, indent = 4, sort_keys = True, separators = (",", ": "))
+
+def get_journal_key(download):
+    """    
+    Return the key of a download in the journal of a batch of downloads.
+
+    Parameters
+    ----------
+    download : dictionary
+        A download dictionary; see iter_downloads().
+    
+    Returns
+    -------
+    key : str
+        String data type and encoded url; e.g. dv/?parameterCD=00060&...
+    """
+    return download["data type"] + "/?" + download["url"]
+
+def read_journal(filepath):
+    """    
+    Read the journal of a batch of downloads. Returns an empty journal if the file 
+    does not exist.
+
+    Parameters
+    ----------
+    filepath : str
+        String path to the journal file.
+    
+    Returns
+    -------
+    journal : dictionary
+        Dictionary of journal keys to a dictionary of the status of the download, 
+        "done" or "failed", its file name, and its error; {"status": str, "filename": str, "error": str}
+    """
+    return read_state(filepath)
+
+def write_journal(filepath, journal):
+    """    
+    Write the journal of a batch of downloads.
+
+    Parameters
+    ----------
+    filepath : str
+        String path to the journal file.
+    journal : dictionary
+        Dictionary returned by read_journal().
+    """
+    write_state(filepath, journal)
+
+def get_incremental_request(request, state):
+    """    
+    Return a request for only the data missing from a request's store; the data 
+    after the last date and time held in the store. The request is returned as is 
+    if there is no store, the request has no date window, or the request starts 
+    before the data held in the store.
+
+    Parameters
+    ----------
+    request : dictionary
+        A request dictionary.
+    state : dictionary
+        Dictionary returned by read_state().
+    
+    Returns
+    -------
+    request : dictionary
+        A request dictionary.
+    """
+    entry = state.get(get_store_name(request))
+    
+    if entry is None or not request["start date"] or not request["end date"] or normalize_date(request["start date"]) < entry["start date"]:
+        return request
+    
+    # the webservice takes local dates only; the local date of a UTC time is at most a day earlier, 
+    # and rows already held in the store are skipped by append_file()
+    start_date = entry["last"][:10]
+    if len(entry["last"]) > 10:
+        start_date = (datetime.datetime.strptime(start_date, "%Y-%m-%d") - datetime.timedelta(days = 1)).strftime("%Y-%m-%d")
+    
+    incremental_request = dict(request)
+    incremental_request["start date"] = min(start_date, normalize_date(request["end date"]))
+    
+    return incremental_request
+
+def append_file(store_filepath, filepath, last = None):
+    """    
+    Append the data rows of a downloaded file that are newer than the last data 
+    row held in a store to the store. Columns are matched by name, so the store 
+    and the file do not need to have the same column order. If the store does not 
+    exist, the file becomes the store. The downloaded file is removed. A gzip 
+    compressed store (.gz) is appended to as a new gzip member. Rows are compared 
+    by their date and time in UTC, converted with their time zone code (tz_cd), so 
+    the repeated hour at the end of daylight saving time is not mistaken for rows 
+    already held in the store.
+
+    Parameters
+    ----------
+    store_filepath : str
+        String path to the store.
+    filepath : str
+        String path to the downloaded file.
+    last : str
+        String date and time in UTC of the last data row in the store; e.g. 
+        2014-03-20 03:45 (the date of a daily data row).
+
+    Returns
+    -------
+    last : str
+        String date and time in UTC of the last data row in the store after 
+        appending; None if the store holds no data rows.
+    """
+    if last is None or not os.path.isfile(store_filepath):
+        if os.path.isfile(store_filepath):
+            os.remove(store_filepath)
+        os.rename(filepath, store_filepath)
+        
+        last = None
+        with nwispy_helpers.open_file(store_filepath, "rb") as f:
+            tz_column = None
+            for line in f:
+                if line.startswith("agency_cd"):
+                    names = line.rstrip("\r\n").split("\t")
+                    tz_column = names.index("tz_cd") if "tz_cd" in names else None
+                    
+                elif line.startswith("USGS\t"):
+                    last = _get_utc_time(line.rstrip("\r\n").split("\t"), tz_column)
+        return last
+    
+    store_columns = _read_column_names(store_filepath)
+    
+    with nwispy_helpers.open_file(filepath, "rb") as f, nwispy_helpers.open_file(store_filepath, "ab") as store:
+        columns = None
+        for line in f:
+            if line.startswith("agency_cd"):
+                names = line.rstrip("\r\n").split("\t")
+                columns = [names.index(name) if name in names else None for name in store_columns]
+                tz_column = names.index("tz_cd") if "tz_cd" in names else None
+                
+            elif line.startswith("USGS\t") and columns:
+                fields = line.rstrip("\r\n").split("\t")
+                utc_time = _get_utc_time(fields, tz_column)
+                if utc_time > last:
+                    store.write("\t".join(fields[i] if i is not None and i < len(fields) else "" for i in columns) + "\n")
+                    last = utc_time
+    
+    os.remove(filepath)
+    
+    return last
+
+def _get_utc_time(fields, tz_column):
+    """ Return the date and time in UTC of the fields of a data row; the date and time as is if it has no time or a time zone code of TIME_ZONE_OFFSETS """
+    
+    date_time = fields[2]
+    tz_cd = fields[tz_column] if tz_column is not None and tz_column < len(fields) else None
+    
+    if len(date_time) <= 10 or tz_cd not in nwispy_helpers.TIME_ZONE_OFFSETS:
+        return date_time
+    
+    utc_time = datetime.datetime.strptime(date_time[:16], "%Y-%m-%d %H:%M") - datetime.timedelta(minutes = nwispy_helpers.TIME_ZONE_OFFSETS[tz_cd])
+    
+    return utc_time.strftime("%Y-%m-%d %H:%M") + date_time[16:]
+
+def _read_column_names(filepath):
+    """ Return the column names of a data file """
+    
+    with nwispy_helpers.open_file(filepath, "rb") as f:
+        for line in f:
+            if line.startswith("agency_cd"):
+                return line.rstrip("\r\n").split("\t")
+            
+    return []
+
+def download_file(user_parameters_url, data_type, filename, file_destination, connection = None, base_url = BASE_URL, cache = None, scheduler = None):
     """    
     Download data from the web and save files to a specified file destination 
-    with a specified filename.
+    with a specified filename. The response is streamed to disk in chunks of 
+    CHUNK_SIZE bytes rather than being read into memory as a whole.
 
     Parameters
     ----------
@@ -158,18 +700,695 @@ def download_file(user_parameters_url, data_type, filename, file_destination):
         String filename.
     file_destination : str
         String path to save file to.
+    connection : httplib.HTTPConnection
+        Open connection to the webservice host to reuse (keep-alive); if None, 
+        a new connection is opened and closed for this download.
+    base_url : str
+        String base url of the webservice.
+    cache : ResponseCache
+        Cache of webservice responses; if None, responses are not cached.
+    scheduler : RequestScheduler
+        Scheduler that rate limits and retries the request; if None, the request 
+        is made once.
     
+    Returns
+    -------
+    outputfile : str
+        String path to the downloaded file.
+        
+    Raises
+    ------
+    urllib2.HTTPError
+        If the webservice responds with an error status.
+    IOError
+        If the cache is offline and the response is not cached.
+        
     Notes
     -----    
     The base url for USGS NWIS Webservice - http://waterservices.usgs.gov/nwis/
+    
+    A fresh cached response is used without a request; a stale cached response is
+    used if the webservice responds that it has not been modified (304). Redirects 
+    (e.g. from http to https) are followed up to MAX_REDIRECTS times.
+    """    
+    url = base_url + data_type + "/?" + user_parameters_url
+    outputfile = os.path.join(file_destination, filename)
+    
+    headers = {}
+    if cache is not None:
+        entry = cache.lookup(url)
+        
+        if entry is not None and (cache.offline or cache.is_fresh(entry)):
+            cache.copy(url = url, filepath = outputfile)
+            return outputfile
+        
+        if cache.offline:
+            raise IOError("Response is not cached and the cache is offline: {0}".format(url))
+            
+        if entry is not None:
+            headers = cache.get_validators(entry)
+    
+    own_connection = connection is None
+    if own_connection:
+        connection = open_connection(base_url = base_url)
+        
+    def request():
+        return _request(connection, url, outputfile, headers)
+    
+    try:
+        if scheduler is None:
+            response_headers = request()
+        else:
+            response_headers = scheduler.call(host = urlparse.urlsplit(base_url).netloc, function = request)
+    finally:
+        if own_connection:
+            connection.close()
+    
+    if cache is not None:
+        if response_headers is None:
+            cache.copy(url = url, filepath = outputfile, revalidated = True)
+        else:
+            cache.store(url = url, filepath = outputfile, headers = response_headers)
+            
+    return outputfile
+
+def open_connection(base_url = BASE_URL, timeout = TIMEOUT):
+    """    
+    Return a persistent (keep-alive) connection to the host of a base url. The
+    connection is opened when the first request is made and can be reused for
+    any number of downloads. A proxy set in the environment (e.g. http_proxy 
+    or https_proxy) is used as it is by urllib2; https is tunneled through the 
+    proxy.
+
+    Parameters
+    ----------
+    base_url : str
+        String base url of the webservice.
+    timeout : float
+        Seconds the connection waits to connect or for data before it fails
+        with a socket error, which a RequestScheduler retries.
+    
+    Returns
+    -------
+    connection : httplib.HTTPConnection 
+    """    
+    url = urlparse.urlsplit(base_url)
+    default_port = httplib.HTTPS_PORT if url.scheme == "https" else httplib.HTTP_PORT
+    
+    proxy = urllib.getproxies().get(url.scheme)
+    if proxy and urllib.proxy_bypass(url.hostname):
+        proxy = None
+    
+    if proxy:
+        proxy = urlparse.urlsplit(proxy if "://" in proxy else "http://" + proxy)
+        
+    if url.scheme == "https":
+        if proxy:
+            connection = httplib.HTTPSConnection(proxy.netloc, timeout = timeout)
+            connection.set_tunnel(url.hostname, url.port or default_port)
+        else:
+            connection = httplib.HTTPSConnection(url.netloc, timeout = timeout)
+    else:
+        connection = httplib.HTTPConnection(proxy.netloc if proxy else url.netloc, timeout = timeout)
+    
+    # the scheme, host, and port that the connection requests urls of; an http proxy is sent absolute urls
+    connection.origin = (url.scheme, url.hostname, url.port or default_port)
+    connection.absolute_urls = bool(proxy) and url.scheme != "https"
+    
+    return connection
+
+def _request(connection, url, outputfile, headers):
+    """ 
+    Download a url on a connection, following up to MAX_REDIRECTS redirects; a 
+    redirect to another scheme, host, or port is requested on a new connection 
+    that is closed when the download is done.
+    """
+    redirect_connection = None
+    redirect = None
+    
+    try:
+        for count in range(MAX_REDIRECTS + 1):
+            current = connection
+            if not _is_origin(current, url):
+                if redirect_connection is None or not _is_origin(redirect_connection, url):
+                    if redirect_connection is not None:
+                        redirect_connection.close()
+                    redirect_connection = open_connection(base_url = url, timeout = connection.timeout)
+                current = redirect_connection
+                
+            try:
+                return _request_once(current, url, outputfile, headers)
+            except _Redirect as error:
+                redirect = error
+                url = urlparse.urljoin(url, redirect.location)
+        
+        if redirect is None:
+            raise urllib2.HTTPError(url, None, "Too many redirects", None, None)
+        raise urllib2.HTTPError(url, redirect.status, "Too many redirects", redirect.headers, None)
+    
+    finally:
+        if redirect_connection is not None:
+            redirect_connection.close()
+
+def _is_origin(connection, url):
+    """ Return whether a connection requests urls of the scheme, host, and port of a url """
+    
+    url = urlparse.urlsplit(url)
+    default_port = httplib.HTTPS_PORT if url.scheme == "https" else httplib.HTTP_PORT
+    
+    return connection.origin == (url.scheme, url.hostname, url.port or default_port)
+
+def _request_once(connection, url, outputfile, headers):
+    """ 
+    Download a url on a connection; the connection is closed on errors so that it 
+    is opened fresh for the next request. Only a stale connection is retried here;
+    timeouts and other errors are left to a RequestScheduler, which backs off.
+    """
+    try:
+        try:
+            return _download(connection, url, outputfile, headers)
+        except Exception as error:
+            if not _is_stale_connection(error):
+                raise
+            
+            # a reused connection may have been closed by the server while idle; retry once on a fresh connection
+            connection.close()
+            return _download(connection, url, outputfile, headers)
+    except _Redirect:
+        raise
+    except Exception:
+        connection.close()
+        raise
+
+def _is_stale_connection(error):
+    """ Return whether a request failed because a reused connection was closed by the server """
+    
+    if isinstance(error, (httplib.BadStatusLine, httplib.CannotSendRequest)):
+        return True
+    
+    return isinstance(error, socket.error) and not isinstance(error, socket.timeout) and error.errno in (errno.ECONNRESET, errno.EPIPE)
+
+class _Redirect(Exception):
+    """ Redirect response to a request; raised by _download with the Location of the redirect """
+    
+    def __init__(self, status, location, headers):
+        Exception.__init__(self, location)
+        self.status = status
+        self.location = location
+        self.headers = headers
+
+def _download(connection, url, outputfile, headers):
+    """ 
+    Get a url on a connection and stream the response to the output file. Returns 
+    the response headers, or None if the response was not modified (304). Compressed
+    responses are decompressed as they are streamed; the output file is compressed
+    if its name ends in a compressed file extension; e.g. .gz. The response is 
+    streamed to a temporary file that is renamed to the output file when it is 
+    complete, so a response that fails while streamed leaves no partial file.
+    """
+    if connection.absolute_urls:
+        path = url
+    else:
+        path = urlparse.urlsplit(url)
+        path = urlparse.urlunsplit(("", "", path.path, path.query, ""))
+    
+    headers = dict(headers, **{"Accept-Encoding": "gzip, deflate"})
+    
+    connection.request("GET", path, headers = headers)
+    response = connection.getresponse()
+    
+    if response.status == httplib.NOT_MODIFIED:
+        response.read()
+        return None
+    
+    if response.status in REDIRECT_STATUSES and response.getheader("Location"):
+        # read the redirect response to its end so that the connection can be reused
+        response.read()
+        raise _Redirect(response.status, response.getheader("Location"), response.msg)
+    
+    if response.status != httplib.OK:
+        # read the error response to its end so that the connection can be reused
+        response.read()
+        raise urllib2.HTTPError(url, response.status, response.reason, response.msg, None)
+    
+    decompressor = _Decompressor(encoding = response.getheader("Content-Encoding", ""))
+    
+    # the temporary file keeps the extension of the output file, which sets its compression
+    temp_path = os.path.join(os.path.dirname(outputfile), ".tmp." + os.path.basename(outputfile))
+    
+    try:
+        with nwispy_helpers.open_file(temp_path, "wb") as f:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(decompressor.decompress(chunk))
+            
+            # reading a response in chunks ends quietly if the connection closes before its Content-Length is read
+            if response.length:
+                raise httplib.IncompleteRead("", response.length)
+            f.write(decompressor.flush())
+    except Exception:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        raise
+    
+    _replace_file(temp_path, outputfile)
+            
+    return response.msg
+
+class _Decompressor(object):
+    """ 
+    Streaming decompressor for a response's content encoding; gzip, deflate, or 
+    none. Deflate is meant to be zlib wrapped, but some servers send raw deflate, 
+    so raw deflate is used if the first chunk is not zlib wrapped.
+    """
+    def __init__(self, encoding):
+        self.encoding = encoding.strip().lower()
+        self.started = False
+        
+        if self.encoding == "gzip":
+            self.decompressobj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == "deflate":
+            self.decompressobj = zlib.decompressobj()
+        else:
+            self.decompressobj = None
+    
+    def decompress(self, chunk):
+        if self.decompressobj is None:
+            return chunk
+        
+        if self.encoding == "deflate" and not self.started:
+            self.started = True
+            try:
+                return self.decompressobj.decompress(chunk)
+            except zlib.error:
+                self.decompressobj = zlib.decompressobj(-zlib.MAX_WBITS)
+                
+        return self.decompressobj.decompress(chunk)
+    
+    def flush(self):
+        if self.decompressobj is None:
+            return ""
+        
+        return self.decompressobj.flush()
+
+class RequestScheduler(object):
+    """
+    Rate limits and retries requests. Requests to the same host are spaced at 
+    least 1 / rate seconds apart, shared by all threads. A request that fails with
+    a transient error; a connection error, a server error (5xx), or too many 
+    requests (429), is retried up to max_retries times after an exponential 
+    backoff with full jitter; a random delay between 0 and 
+    min(max_backoff, backoff * 2 ** attempt) seconds. A Retry-After header sent 
+    by the server is honored instead.
+
+    Parameters
+    ----------
+    max_retries : int
+        Maximum number of times a failed request is retried.
+    backoff : float
+        Seconds of the backoff of the first retry.
+    max_backoff : float
+        Maximum seconds of a backoff.
+    rate : float
+        Maximum number of requests per second to one host; None for no limit.
+    """
+    def __init__(self, max_retries = MAX_RETRIES, backoff = 1.0, max_backoff = 60.0, rate = MAX_RATE):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate = rate
+        self._next_times = {}
+        self._lock = threading.Lock()
+    
+    def call(self, host, function):
+        """ Call a function that makes a request to a host, waiting for the rate limit and retrying transient errors """
+        
+        attempt = 0
+        while True:
+            self.wait(host)
+            try:
+                return function()
+            except Exception as error:
+                if attempt >= self.max_retries or not self.is_retryable(error):
+                    raise
+                
+                time.sleep(self.get_delay(attempt, error))
+                attempt += 1
+    
+    def wait(self, host):
+        """ Wait until a request to a host is allowed by the rate limit """
+        
+        if not self.rate:
+            return
+        
+        with self._lock:
+            now = time.time()
+            request_time = max(now, self._next_times.get(host, now))
+            self._next_times[host] = request_time + 1.0 / self.rate
+            
+        if request_time > now:
+            time.sleep(request_time - now)
+    
+    def get_delay(self, attempt, error):
+        """ Return the seconds to wait before retrying a failed request """
+        
+        retry_after = None
+        if isinstance(error, urllib2.HTTPError) and error.hdrs is not None:
+            retry_after = error.hdrs.get("Retry-After")
+        
+        if retry_after and retry_after.strip().isdigit():
+            return min(float(retry_after), self.max_backoff)
+        
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+    
+    def is_retryable(self, error):
+        """ Return whether a failed request may succeed if retried """
+        
+        if isinstance(error, urllib2.HTTPError):
+            return error.code == 429 or error.code >= 500
+        
+        return isinstance(error, (urllib2.URLError, httplib.HTTPException, socket.error))
+
+class ResponseCache(object):
+    """
+    On-disk cache of webservice responses keyed by request url. Responses are cached
+    uncompressed, whatever the compression of the downloaded files. Each response is
+    saved with its ETag and Last-Modified headers so that a stale response can be
+    revalidated with a conditional request instead of downloaded again. Responses
+    holding provisional data expire sooner than other responses. When the cache
+    grows larger than max_size bytes, the least recently used responses are removed.
+    The size and last access time of each cached response are indexed in memory, 
+    read from the metadata of the responses once when the cache is created, so 
+    that the size of the cache is kept as a running total instead of being summed 
+    from the metadata of every response each time a response is stored.
+
+    Parameters
+    ----------
+    directory : str
+        String path to the cache directory; created if it does not exist.
+    max_size : int
+        Maximum size of the cached responses in bytes.
+    ttl : float
+        Seconds a response is used without revalidating it.
+    provisional_ttl : float
+        Seconds a response holding provisional data is used without revalidating it.
+    offline : bool
+        If True, only cached responses are used, however old, and no requests are made.
+    """
+    # pattern matching the qualification code of provisional data in the header of a response
+    provisional_pattern = re.compile("#\s+P\s+Provisional data")
+    
+    def __init__(self, directory, max_size = 500 * 1024 * 1024, ttl = 24 * 60 * 60, provisional_ttl = 60 * 60, offline = False):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.provisional_ttl = provisional_ttl
+        self.offline = offline
+        self._lock = threading.Lock()
+        
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        
+        # the last access time and size of each cached response by key, and the size of all of them
+        self._index = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.directory, name), "r") as f:
+                        entry = json.load(f)
+                    self._index[name[:-len(".json")]] = (entry["accessed"], entry["size"])
+                except (IOError, ValueError, KeyError):
+                    continue
+        self._total_size = sum(size for accessed, size in self._index.values())
+    
+    def get_key(self, url):
+        """ Return the key of the cached response of a url """
+        
+        return hashlib.sha1(url).hexdigest()
+    
+    def get_paths(self, url):
+        """ Return the paths of the cached response and its metadata for a url """
+        
+        key = self.get_key(url)
+        
+        return os.path.join(self.directory, key + ".rdb"), os.path.join(self.directory, key + ".json")
+        
+    def lookup(self, url):
+        """ Return the metadata dictionary of the cached response of a url, or None if the url is not cached """
+        
+        response_path, metadata_path = self.get_paths(url)
+        
+        try:
+            with open(metadata_path, "r") as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        
+        if entry.get("url") != url or not os.path.isfile(response_path):
+            return None
+        
+        return entry
+    
+    def is_fresh(self, entry):
+        """ Return whether a cached response can be used without revalidating it """
+        
+        ttl = self.provisional_ttl if entry["provisional"] else self.ttl
+        
+        return time.time() - entry["fetched"] < ttl
+    
+    def get_validators(self, entry):
+        """ Return the headers of a conditional request revalidating a cached response """
+        
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+            
+        return headers
+    
+    def copy(self, url, filepath, revalidated = False):
+        """ Copy the cached response of a url to a file and mark it as used; and as fetched now if it was revalidated """
+        
+        response_path, metadata_path = self.get_paths(url)
+        with open(response_path, "rb") as source, nwispy_helpers.open_file(filepath, "wb") as destination:
+            shutil.copyfileobj(source, destination)
+        
+        with self._lock:
+            entry = self.lookup(url)
+            if entry is not None:
+                entry["accessed"] = time.time()
+                if revalidated:
+                    entry["fetched"] = entry["accessed"]
+                self._write_metadata(metadata_path, entry)
+                self._update_index(self.get_key(url), entry)
+    
+    def store(self, url, filepath, headers):
+        """ Cache the response of a url saved in a file, then remove least recently used responses if the cache has grown too large """
+        
+        response_path, metadata_path = self.get_paths(url)
+        
+        provisional = False
+        with nwispy_helpers.open_file(filepath, "rb") as f:
+            for line in f:
+                if not line.startswith("#"):
+                    break
+                if self.provisional_pattern.match(line):
+                    provisional = True
+                    break
+        
+        now = time.time()
+        entry = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "provisional": provisional,
+            "fetched": now,
+            "accessed": now,
+            "size": None
+        }
+        
+        with self._lock:
+            temp_path = response_path + ".tmp"
+            with nwispy_helpers.open_file(filepath, "rb") as source, open(temp_path, "wb") as destination:
+                shutil.copyfileobj(source, destination)
+            _replace_file(temp_path, response_path)
+            entry["size"] = os.path.getsize(response_path)
+            self._write_metadata(metadata_path, entry)
+            self._update_index(self.get_key(url), entry)
+            
+            if self._total_size > self.max_size:
+                self.evict()
+    
+    def evict(self):
+        """ Remove least recently used responses until the cached responses are no larger than max_size """
+        
+        for key in sorted(self._index, key = lambda key: self._index[key][0]):
+            if self._total_size <= self.max_size:
+                break
+            
+            for extension in (".json", ".rdb"):
+                try:
+                    os.remove(os.path.join(self.directory, key + extension))
+                except OSError:
+                    pass
+            self._total_size -= self._index.pop(key)[1]
+    
+    def _update_index(self, key, entry):
+        """ Index the last access time and size of a cached response, keeping the size of all cached responses """
+        
+        if key in self._index:
+            self._total_size -= self._index[key][1]
+        self._index[key] = (entry["accessed"], entry["size"])
+        self._total_size += entry["size"]
+    
+    def _write_metadata(self, metadata_path, entry):
+        """ Write the metadata of a cached response """
+        
+        temp_path = metadata_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(entry, f)
+        _replace_file(temp_path, metadata_path)
+
+def _replace_file(source, destination):
+    """ Rename a file, replacing the destination file if it exists """
+    
+    if os.path.isfile(destination):
+        os.remove(destination)
+    os.rename(source, destination)
+
+def download_files(downloads, file_destination, max_workers = MAX_WORKERS, base_url = BASE_URL, cache = None, scheduler = None):
+    """    
+    Download many files concurrently and wait for all of them to complete. 
+
+    Parameters
+    ----------
+    downloads : list of dictionaries
+        List of download dictionaries; see iter_downloads().
+    file_destination : str
+        String path to save files to.
+    max_workers : int
+        Maximum number of concurrent downloads.
+    base_url : str
+        String base url of the webservice.
+    cache : ResponseCache
+        Cache of webservice responses; if None, responses are not cached.
+    scheduler : RequestScheduler
+        Scheduler that rate limits and retries requests; if None, each request is made once.
+    
+    Returns
+    -------
+    results : list of tuples
+        List of (filepath, error) tuples in the order the downloads completed; error
+        is None if the download succeeded.
+        
+    See Also
+    --------
+    iter_downloads : Yield downloads as they complete
     """    
-    base_url = "http://waterservices.usgs.gov/nwis/" + data_type + "/?" 
-    request = urllib2.Request(base_url, user_parameters_url)
-    response = urllib2.urlopen(request)  
+    return list(iter_downloads(downloads = downloads, file_destination = file_destination, max_workers = max_workers, base_url = base_url, cache = cache, scheduler = scheduler))
 
-    outputfile = os.path.join(file_destination, filename)        
-    with open(outputfile, "wb") as f:
-        f.write(response.read())        
+def iter_downloads(downloads, file_destination, max_workers = MAX_WORKERS, base_url = BASE_URL, max_pending = None, cache = None, scheduler = None):
+    """    
+    Download many files concurrently, yielding each file as soon as its download 
+    completes so that it can be processed while other downloads are in flight. 
+    Downloads are shared among up to max_workers threads; each thread keeps one 
+    persistent connection to the webservice open and reuses it for all of its 
+    downloads. A failed download does not stop the remaining downloads; its error
+    is yielded instead.
+    
+    At most max_pending completed downloads wait to be consumed; when that many 
+    are waiting, the threads pause until the consumer catches up.
+
+    Parameters
+    ----------
+    downloads : list of dictionaries
+        List of download dictionaries; see Notes.
+    file_destination : str
+        String path to save files to.
+    max_workers : int
+        Maximum number of concurrent downloads.
+    base_url : str
+        String base url of the webservice.
+    max_pending : int
+        Maximum number of completed downloads waiting to be consumed; defaults to max_workers.
+    cache : ResponseCache
+        Cache of webservice responses; if None, responses are not cached.
+    scheduler : RequestScheduler
+        Scheduler that rate limits and retries requests; if None, each request is made once.
+    
+    Yields
+    ------
+    result : tuple
+        Tuple of (filepath, error) in the order the downloads complete; error is 
+        None if the download succeeded.
+        
+    Notes
+    -----
+    downloads[0] = {"url": str, "data type": str, "filename": str} 
+    
+    where "url" is the encoded url returned by encode_url().
+    """    
+    if max_pending is None:
+        max_pending = max_workers
+    
+    tasks = Queue.Queue()
+    for download in downloads:
+        tasks.put(download)
+    
+    results = Queue.Queue(maxsize = max(1, max_pending))
+    stop = threading.Event()
+    num_workers = max(1, min(max_workers, len(downloads)))
+    
+    workers = [threading.Thread(target = _download_worker, args = (tasks, results, stop, file_destination, base_url, cache, scheduler), name = "nwispy-download-{0}".format(i)) for i in range(num_workers)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    
+    try:
+        for i in range(len(downloads)):
+            yield results.get()
+            
+    finally:
+        # stop the threads if the consumer stops early; keep emptying the results so no thread stays blocked
+        stop.set()
+        while any(worker.is_alive() for worker in workers):
+            try:
+                results.get(timeout = 0.1)
+            except Queue.Empty:
+                pass
+
+def _download_worker(tasks, results, stop, file_destination, base_url, cache, scheduler):
+    """ Download files from the tasks queue on one persistent connection until the queue is empty or stopped """
+    
+    connection = open_connection(base_url = base_url)
+    
+    try:
+        while not stop.is_set():
+            try:
+                download = tasks.get_nowait()
+            except Queue.Empty:
+                break
+            
+            filepath = os.path.join(file_destination, download["filename"])
+            try:
+                download_file(user_parameters_url = download["url"], 
+                              data_type = download["data type"], 
+                              filename = download["filename"],
+                              file_destination = file_destination,
+                              connection = connection,
+                              base_url = base_url,
+                              cache = cache,
+                              scheduler = scheduler)
+                results.put((filepath, None))
+                
+            except Exception as error:
+                connection.close()
+                results.put((filepath, error))
+    finally:
+        connection.close()
 
 def _create_test_data():
     """ Create test data for tests """
@@ -22,10 +22,12 @@ from matplotlib.widgets import SpanSelector
 import Tkinter, tkFileDialog
 import matplotlib.dates as mdates
 import datetime
-from scipy.stats import nanmean 
 
 # my module
-import nwispy
+import nwispy_filereader
+import nwispy_viewer
+import nwispy_helpers
+import nwispy_stats
 
 def onselect(xmin, xmax):
     """ 
@@ -40,19 +42,20 @@ def onselect(xmin, xmax):
     date_min = datetime.datetime(date_min.year, date_min.month, date_min.day, date_min.hour, date_min.minute)    
     date_max = datetime.datetime(date_max.year, date_max.month, date_max.day, date_max.hour, date_max.minute)
     
-    # find the indices that were selected    
-    indices = np.where((dates >= date_min) & (dates <= date_max))
-    indices = indices[0]
+    # find the rows that were selected with a binary search of the sorted dates    
+    start, end = nwispy_helpers.find_date_indices(dates, start_dates = date_min, end_dates = date_max)
+    if start >= end:
+        return
+    indices = slice(start, end)
     
     # set the data in second plot
-    plot2.set_data(dates[indices], parameter['data'][indices])
+    plot2.set_data(plot_dates[indices], parameter['data'][indices])
     
     # calculate new mean, max, min
-    param_mean = nanmean(parameter['data'][indices])    
-    param_max = np.nanmax(parameter['data'][indices])  
-    param_min = np.nanmin(parameter['data'][indices])  
+    stats = nwispy_stats.compute_stats(parameter['data'][indices])
+    param_mean, param_max, param_min = stats['mean'], stats['max'], stats['min']
     
-    ax2.set_xlim(dates[indices][0], dates[indices][-1])
+    ax2.set_xlim(plot_dates[indices][0], plot_dates[indices][-1])
     ax2.set_ylim(param_min, param_max)
         
     # show text of mean, max, min values on graph; use matplotlib.patch.Patch properies and bbox
@@ -85,13 +88,15 @@ if nwis_file:
     
     try:
         # process file    
-        nwis_data = nwispy.read_file(nwis_file)
+        nwis_data = nwispy_filereader.read_file(nwis_file)
         
         # print relevant information
         print '** USGS NWIS File Information **'
-        nwispy.print_info(nwis_data = nwis_data)
+        nwispy_viewer.print_info(nwis_data = nwis_data)
     
+        # datetime64 dates are searched for selections; matplotlib plots dates as datetime objects
         dates = nwis_data['dates']
+        plot_dates = nwispy_helpers.to_datetime(dates)
         parameter = nwis_data['parameters'][0]
         
          # plot parameter
@@ -103,7 +108,7 @@ if nwis_file:
         ax1.set_xlabel('Date')
         ax1.set_ylabel(parameter['description'])
 
-        plot1, = ax1.plot(dates, parameter['data'], color = 'b', marker = 'o', label = parameter['description'])
+        plot1, = ax1.plot(plot_dates, parameter['data'], color = 'b', marker = 'o', label = parameter['description'])
         
         # rotate and align the tick labels so they look better      
         plt.setp(ax1.xaxis.get_majorticklabels(), rotation = 30)
@@ -134,7 +139,7 @@ if nwis_file:
         ax2.set_title('USGS NWIS: ' + nwis_data['gage_name'])
         ax2.set_xlabel('Date')
         ax2.set_ylabel(parameter['description'])
-        plot2, = ax2.plot(dates, parameter['data'], color = 'b',  marker = 'o', label = parameter['description'])
+        plot2, = ax2.plot(plot_dates, parameter['data'], color = 'b',  marker = 'o', label = parameter['description'])
         
         # rotate and align the tick labels so they look better  
         plt.xticks(rotation = 30)
@@ -0,0 +1,149 @@
+import nose.tools
+
+import sys
+import numpy as np
+import datetime
+
+# my module
+from nwispy import nwispy_dataset
+from nwispy import nwispy_helpers
+
+# define the global fixture to hold the data that goes into the functions you test
+fixture = {}
+
+def setup():
+    """ Setup fixture for testing """
+
+    print >> sys.stderr, "SETUP: nwispy_dataset tests"
+
+    fixture["dates"] = np.array([datetime.datetime(2014, 01, 01, 0, 0) + datetime.timedelta(i) for i in range(5)], dtype = "datetime64[m]")
+    fixture["values"] = np.array([[1.0, 10.0], [2.0, 20.0], [3.0, 30.0], [4.0, 40.0], [5.0, 50.0]])
+    fixture["parameters"] = [
+        {"code": "06_00060_00003", "description": "Discharge, cubic feet per second (Mean)", "index": 3},
+        {"code": "07_00065_00003", "description": "Gage height, feet (Mean)", "index": 5,
+         "qualifiers": {"codes": np.array([0, 0, 1, 2, 2], dtype = np.int8), "categories": ["A", "A:e", "P"]}}
+    ]
+
+def teardown():
+    """ Print to standard error when all tests are finished """
+
+    print >> sys.stderr, "TEARDOWN: nwispy_dataset tests"
+
+def _create_dataset():
+    """ Create a dataset from the fixture """
+
+    return nwispy_dataset.NwisDataset(dates = fixture["dates"], values = fixture["values"], parameters = fixture["parameters"],
+                                      gage_name = "USGS 03290500 KENTUCKY RIVER AT LOCK 2 AT LOCKPORT, KY", timestep = "daily")
+
+def test_dataset_dictionary_access():
+
+    dataset = _create_dataset()
+
+    nose.tools.assert_equals(dataset["gage_name"], "USGS 03290500 KENTUCKY RIVER AT LOCK 2 AT LOCKPORT, KY")
+    nose.tools.assert_equals(dataset["timestep"], "daily")
+    nose.tools.assert_equals(dataset.get("date_retrieved"), None)
+    nose.tools.assert_equals(len(dataset["parameters"]), 2)
+    nose.tools.assert_equals(dataset["parameters"][1]["code"], "07_00065_00003")
+    nose.tools.assert_equals(dataset["parameters"][1]["index"], 5)
+    nose.tools.assert_true("dates" in dataset)
+    nose.tools.assert_raises(KeyError, dataset.__getitem__, "not a key")
+
+    np.testing.assert_array_equal(dataset["parameters"][1]["data"], np.array([10.0, 20.0, 30.0, 40.0, 50.0]))
+
+def test_parameter_data_is_view():
+
+    dataset = _create_dataset()
+    parameter = dataset.get_parameter("06_00060_00003")
+
+    nose.tools.assert_true(parameter["data"].flags["C_CONTIGUOUS"])
+    nose.tools.assert_true(np.may_share_memory(parameter["data"], dataset.values))
+
+    parameter["data"] = parameter["data"] * 2
+    parameter["mean"] = np.mean(parameter["data"])
+
+    np.testing.assert_array_equal(dataset.values[:, 0], np.array([2.0, 4.0, 6.0, 8.0, 10.0]))
+    nose.tools.assert_equals(parameter["mean"], 6.0)
+
+def test_parameter_qualifier_mask():
+
+    dataset = _create_dataset()
+
+    parameter = dataset.get_parameter("07_00065_00003")
+    np.testing.assert_array_equal(parameter.get_qualifier_mask(include = ["A"]), np.array([True, True, True, False, False]))
+    np.testing.assert_array_equal(parameter.get_qualifier_mask(exclude = ["e"]), np.array([True, True, False, True, True]))
+
+    # a parameter without qualification codes
+    parameter = dataset.get_parameter("06_00060_00003")
+    nose.tools.assert_equals(parameter["qualifiers"], None)
+    np.testing.assert_array_equal(parameter.get_qualifier_mask(include = ["A"]), np.zeros(5, dtype = bool))
+    np.testing.assert_array_equal(parameter.get_qualifier_mask(exclude = ["e"]), np.ones(5, dtype = bool))
+
+def test_dataset_get_index_and_slice():
+
+    # regular dates are an implicit index
+    dataset = _create_dataset()
+    dataset["step"] = np.timedelta64(1, "D")
+
+    nose.tools.assert_equals(dataset.get_index(datetime.datetime(2014, 01, 03)), 2)
+    nose.tools.assert_raises(KeyError, dataset.get_index, datetime.datetime(2014, 01, 03, 12, 0))
+    nose.tools.assert_raises(KeyError, dataset.get_index, datetime.datetime(2014, 01, 10))
+
+    nose.tools.assert_equals(dataset.get_slice(datetime.datetime(2014, 01, 02), datetime.datetime(2014, 01, 04)), slice(1, 4))
+    nose.tools.assert_equals(dataset.get_slice(datetime.datetime(2014, 01, 01, 12, 0), datetime.datetime(2014, 01, 03, 12, 0)), slice(1, 3))
+    nose.tools.assert_equals(dataset.get_slice(datetime.datetime(2013, 12, 01), None), slice(0, 5))
+    nose.tools.assert_equals(dataset.get_slice(datetime.datetime(2014, 02, 01), datetime.datetime(2014, 03, 01)), slice(5, 5))
+
+    rows = dataset.get_slice(datetime.datetime(2014, 01, 02), datetime.datetime(2014, 01, 04))
+    np.testing.assert_array_equal(dataset["parameters"][1]["data"][rows], np.array([20.0, 30.0, 40.0]))
+
+    # irregular dates are searched
+    dates = fixture["dates"][[0, 1, 3, 4]]
+    dataset = nwispy_dataset.NwisDataset(dates = dates, values = fixture["values"][[0, 1, 3, 4]], parameters = fixture["parameters"])
+
+    nose.tools.assert_equals(dataset.get_index(datetime.datetime(2014, 01, 04)), 2)
+    nose.tools.assert_raises(KeyError, dataset.get_index, datetime.datetime(2014, 01, 03))
+    nose.tools.assert_equals(dataset.get_slice(datetime.datetime(2014, 01, 02), datetime.datetime(2014, 01, 04)), slice(1, 3))
+    nose.tools.assert_equals(dataset.get_slice(end_date = datetime.datetime(2014, 01, 03)), slice(0, 2))
+
+def test_dataset_aggregate():
+
+    dataset = _create_dataset()
+    aggregation = dataset.aggregate(by = "month")
+
+    np.testing.assert_array_equal(aggregation["keys"], np.array([1]))
+    np.testing.assert_array_equal(aggregation["mean"], np.array([[3.0, 30.0]]))
+
+def test_dataset_resample():
+
+    # 15 minute values in local time across the start of daylight saving time (2014-03-09 02:00 EST)
+    dates = np.concatenate([np.arange("2014-03-08T00:00", "2014-03-09T02:00", 15, dtype = "datetime64[m]"),
+                            np.arange("2014-03-09T03:00", "2014-03-11T01:00", 15, dtype = "datetime64[m]")])
+    tz_cd = ["EST"] * 104 + ["EDT"] * (len(dates) - 104)
+    values = np.column_stack([np.ones(len(dates)), np.arange(len(dates), dtype = float)])
+
+    dataset = nwispy_dataset.NwisDataset(dates = dates, values = values, parameters = fixture["parameters"], timestep = "instantaneous",
+                                         tz_cd = nwispy_helpers.encode_categorical(tz_cd))
+
+    # local days; the day daylight saving time starts is an hour short
+    resampled = dataset.resample(freq = "daily")
+    np.testing.assert_array_equal(resampled["count"][:, 0], np.array([96, 92, 96, 4]))
+
+    resampled = dataset.resample(freq = "daily", min_fraction = 1.0)
+    nose.tools.assert_true(np.isnan(resampled["mean"][1, 0]))
+
+    # days of standard time are complete
+    resampled = dataset.resample(freq = "daily", tz = "EST", min_fraction = 1.0)
+    np.testing.assert_array_equal(resampled["dates"], np.array(["2014-03-08", "2014-03-09", "2014-03-10"], dtype = "datetime64[D]"))
+    np.testing.assert_array_equal(resampled["count"][:, 0], np.array([96, 96, 96]))
+    np.testing.assert_array_equal(resampled["mean"][:, 0], np.ones(3))
+
+    dataset["tz_cd"] = None
+    nose.tools.assert_raises(ValueError, dataset.resample, "daily", "EST")
+
+def test_parameter_rolling():
+
+    dataset = _create_dataset()
+    parameter = dataset.get_parameter("07_00065_00003")
+
+    np.testing.assert_allclose(parameter.rolling(2), np.array([np.nan, 15.0, 25.0, 35.0, 45.0]))
+    np.testing.assert_array_equal(parameter.rolling(np.timedelta64(2, "D"), statistic = "min"), np.array([10.0, 10.0, 20.0, 30.0, 40.0]))
@@ -1,6 +1,9 @@
 import nose.tools
 
+import os
 import sys
+import shutil
+import tempfile
 import numpy as np
 import datetime
 import re
@@ -8,6 +11,7 @@ from StringIO import StringIO
 
 # my module
 from nwispy import nwispy_filereader
+from nwispy import nwispy_helpers
 
 # define the global fixture to hold the data that goes into the functions you test
 fixture = {}
@@ -262,6 +266,43 @@ def setup():
         USGS	11143000	2010-03-01 01:00	PST	50.0	A
         """
 
+    fixture["data_daily_multi_site"] = \
+        """
+        # retrieved: 2013-07-02 22:08:51 EDT       (sdww01)
+        #
+        # Data for the following 2 site(s) are contained in this file
+        #    USGS 03290500 KENTUCKY RIVER AT LOCK 2 AT LOCKPORT, KY
+        #    USGS 03298500 SALT RIVER AT SHEPHERDSVILLE, KY
+        # -----------------------------------------------------------------------------------
+        #
+        # Data provided for site 03290500
+        #    DD parameter statistic   Description
+        #    06   00060     00003     Discharge, cubic feet per second (Mean)
+        #
+        # Data-value qualification codes included in this output: 
+        #     A  Approved for publication -- Processing and review completed.  
+        # 
+        agency_cd	site_no	datetime	06_00060_00003	06_00060_00003_cd
+        5s	15s	20d	14n	10s
+        USGS	03290500	2012-07-01	171	A
+        USGS	03290500	2012-07-02	190	A
+        USGS	03290500	2012-07-03	164	A
+        #
+        # Data provided for site 03298500
+        #    DD parameter statistic   Description
+        #    08   80154     00003     Suspended sediment concentration, milligrams per liter (Mean)
+        #    05   00060     00003     Discharge, cubic feet per second (Mean)
+        #
+        # Data-value qualification codes included in this output: 
+        #     A  Approved for publication -- Processing and review completed.  
+        #     e  Value has been estimated.  
+        # 
+        agency_cd	site_no	datetime	05_00060_00003	05_00060_00003_cd	08_80154_00003	08_80154_00003_cd
+        5s	15s	20d	14n	10s	14n	10s
+        USGS	03298500	1955-01-01	1880	A	269	A
+        USGS	03298500	1955-01-02	1450	A	134	A:e
+        """
+
 
 def teardown():
     """ Print to standard error when all tests are finished """
@@ -409,7 +450,7 @@ def test_daily_single_parameter():
     nose.tools.assert_almost_equals(actual["parameters"][0]["max"], expected["parameters"][0]["max"])
     nose.tools.assert_almost_equals(actual["parameters"][0]["min"], expected["parameters"][0]["min"])
 
-    nose.tools.assert_equals(actual["dates"].all(), expected["dates"].all())
+    np.testing.assert_array_equal(actual["dates"], expected["dates"].astype("datetime64[m]"))
 
     nose.tools.assert_equals(actual["timestep"], expected["timestep"])
 
@@ -458,7 +499,7 @@ def test_data_instantaneous_single_parameter():
     nose.tools.assert_almost_equals(actual["parameters"][0]["max"], expected["parameters"][0]["max"])
     nose.tools.assert_almost_equals(actual["parameters"][0]["min"], expected["parameters"][0]["min"])
 
-    nose.tools.assert_equals(actual["dates"].all(), expected["dates"].all())
+    np.testing.assert_array_equal(actual["dates"], expected["dates"].astype("datetime64[m]"))
         
     nose.tools.assert_equals(actual["timestep"], expected["timestep"])    
 
@@ -585,7 +626,7 @@ def test_data_instantaneous_multi_parameter():
     nose.tools.assert_almost_equals(actual["parameters"][5]["max"], expected["parameters"][5]["max"])
     nose.tools.assert_almost_equals(actual["parameters"][5]["min"], expected["parameters"][5]["min"])
 
-    nose.tools.assert_equals(actual["dates"].all(), expected["dates"].all())
+    np.testing.assert_array_equal(actual["dates"], expected["dates"].astype("datetime64[m]"))
          
     nose.tools.assert_equals(actual["timestep"], expected["timestep"]) 
     
@@ -667,4 +708,236 @@ def test_bad_data_instantaneous_single_parameter2():
     nose.tools.assert_almost_equals(actual["parameters"][0]["min"], expected["parameters"][0]["min"]) 
 
 
-    
\ No newline at end of file
+    
+def test_classify_line():
+
+    nose.tools.assert_equals(nwispy_filereader.classify_line("USGS\t03290500\t2012-07-01\t171\tA"), "data_row")
+    nose.tools.assert_equals(nwispy_filereader.classify_line("        # retrieved: 2013-07-02 22:08:51 EDT       (nadww01)"), "comment")
+    nose.tools.assert_equals(nwispy_filereader.classify_line("agency_cd\tsite_no\tdatetime\t06_00060_00003\t06_00060_00003_cd"), "column_names")
+    nose.tools.assert_equals(nwispy_filereader.classify_line("5s\t15s\t20d\t14n\t10s"), "format_row")
+    nose.tools.assert_equals(nwispy_filereader.classify_line("   \n"), None)
+
+def test_split_rows():
+
+    rows = ["USGS\t03290500\t2012-07-01\t171\tA", "USGS\t03290500\t2012-07-02\t190\tA"]
+    ragged_rows = ["USGS\t03290500\t2012-07-01\t171\tA", "USGS\t03290500\t2012-07-02\t190"]
+
+    actual = nwispy_filereader.split_rows(rows = rows, num_columns = 5)
+    actual_ragged = nwispy_filereader.split_rows(rows = ragged_rows, num_columns = 5)
+
+    nose.tools.assert_equals(actual.shape, (2, 5))
+    nose.tools.assert_equals(list(actual[:, 3]), ["171", "190"])
+    nose.tools.assert_equals(actual_ragged.shape, (2, 5))
+    nose.tools.assert_equals(list(actual_ragged[:, 4]), ["A", ""])
+
+def test_convert_column():
+
+    dates = np.array([datetime.datetime(2010, 03, 01, 0, 0) + datetime.timedelta(minutes = 15 * i) for i in range(5)], dtype = "datetime64[m]")
+    
+    expected = np.array([5.0, 10.0, np.nan, np.nan, 5.5])
+
+    actual = nwispy_filereader.convert_column(column = np.array(["5.0", "10.0_", "", "Ice", "5.5"]), code = "03_00065", dates = dates)
+
+    np.testing.assert_equal(actual, expected)
+
+def test_parse_dates():
+
+    expected = np.array(["2013-06-05T00:00", "2013-06-05T00:15"], dtype = "datetime64[m]")
+
+    actual = nwispy_filereader.parse_dates(date_strings = np.array(["2013-06-05 00:00", "2013-06-05 00:15"]))
+    actual_not_padded = nwispy_filereader.parse_dates(date_strings = np.array(["2013-6-5 00:00", "2013-6-5 00:15"]))
+
+    np.testing.assert_array_equal(actual, expected)
+    np.testing.assert_array_equal(actual_not_padded, expected)
+
+def test_read_file_in_as_datetime():
+
+    expected_dates = [datetime.datetime(2010, 03, 01, 0, 0), datetime.datetime(2010, 03, 01, 0, 15), datetime.datetime(2010, 03, 01, 0, 30), 
+                      datetime.datetime(2010, 03, 01, 0, 45), datetime.datetime(2010, 03, 01, 1, 0)]
+
+    fileobj = StringIO(fixture["data_instantaneous_single_parameter"])
+    actual = nwispy_filereader.read_file_in(filestream = fileobj, as_datetime = True)
+
+    nose.tools.assert_equals(list(actual["dates"]), expected_dates)
+    nose.tools.assert_equals(actual["tz_cd"]["categories"], ["PST"])
+    nose.tools.assert_equals(list(actual["tz_cd"]["codes"]), [0, 0, 0, 0, 0])
+
+def test_read_chunks_in():
+
+    fileobj = StringIO(fixture["data_instantaneous_multi_parameter"])
+    chunks = list(nwispy_filereader.read_chunks_in(filestream = fileobj, chunk_size = 2))
+
+    nose.tools.assert_equals(len(chunks), 3)
+    nose.tools.assert_equals([len(chunk["dates"]) for chunk in chunks], [2, 2, 1])
+    nose.tools.assert_equals(chunks[0]["gage_name"], "USGS 03401385 DAVIS BRANCH AT HIGHWAY 988 NEAR MIDDLESBORO, KY")
+    nose.tools.assert_equals(len(chunks[0]["parameters"]), 6)
+    
+    np.testing.assert_array_equal(np.concatenate([chunk["parameters"][0]["data"] for chunk in chunks]), np.array([1.0, 2.0, 3.0, 4.0, 5.0]))
+    np.testing.assert_array_equal(chunks[2]["dates"], np.array(["2013-06-06T01:00"], dtype = "datetime64[m]"))
+
+def test_read_file_in_qualifiers():
+
+    fileobj = StringIO(fixture["data_daily_single_parameter"].replace("150\tA", "150\tA:e").replace("125\tA", "125\tP"))
+    actual = nwispy_filereader.read_file_in(filestream = fileobj)
+
+    nose.tools.assert_equals(actual["qualification_codes"].keys(), ["A", "P", "e"])
+    nose.tools.assert_equals(actual["qualification_codes"]["e"], "Value has been estimated.")
+
+    parameter = actual["parameters"][0]
+    nose.tools.assert_equals(parameter["qualifiers"]["categories"], ["A", "A:e", "P"])
+    nose.tools.assert_equals(list(parameter["qualifiers"]["codes"]), [0, 0, 0, 1, 2])
+
+    np.testing.assert_array_equal(parameter.get_qualifier_mask(include = ["A"]), np.array([True, True, True, True, False]))
+    np.testing.assert_array_equal(parameter.get_qualifier_mask(exclude = ["e"]), np.array([True, True, True, False, True]))
+
+    # qualification codes are joined across chunks
+    fileobj = StringIO(fixture["data_daily_single_parameter"].replace("125\tA", "125\tP"))
+    chunks = list(nwispy_filereader.read_chunks_in(filestream = fileobj, chunk_size = 2))
+    nose.tools.assert_equals(chunks[0]["parameters"][0]["qualifiers"]["categories"], ["A"])
+
+    fileobj = StringIO(fixture["data_daily_single_parameter"].replace("125\tA", "125\tP"))
+    actual = nwispy_filereader.read_file_in(filestream = fileobj)
+    nose.tools.assert_equals(actual["parameters"][0]["qualifiers"]["categories"], ["A", "P"])
+    nose.tools.assert_equals(list(actual["parameters"][0]["qualifiers"]["codes"]), [0, 0, 0, 0, 1])
+
+def test_read_file_in_timestep():
+
+    # a single row has no interval between dates
+    lines = fixture["data_daily_single_parameter"].rstrip().splitlines()
+    actual = nwispy_filereader.read_file_in(filestream = StringIO("\n".join(lines[:-4])))
+
+    nose.tools.assert_equals(len(actual), 1)
+    nose.tools.assert_equals(actual["timestep"], "daily")
+    nose.tools.assert_equals(actual["step"], None)
+
+    lines = fixture["data_instantaneous_single_parameter"].rstrip().splitlines()
+    actual = nwispy_filereader.read_file_in(filestream = StringIO("\n".join(lines[:-4])))
+
+    nose.tools.assert_equals(actual["timestep"], "instantaneous")
+
+    # the timestep is the most common interval; a gap does not change it
+    lines = fixture["data_daily_single_parameter"].rstrip().splitlines()
+    actual = nwispy_filereader.read_file_in(filestream = StringIO("\n".join(lines[:-2] + lines[-1:])))
+
+    nose.tools.assert_equals(actual["timestep"], "daily")
+    nose.tools.assert_equals(actual["step"], None)
+    np.testing.assert_array_equal(actual["gaps"]["start"], np.array(["2012-07-03"], dtype = "datetime64[m]"))
+    np.testing.assert_array_equal(actual["gaps"]["missing"], np.array([1]))
+
+    actual = nwispy_filereader.read_file_in(filestream = StringIO(fixture["data_daily_single_parameter"]))
+
+    nose.tools.assert_equals(actual["step"], np.timedelta64(1, "D"))
+    nose.tools.assert_equals(actual.get_index(datetime.datetime(2012, 07, 04)), 3)
+
+def test_read_sites_in():
+
+    fileobj = StringIO(fixture["data_daily_multi_site"])
+    sites = nwispy_filereader.read_sites_in(filestream = fileobj)
+
+    nose.tools.assert_equals(sites.keys(), ["03290500", "03298500"])
+
+    data = sites["03290500"]
+    nose.tools.assert_equals(data["site_no"], "03290500")
+    nose.tools.assert_equals(data["gage_name"], "USGS 03290500 KENTUCKY RIVER AT LOCK 2 AT LOCKPORT, KY")
+    nose.tools.assert_equals(data["timestep"], "daily")
+    nose.tools.assert_equals(data.codes, ["06_00060_00003"])
+    nose.tools.assert_equals(data["qualification_codes"].keys(), ["A"])
+    np.testing.assert_array_equal(data["parameters"][0]["data"], np.array([171.0, 190.0, 164.0]))
+
+    # column indices are found again in the column layout of each site
+    data = sites["03298500"]
+    nose.tools.assert_equals(data["gage_name"], "USGS 03298500 SALT RIVER AT SHEPHERDSVILLE, KY")
+    nose.tools.assert_equals(data.codes, ["08_80154_00003", "05_00060_00003"])
+    nose.tools.assert_equals([parameter["index"] for parameter in data["parameters"]], [5, 3])
+    nose.tools.assert_equals(data["qualification_codes"].keys(), ["A", "e"])
+    np.testing.assert_array_equal(data.get_parameter("08_80154_00003")["data"], np.array([269.0, 134.0]))
+    np.testing.assert_array_equal(data.get_parameter("05_00060_00003")["data"], np.array([1880.0, 1450.0]))
+    np.testing.assert_array_equal(data["dates"], np.array(["1955-01-01", "1955-01-02"], dtype = "datetime64[m]"))
+
+    # a chunk never holds the data of more than one site
+    fileobj = StringIO(fixture["data_daily_multi_site"])
+    chunks = list(nwispy_filereader.read_chunks_in(filestream = fileobj, chunk_size = 2))
+    nose.tools.assert_equals([(chunk["site_no"], len(chunk["dates"])) for chunk in chunks], [("03290500", 2), ("03290500", 1), ("03298500", 2)])
+
+    # a single dataset can only be read from a file with one site
+    nose.tools.assert_raises(ValueError, nwispy_filereader.read_file_in, StringIO(fixture["data_daily_multi_site"]))
+
+    fileobj = StringIO(fixture["data_daily_single_parameter"])
+    nose.tools.assert_equals(nwispy_filereader.read_file_in(filestream = fileobj)["site_no"], "03290500")
+
+def test_read_file_cache():
+
+    tmpdir = tempfile.mkdtemp()
+    filepath = os.path.join(tmpdir, "03401385_uv.txt")
+    
+    try:
+        with open(filepath, "w") as f:
+            f.write(fixture["data_instantaneous_multi_parameter"])
+    
+        nose.tools.assert_equals(nwispy_filereader.read_cache(filepath), None)
+
+        expected = nwispy_filereader.read_file(filepath, use_cache = True)
+        actual = nwispy_filereader.read_cache(filepath)
+
+        nose.tools.assert_equals(actual["gage_name"], expected["gage_name"])
+        nose.tools.assert_equals(actual["column_names"], expected["column_names"])
+        nose.tools.assert_equals(actual["timestep"], expected["timestep"])
+        nose.tools.assert_equals(actual["tz_cd"]["categories"], expected["tz_cd"]["categories"])
+        nose.tools.assert_equals(actual["parameters"][5]["code"], expected["parameters"][5]["code"])
+        nose.tools.assert_almost_equals(actual["parameters"][5]["mean"], expected["parameters"][5]["mean"])
+        
+        np.testing.assert_array_equal(actual["dates"], expected["dates"])
+        np.testing.assert_array_equal(actual["parameters"][5]["data"], expected["parameters"][5]["data"])
+
+        nose.tools.assert_equals(actual["qualification_codes"], expected["qualification_codes"])
+        nose.tools.assert_equals(actual["step"], expected["step"])
+        np.testing.assert_array_equal(actual["gaps"]["start"], expected["gaps"]["start"])
+        nose.tools.assert_equals(actual["parameters"][5]["qualifiers"]["categories"], expected["parameters"][5]["qualifiers"]["categories"])
+        np.testing.assert_array_equal(actual["parameters"][5]["qualifiers"]["codes"], expected["parameters"][5]["qualifiers"]["codes"])
+
+        # a dataset read from the cache can be changed without changing the cache
+        warm = nwispy_filereader.read_file(filepath, use_cache = True)
+        warm["parameters"][5]["data"][0] = -999.0
+        warm["parameters"][5]["qualifiers"]["codes"][0] = 0
+        warm["dates"][0] = np.datetime64("1900-01-01T00:00")
+        
+        nose.tools.assert_equals(warm["parameters"][5]["data"][0], -999.0)
+        
+        actual = nwispy_filereader.read_cache(filepath)
+        np.testing.assert_array_equal(actual["dates"], expected["dates"])
+        np.testing.assert_array_equal(actual["parameters"][5]["data"], expected["parameters"][5]["data"])
+        np.testing.assert_array_equal(actual["parameters"][5]["qualifiers"]["codes"], expected["parameters"][5]["qualifiers"]["codes"])
+
+        # a changed file is not read from the cache
+        with open(filepath, "a") as f:
+            f.write("\n")
+            
+        nose.tools.assert_equals(nwispy_filereader.read_cache(filepath), None)
+        
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_read_file_compressed():
+
+    tmpdir = tempfile.mkdtemp()
+    filepath = os.path.join(tmpdir, "03401385_uv.txt")
+
+    try:
+        with open(filepath, "w") as f:
+            f.write(fixture["data_instantaneous_multi_parameter"])
+
+        expected = nwispy_filereader.read_file(filepath)
+
+        for ext in [".gz", ".bz2"]:
+            with nwispy_helpers.open_file(filepath + ext, "wb") as f:
+                f.write(fixture["data_instantaneous_multi_parameter"])
+
+            actual = nwispy_filereader.read_file(filepath + ext)
+
+            nose.tools.assert_equals(actual["gage_name"], expected["gage_name"])
+            nose.tools.assert_equals(actual.codes, expected.codes)
+            np.testing.assert_array_equal(actual["dates"], expected["dates"])
+            np.testing.assert_array_equal(actual.values, expected.values)
+
+    finally:
+        shutil.rmtree(tmpdir)
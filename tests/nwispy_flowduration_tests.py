@@ -0,0 +1,109 @@
+import nose.tools
+
+import sys
+import numpy as np
+
+# my module
+from nwispy import nwispy_flowduration
+from nwispy import nwispy_dataset
+
+# define the global fixture to hold the data that goes into the functions you test
+fixture = {}
+
+def setup():
+    """ Setup fixture for testing """
+
+    print >> sys.stderr, "SETUP: nwispy_flowduration tests"
+
+    fixture["dates"] = np.arange("2013-01-01", "2015-01-01", dtype = "datetime64[D]").astype("datetime64[m]")
+    fixture["values"] = np.arange(1.0, len(fixture["dates"]) + 1)
+
+def teardown():
+    """ Print to standard error when all tests are finished """
+
+    print >> sys.stderr, "TEARDOWN: nwispy_flowduration tests"
+
+def _expected_flows(values, probabilities):
+    """ Interpolate the flows of exceedance probabilities on the flow duration curve """
+
+    curve = nwispy_flowduration.compute_exceedance_curve(values)
+
+    return np.interp(probabilities, curve["probabilities"], curve["flows"])
+
+def test_is_discharge():
+
+    nose.tools.assert_true(nwispy_flowduration.is_discharge("06_00060_00003"))
+    nose.tools.assert_true(nwispy_flowduration.is_discharge("02_00060"))
+    nose.tools.assert_false(nwispy_flowduration.is_discharge("02_00065"))
+
+def test_compute_exceedance_curve():
+
+    curve = nwispy_flowduration.compute_exceedance_curve([1.0, np.nan, 4.0, 2.0])
+
+    np.testing.assert_array_equal(curve["flows"], np.array([4.0, 2.0, 1.0]))
+    np.testing.assert_array_equal(curve["probabilities"], np.array([25.0, 50.0, 75.0]))
+
+def test_compute_flow_duration():
+
+    flow_duration = nwispy_flowduration.compute_flow_duration(np.arange(1.0, 100.0), probabilities = [0.1, 10, 50, 90, 99.9])
+
+    np.testing.assert_array_equal(flow_duration["flows"], np.array([99.0, 90.0, 50.0, 10.0, 1.0]))
+    nose.tools.assert_equals(flow_duration["count"], 99)
+
+    # default probabilities
+    flow_duration = nwispy_flowduration.compute_flow_duration(fixture["values"])
+
+    np.testing.assert_array_equal(flow_duration["probabilities"], np.array(nwispy_flowduration.EXCEEDANCE_PROBABILITIES))
+    np.testing.assert_allclose(flow_duration["flows"], _expected_flows(fixture["values"], flow_duration["probabilities"]))
+
+def test_compute_flow_duration_columns():
+
+    values = np.full((len(fixture["values"]), 3), np.nan)
+    values[:, 0] = fixture["values"]
+    values[:100, 1] = np.random.rand(100)
+
+    flow_duration = nwispy_flowduration.compute_flow_duration(values, probabilities = [5, 50, 95])
+
+    np.testing.assert_array_equal(flow_duration["count"], np.array([len(fixture["values"]), 100, 0]))
+    np.testing.assert_allclose(flow_duration["flows"][:, 0], _expected_flows(values[:, 0], [5, 50, 95]))
+    np.testing.assert_allclose(flow_duration["flows"][:, 1], _expected_flows(values[:, 1], [5, 50, 95]))
+    nose.tools.assert_true(np.all(np.isnan(flow_duration["flows"][:, 2])))
+
+def test_compute_flow_duration_by():
+
+    values = fixture["values"][::-1].copy()
+    values[::3] = np.nan
+
+    flow_duration = nwispy_flowduration.compute_flow_duration_by(fixture["dates"], values, by = "month", probabilities = [10, 50, 90])
+
+    np.testing.assert_array_equal(flow_duration["keys"], np.arange(1, 13))
+
+    months = fixture["dates"].astype("datetime64[M]").astype(np.int64) % 12 + 1
+    for i, month in enumerate(flow_duration["keys"]):
+        nose.tools.assert_equals(flow_duration["count"][i], np.sum(~np.isnan(values[months == month])))
+        np.testing.assert_allclose(flow_duration["flows"][i], _expected_flows(values[months == month], [10, 50, 90]))
+
+    flow_duration = nwispy_flowduration.compute_flow_duration_by(fixture["dates"], values, by = "year")
+
+    np.testing.assert_array_equal(flow_duration["keys"], np.array([2013, 2014]))
+    np.testing.assert_allclose(flow_duration["flows"][1], _expected_flows(values[365:], nwispy_flowduration.EXCEEDANCE_PROBABILITIES))
+
+def test_compute_flow_durations():
+
+    parameters = [
+        {"code": "06_00060_00003", "description": "Discharge, cubic feet per second (Mean)", "index": 3},
+        {"code": "07_00065_00003", "description": "Gage height, feet (Mean)", "index": 5}
+    ]
+
+    datasets = []
+    for site_no, length in [("03290500", 100), ("03284000", len(fixture["values"]))]:
+        values = np.column_stack([fixture["values"][:length], np.zeros(length)])
+        datasets.append(nwispy_dataset.NwisDataset(dates = fixture["dates"][:length], values = values, parameters = parameters, site_no = site_no))
+
+    flow_durations = nwispy_flowduration.compute_flow_durations(datasets, probabilities = [10, 50, 90])
+
+    nose.tools.assert_equals(flow_durations["site_no"], ["03290500", "03284000"])
+    nose.tools.assert_equals(flow_durations["code"], ["06_00060_00003", "06_00060_00003"])
+    np.testing.assert_array_equal(flow_durations["count"], np.array([100, len(fixture["values"])]))
+    np.testing.assert_allclose(flow_durations["flows"][:, 0], _expected_flows(fixture["values"][:100], [10, 50, 90]))
+    np.testing.assert_allclose(flow_durations["flows"][:, 1], _expected_flows(fixture["values"], [10, 50, 90]))
@@ -1,7 +1,12 @@
 import nose.tools
 from nose import with_setup
 
+import os
 import sys
+import logging
+import gzip
+import shutil
+import tempfile
 import numpy as np
 import datetime
 
@@ -41,6 +46,69 @@ def test_convert_to_float():
     nose.tools.assert_almost_equals(np.array(np.nan).all(), np.array(helpers.convert_to_float("", helper_str = "My help message")).all())
     nose.tools.assert_almost_equals(np.array(np.nan).all(), np.array(helpers.convert_to_float("hello", helper_str = "My help message")).all())
 
+def test_convert_to_floats():
+
+    dates = np.array([datetime.datetime(2014, 01, 01, 0, 0) + datetime.timedelta(minutes = 15 * i) for i in range(7)], dtype = "datetime64[m]")
+    values = np.array(["6.25", "", "Ice", "2.5_", "", "Eqp", "-1"])
+
+    # capture the log messages
+    class ListHandler(logging.Handler):
+        def __init__(self):
+            logging.Handler.__init__(self)
+            self.messages = []
+        def emit(self, record):
+            self.messages.append(record.getMessage())
+
+    handler = ListHandler()
+    logging.getLogger().addHandler(handler)
+    try:
+        floats, mask = helpers.convert_to_floats(values, helper_str = "parameter 02_00065", dates = dates)
+    finally:
+        logging.getLogger().removeHandler(handler)
+
+    np.testing.assert_equal(floats, np.array([6.25, np.nan, np.nan, 2.5, np.nan, np.nan, -1.0]))
+    np.testing.assert_equal(mask, np.array([False, True, True, False, True, True, False]))
+
+    # one summary for missing values and one for bad values
+    nose.tools.assert_equals(handler.messages, ["*Missing value* parameter 02_00065: 2 value(s) from 2014-01-01_00.15 to 2014-01-01_01.00. *Solution* - Replacing with NaN value",
+                                                "*Bad value* parameter 02_00065: 2 value(s) from 2014-01-01_00.30 to 2014-01-01_01.15. *Solution* - Replacing with NaN value"])
+
+    # good values
+    floats, mask = helpers.convert_to_floats(np.array(["1", "2.5"]))
+    np.testing.assert_equal(floats, np.array([1.0, 2.5]))
+    nose.tools.assert_false(mask.any())
+
+def test_find_timestep():
+
+    dates = np.array(["2014-01-01T00:00", "2014-01-01T00:15", "2014-01-01T00:30", "2014-01-01T01:15", "2014-01-01T01:30", "2014-01-01T02:30"], dtype = "datetime64[m]")
+    timestep = helpers.find_timestep(dates)
+
+    nose.tools.assert_equals(timestep["step"], np.timedelta64(15, "m"))
+    nose.tools.assert_false(timestep["regular"])
+    np.testing.assert_equal(timestep["gaps"]["start"], dates[[2, 4]])
+    np.testing.assert_equal(timestep["gaps"]["end"], dates[[3, 5]])
+    np.testing.assert_equal(timestep["gaps"]["missing"], np.array([2, 3]))
+
+    timestep = helpers.find_timestep(dates[:3])
+    nose.tools.assert_equals(timestep["step"], np.timedelta64(15, "m"))
+    nose.tools.assert_true(timestep["regular"])
+    nose.tools.assert_equals(len(timestep["gaps"]["missing"]), 0)
+
+    # less than two dates have no timestep
+    for dates in [dates[:1], dates[:0]]:
+        timestep = helpers.find_timestep(dates)
+        nose.tools.assert_equals(timestep["step"], None)
+        nose.tools.assert_false(timestep["regular"])
+
+def test_get_qualifier_mask():
+
+    qualifiers = helpers.encode_categorical(np.array(["A", "A:e", "P", "P:e", "P Ice", ""]))
+
+    np.testing.assert_equal(helpers.get_qualifier_mask(qualifiers, include = ["A"]), np.array([True, True, False, False, False, False]))
+    np.testing.assert_equal(helpers.get_qualifier_mask(qualifiers, exclude = ["e"]), np.array([True, False, True, False, True, True]))
+    np.testing.assert_equal(helpers.get_qualifier_mask(qualifiers, include = ["A", "P"], exclude = ["e", "Ice"]), np.array([True, False, True, False, False, False]))
+    np.testing.assert_equal(helpers.get_qualifier_mask(qualifiers), np.ones(6, dtype = bool))
+
 def test_rmspecialchars():
     
     nose.tools.assert_equals("6.5", helpers.rmspecialchars("*6.5_"))
@@ -109,6 +177,77 @@ def test_subset_data_dates_outside_range():
     nose.tools.assert_equals(actual_dates.all(), expected_dates.all())
     nose.tools.assert_equals(actual_values.all(), expected_values.all())
 
+def test_subset_data_dates_between_rows():
+
+    # bounds that are not dates in the array
+    actual_dates, actual_values = helpers.subset_data(dates = fixture["dates"], 
+                                                      values = fixture["values"], 
+                                                      start_date = datetime.datetime(2014, 01, 03, 12, 0), 
+                                                      end_date = datetime.datetime(2014, 01, 06, 12, 0))
+
+    np.testing.assert_array_equal(actual_values, np.array([3, 4, 5]))
+
+    actual_dates, actual_values = helpers.subset_data(dates = helpers.to_datetime64(fixture["dates"]), 
+                                                      values = fixture["values"], 
+                                                      start_date = datetime.datetime(2014, 01, 04), 
+                                                      end_date = datetime.datetime(2014, 01, 06), 
+                                                      closed = "left")
+
+    np.testing.assert_array_equal(actual_values, np.array([3, 4]))
+
+def test_subset_data_repeated_hour():
+
+    # local dates repeat the hour after clocks fall back, so they are not sorted
+    dates = np.array(["2014-11-02T00:30", "2014-11-02T01:00", "2014-11-02T01:30", "2014-11-02T01:00", "2014-11-02T01:30", "2014-11-02T02:00"], dtype = "datetime64[m]")
+    values = np.arange(6.0)
+
+    actual_dates, actual_values = helpers.subset_data(dates = dates, values = values, 
+                                                      start_date = datetime.datetime(2014, 11, 02, 1, 0), 
+                                                      end_date = datetime.datetime(2014, 11, 02, 1, 30))
+
+    np.testing.assert_array_equal(actual_values, np.array([1.0, 2.0, 3.0, 4.0]))
+    np.testing.assert_array_equal(actual_dates, dates[1:5])
+
+    actual_dates, actual_values = helpers.subset_data(dates = dates, values = values, 
+                                                      start_date = datetime.datetime(2014, 11, 02, 1, 0), 
+                                                      end_date = datetime.datetime(2014, 11, 02, 1, 30), 
+                                                      closed = "left")
+
+    np.testing.assert_array_equal(actual_values, np.array([1.0, 3.0]))
+
+def test_find_date_indices():
+
+    dates = helpers.to_datetime64(fixture["dates"])
+    start, end = datetime.datetime(2014, 01, 04), datetime.datetime(2014, 01, 06)
+
+    nose.tools.assert_equals(helpers.find_date_indices(dates, start, end), (3, 6))
+    nose.tools.assert_equals(helpers.find_date_indices(dates, start, end, closed = "left"), (3, 5))
+    nose.tools.assert_equals(helpers.find_date_indices(dates, start, end, closed = "right"), (4, 6))
+    nose.tools.assert_equals(helpers.find_date_indices(dates, start, end, closed = "neither"), (4, 5))
+    nose.tools.assert_equals(helpers.find_date_indices(dates, end, start), (5, 5))
+    nose.tools.assert_equals(helpers.find_date_indices(dates, None, start), (0, 4))
+    nose.tools.assert_equals(helpers.find_date_indices(fixture["dates"], start, None), (3, len(dates)))
+    nose.tools.assert_raises(ValueError, helpers.find_date_indices, dates, start, end, "open")
+
+    # many windows in one call
+    starts, ends = helpers.find_date_indices(dates, [datetime.datetime(2013, 12, 01), start, datetime.datetime(2014, 01, 10, 6, 0)], 
+                                                    [datetime.datetime(2014, 01, 02), end, datetime.datetime(2014, 02, 01)])
+
+    np.testing.assert_array_equal(starts, np.array([0, 3, 10]))
+    np.testing.assert_array_equal(ends, np.array([2, 6, 11]))
+
+def test_subset_windows():
+
+    subsets = helpers.subset_windows(dates = fixture["dates"], values = fixture["values"], 
+                                     start_dates = [datetime.datetime(2014, 01, 01), datetime.datetime(2014, 01, 05)], 
+                                     end_dates = [datetime.datetime(2014, 01, 02), datetime.datetime(2014, 01, 07)],
+                                     closed = "left")
+
+    nose.tools.assert_equals(len(subsets), 2)
+    np.testing.assert_array_equal(subsets[0][1], np.array([0]))
+    np.testing.assert_array_equal(subsets[1][1], np.array([4, 5]))
+    nose.tools.assert_equals(list(subsets[1][0]), [datetime.datetime(2014, 01, 05), datetime.datetime(2014, 01, 06)])
+
 def test_find_start_end_dates_shorter_range():
 
     expected_start_date = datetime.datetime(2014, 01, 03, 0, 0)
@@ -128,3 +267,108 @@ def test_find_start_end_dates_longer_range():
 
     nose.tools.assert_equals(actual_start_date, expected_start_date)
     nose.tools.assert_equals(actual_end_date, expected_end_date)
+
+def test_find_start_end_dates_no_common_dates():
+
+    dates = helpers.to_datetime64(fixture["dates"])
+
+    # overlapping ranges without a common date
+    nose.tools.assert_raises(ValueError, helpers.find_start_end_dates, dates, dates + np.timedelta64(30, "m"))
+
+    # ranges that do not overlap
+    nose.tools.assert_raises(ValueError, helpers.find_start_end_dates, dates[:3], dates[5:])
+
+    nose.tools.assert_equals(helpers.find_start_end_dates(dates[:6], dates[5:]), (dates[5], dates[5]))
+
+def test_align_dates():
+
+    dates1 = np.array(["2014-01-01", "2014-01-02", "2014-01-03", "2014-01-05"], dtype = "datetime64[m]")
+    dates2 = np.array(["2014-01-02", "2014-01-03", "2014-01-04", "2014-01-05"], dtype = "datetime64[m]")
+    dates3 = fixture["dates"][2:]
+
+    index, indexers = helpers.align_dates([dates1, dates2, dates3])
+
+    np.testing.assert_array_equal(index, np.array(["2014-01-03", "2014-01-05"], dtype = "datetime64[m]"))
+    np.testing.assert_array_equal(indexers[0], np.array([2, 3]))
+    np.testing.assert_array_equal(indexers[1], np.array([1, 3]))
+    np.testing.assert_array_equal(indexers[2], np.array([0, 2]))
+
+    index, indexers = helpers.align_dates([dates1, dates2], how = "outer")
+
+    np.testing.assert_array_equal(index, np.array(["2014-01-01", "2014-01-02", "2014-01-03", "2014-01-04", "2014-01-05"], dtype = "datetime64[m]"))
+    np.testing.assert_array_equal(indexers[0], np.array([0, 1, 2, -1, 3]))
+    np.testing.assert_array_equal(indexers[1], np.array([-1, 0, 1, 2, 3]))
+
+    np.testing.assert_array_equal(helpers.reindex_values(np.array([1.0, 2.0, 3.0, 5.0]), indexers[0]), np.array([1.0, 2.0, 3.0, np.nan, 5.0]))
+
+    # an empty array (e.g. of a file without data) aligned with outer dates is all fill values
+    index, indexers = helpers.align_dates([dates1, np.array([], dtype = "datetime64[m]")], how = "outer")
+
+    np.testing.assert_array_equal(indexers[1], np.array([-1, -1, -1, -1]))
+    np.testing.assert_array_equal(helpers.reindex_values(np.array([]), indexers[1]), np.array([np.nan] * 4))
+    np.testing.assert_array_equal(helpers.reindex_values(np.zeros((0, 2)), indexers[1], fill_value = 0.0), np.zeros((4, 2)))
+
+    nose.tools.assert_raises(ValueError, helpers.align_dates, [dates1, dates2], "left")
+
+def test_to_datetime64():
+
+    expected = np.array(["2014-01-01T00:00", "2014-01-02T00:00"], dtype = "datetime64[m]")
+
+    actual = helpers.to_datetime64(fixture["dates"][0:2])
+
+    np.testing.assert_array_equal(actual, expected)
+    nose.tools.assert_equals(list(helpers.to_datetime(actual)), list(fixture["dates"][0:2]))
+
+def test_encode_categorical():
+
+    actual = helpers.encode_categorical(np.array(["EST", "EST", "EDT", "EST"]))
+
+    nose.tools.assert_equals(actual["categories"], ["EDT", "EST"])
+    nose.tools.assert_equals(list(actual["codes"]), [1, 1, 0, 1])
+    nose.tools.assert_equals(actual["codes"].dtype, np.int8)
+
+def test_concatenate_categorical():
+
+    categoricals = [helpers.encode_categorical(np.array(["EST", "EST"])), helpers.encode_categorical(np.array(["EST", "EDT"]))]
+
+    actual = helpers.concatenate_categorical(categoricals)
+
+    nose.tools.assert_equals(actual["categories"], ["EDT", "EST"])
+    nose.tools.assert_equals(list(actual["codes"]), [1, 1, 1, 0])
+
+def test_open_file():
+
+    tmpdir = tempfile.mkdtemp()
+    text = "# comment\nUSGS\t03290500\t2012-07-01\t171\tA\n" * 100
+
+    try:
+        for filename in ["file.txt", "file.txt.gz", "file.txt.bz2"]:
+            filepath = os.path.join(tmpdir, filename)
+            with helpers.open_file(filepath, "wb") as f:
+                f.write(text)
+
+            with helpers.open_file(filepath, "rb") as f:
+                nose.tools.assert_equals(list(f), text.splitlines(True))
+
+        # compressed while written
+        with gzip.open(os.path.join(tmpdir, "file.txt.gz"), "rb") as f:
+            nose.tools.assert_equals(f.read(), text)
+
+        nose.tools.assert_true(os.path.getsize(os.path.join(tmpdir, "file.txt.gz")) < len(text) / 10)
+
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_convert_time_zone():
+
+    # daylight saving time starts 2014-03-09 at 02:00 EST
+    dates = np.array(["2014-03-09T01:30", "2014-03-09T01:45", "2014-03-09T03:00", "2014-03-09T03:15"], dtype = "datetime64[m]")
+    tz_cd = helpers.encode_categorical(["EST", "EST", "EDT", "EDT"])
+
+    expected = np.array(["2014-03-09T01:30", "2014-03-09T01:45", "2014-03-09T02:00", "2014-03-09T02:15"], dtype = "datetime64[m]")
+    np.testing.assert_array_equal(helpers.convert_time_zone(dates, tz_cd, "EST"), expected)
+
+    expected = np.array(["2014-03-09T06:30", "2014-03-09T06:45", "2014-03-09T07:00", "2014-03-09T07:15"], dtype = "datetime64[m]")
+    np.testing.assert_array_equal(helpers.convert_time_zone(dates, tz_cd, "UTC"), expected)
+
+    nose.tools.assert_raises(ValueError, helpers.convert_time_zone, dates, tz_cd, "XYZ")
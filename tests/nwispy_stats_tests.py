@@ -0,0 +1,230 @@
+import nose.tools
+
+import sys
+import numpy as np
+import datetime
+
+# my module
+from nwispy import nwispy_stats
+from nwispy import nwispy_helpers as helpers
+
+# define the global fixture to hold the data that goes into the functions you test
+fixture = {}
+
+def setup():
+    """ Setup fixture for testing """
+
+    print >> sys.stderr, "SETUP: nwispy_stats tests"
+
+    fixture["values"] = np.asfortranarray([[1.0, 10.0, np.nan], [2.0, np.nan, np.nan], [3.0, 30.0, np.nan], [4.0, 40.0, np.nan], [5.0, 15.0, np.nan]])
+
+def teardown():
+    """ Print to standard error when all tests are finished """
+
+    print >> sys.stderr, "TEARDOWN: nwispy_stats tests"
+
+def test_compute_stats():
+
+    stats = nwispy_stats.compute_stats(fixture["values"], percentiles = [50, 90])
+
+    np.testing.assert_array_equal(stats["count"], np.array([5, 4, 0]))
+    np.testing.assert_allclose(stats["mean"], np.array([3.0, 23.75, np.nan]))
+    np.testing.assert_allclose(stats["std"], np.nanstd(fixture["values"][:, :2], axis = 0).tolist() + [np.nan])
+    np.testing.assert_array_equal(stats["min"], np.array([1.0, 10.0, np.nan]))
+    np.testing.assert_array_equal(stats["max"], np.array([5.0, 40.0, np.nan]))
+    np.testing.assert_allclose(stats["percentiles"][50], np.array([3.0, 22.5, np.nan]))
+    np.testing.assert_allclose(stats["percentiles"][90], np.nanpercentile(fixture["values"][:, :2], 90, axis = 0).tolist() + [np.nan])
+
+def test_compute_stats_1d():
+
+    stats = nwispy_stats.compute_stats([2, np.nan, 6, 1])
+
+    nose.tools.assert_equals(stats["count"], 3)
+    nose.tools.assert_almost_equals(stats["mean"], 3.0)
+    nose.tools.assert_almost_equals(stats["std"], np.nanstd([2, np.nan, 6, 1]))
+    nose.tools.assert_equals(stats["min"], 1.0)
+    nose.tools.assert_equals(stats["max"], 6.0)
+
+    stats = nwispy_stats.compute_stats([])
+
+    nose.tools.assert_equals(stats["count"], 0)
+    nose.tools.assert_true(np.isnan(stats["mean"]))
+
+def test_merge_stats():
+
+    expected = nwispy_stats.compute_stats(fixture["values"])
+
+    # merge the statistics of chunks as they would be streamed
+    actual = nwispy_stats.compute_stats(fixture["values"][:1])
+    for start in range(1, len(fixture["values"]), 2):
+        actual = nwispy_stats.merge_stats(actual, nwispy_stats.compute_stats(fixture["values"][start:start + 2]))
+
+    for key in ["count", "mean", "std", "m2", "min", "max"]:
+        np.testing.assert_allclose(actual[key], expected[key])
+
+    actual = nwispy_stats.merge_stats(nwispy_stats.compute_stats([np.nan]), nwispy_stats.compute_stats([1.0, 3.0]))
+
+    nose.tools.assert_equals(actual["count"], 2)
+    nose.tools.assert_almost_equals(actual["mean"], 2.0)
+    nose.tools.assert_almost_equals(actual["std"], 1.0)
+
+def test_compute_simple_stats():
+
+    nose.tools.assert_equals(helpers.compute_simple_stats([2, np.nan, 6, 1]), (3.0, 6.0, 1.0))
+    nose.tools.assert_raises(ValueError, helpers.compute_simple_stats, [np.nan, np.nan])
+
+def test_get_group_keys():
+
+    dates = np.array(["2012-02-29", "2013-09-30T23:45", "2013-10-01", "2013-12-31"], dtype = "datetime64[m]")
+
+    np.testing.assert_array_equal(nwispy_stats.get_group_keys(dates, by = "month"), np.array([2, 9, 10, 12]))
+    np.testing.assert_array_equal(nwispy_stats.get_group_keys(dates, by = "season"), np.array([0, 3, 3, 0]))
+    np.testing.assert_array_equal(nwispy_stats.get_group_keys(dates, by = "day_of_year"), np.array([60, 273, 274, 365]))
+    np.testing.assert_array_equal(nwispy_stats.get_group_keys(dates, by = "year"), np.array([2012, 2013, 2013, 2013]))
+    np.testing.assert_array_equal(nwispy_stats.get_group_keys(dates, by = "water_year"), np.array([2012, 2013, 2014, 2014]))
+    np.testing.assert_array_equal(nwispy_stats.get_group_keys(dates, by = "climatic_year"), np.array([2011, 2013, 2013, 2013]))
+
+    # the climatic year of April through March is named by the year it begins
+    climatic_dates = np.array(["2000-03-31T23:59", "2000-04-01", "2001-03-31", "2001-04-01"], dtype = "datetime64[m]")
+    np.testing.assert_array_equal(nwispy_stats.get_group_keys(climatic_dates, by = "climatic_year"), np.array([1999, 2000, 2000, 2001]))
+    np.testing.assert_array_equal(nwispy_stats.get_group_keys(dates, by = "year_month").astype("datetime64[M]"), 
+                                  np.array(["2012-02", "2013-09", "2013-10", "2013-12"], dtype = "datetime64[M]"))
+
+    nose.tools.assert_raises(ValueError, nwispy_stats.get_group_keys, dates, "week")
+
+def test_aggregate():
+
+    dates = np.arange("2012-01-01", "2014-01-01", dtype = "datetime64[D]").astype("datetime64[m]")
+    values = np.column_stack([np.arange(len(dates), dtype = float), np.random.rand(len(dates))])
+    values[::5, 1] = np.nan
+    values[:31, 1] = np.nan
+
+    for by in nwispy_stats.GROUPS:
+        aggregation = nwispy_stats.aggregate(dates, values, by = by, percentiles = [10, 50])
+        keys = nwispy_stats.get_group_keys(dates, by = by)
+
+        nose.tools.assert_equals(len(aggregation["keys"]), len(np.unique(keys)))
+
+        for i, key in enumerate(np.unique(keys)):
+            group = values[keys == key]
+
+            np.testing.assert_array_equal(aggregation["count"][i], np.sum(~np.isnan(group), axis = 0))
+            np.testing.assert_allclose(aggregation["mean"][i], _nan_reduce(np.nanmean, group))
+            np.testing.assert_allclose(aggregation["std"][i], _nan_reduce(np.nanstd, group))
+            np.testing.assert_allclose(aggregation["min"][i], _nan_reduce(np.nanmin, group))
+            np.testing.assert_allclose(aggregation["max"][i], _nan_reduce(np.nanmax, group))
+            np.testing.assert_allclose(aggregation["percentiles"][10][i], _nan_reduce(np.nanpercentile, group, 10))
+            np.testing.assert_allclose(aggregation["percentiles"][50][i], _nan_reduce(np.nanpercentile, group, 50))
+
+def test_aggregate_1d():
+
+    dates = np.array(["2014-01-01", "2014-02-01", "2014-01-02"], dtype = "datetime64[m]")
+    aggregation = nwispy_stats.aggregate(dates, [1.0, 5.0, 3.0], by = "month")
+
+    np.testing.assert_array_equal(aggregation["keys"], np.array([1, 2]))
+    np.testing.assert_array_equal(aggregation["count"], np.array([2, 1]))
+    np.testing.assert_array_equal(aggregation["mean"], np.array([2.0, 5.0]))
+
+    aggregation = nwispy_stats.aggregate(dates, [1.0, 5.0, 3.0], by = "year_month")
+    np.testing.assert_array_equal(aggregation["keys"], np.array(["2014-01", "2014-02"], dtype = "datetime64[M]"))
+
+    nose.tools.assert_raises(ValueError, nwispy_stats.aggregate, dates, [1.0, 2.0], "month")
+
+def _nan_reduce(function, values, *args):
+    """ Reduce each column of values with a nan function; nan for columns without values """
+
+    return np.array([function(column, *args) if np.any(~np.isnan(column)) else np.nan for column in values.T])
+
+def test_resample():
+
+    dates = np.arange("2014-01-01", "2014-01-04", 15, dtype = "datetime64[m]")
+    values = np.column_stack([np.arange(len(dates), dtype = float), np.ones(len(dates))])
+    values[100:150, 0] = np.nan
+
+    resampled = nwispy_stats.resample(dates, values, freq = "daily", step = np.timedelta64(15, "m"))
+
+    np.testing.assert_array_equal(resampled["dates"], np.array(["2014-01-01", "2014-01-02", "2014-01-03"], dtype = "datetime64[D]"))
+    np.testing.assert_array_equal(resampled["expected"], np.array([96, 96, 96]))
+    np.testing.assert_array_equal(resampled["count"], np.array([[96, 96], [46, 96], [96, 96]]))
+    np.testing.assert_allclose(resampled["mean"][:, 0], [47.5, np.mean(np.r_[96:100, 150:192]), 239.5])
+    np.testing.assert_array_equal(resampled["max"][:, 1], np.ones(3))
+
+    resampled = nwispy_stats.resample(dates, values, freq = "daily", step = np.timedelta64(15, "m"), min_fraction = 0.9)
+
+    nose.tools.assert_true(np.isnan(resampled["mean"][1, 0]))
+    nose.tools.assert_equals(resampled["mean"][1, 1], 1.0)
+    nose.tools.assert_equals(resampled["min"][2, 0], 192.0)
+
+    resampled = nwispy_stats.resample(dates, values[:, 0], freq = "hourly")
+
+    nose.tools.assert_equals(len(resampled["dates"]), 72)
+    nose.tools.assert_equals(resampled["mean"][0], 1.5)
+    nose.tools.assert_equals(resampled["expected"], None)
+
+    resampled = nwispy_stats.resample(dates, values[:, 0], freq = "monthly", step = np.timedelta64(1, "D"))
+
+    np.testing.assert_array_equal(resampled["dates"], np.array(["2014-01"], dtype = "datetime64[M]"))
+    np.testing.assert_array_equal(resampled["expected"], np.array([31]))
+
+    nose.tools.assert_raises(ValueError, nwispy_stats.resample, dates, values, "weekly")
+    nose.tools.assert_raises(ValueError, nwispy_stats.resample, dates, values, "daily", None, 0.9)
+
+def test_rolling():
+
+    values = np.array([3.0, 1.0, 4.0, np.nan, 5.0, 9.0, 2.0, 6.0])
+
+    np.testing.assert_array_equal(nwispy_stats.rolling(values, 3, statistic = "count"), np.array([1, 2, 3, 2, 2, 2, 3, 3]))
+    np.testing.assert_allclose(nwispy_stats.rolling(values, 3, statistic = "mean"), np.array([np.nan, np.nan, 8 / 3.0, np.nan, np.nan, np.nan, 16 / 3.0, 17 / 3.0]))
+    np.testing.assert_allclose(nwispy_stats.rolling(values, 3, statistic = "sum", min_count = 2), np.array([np.nan, 4.0, 8.0, 5.0, 9.0, 14.0, 16.0, 17.0]))
+    np.testing.assert_array_equal(nwispy_stats.rolling(values, 3, statistic = "min", min_count = 1), np.array([3.0, 1.0, 1.0, 1.0, 4.0, 5.0, 2.0, 2.0]))
+    np.testing.assert_array_equal(nwispy_stats.rolling(values, 3, statistic = "max", min_count = 1), np.array([3.0, 3.0, 4.0, 4.0, 5.0, 9.0, 9.0, 9.0]))
+
+    # a window longer than the values
+    np.testing.assert_array_equal(nwispy_stats.rolling(values[:2], 5, statistic = "max", min_count = 1), np.array([3.0, 3.0]))
+
+    # columns are rolled independently
+    rolled = nwispy_stats.rolling(np.column_stack([values, -values]), 2, statistic = "max", min_count = 1)
+    np.testing.assert_array_equal(rolled[:, 1], nwispy_stats.rolling(-values, 2, statistic = "max", min_count = 1))
+
+    nose.tools.assert_raises(ValueError, nwispy_stats.rolling, values, 0)
+    nose.tools.assert_raises(ValueError, nwispy_stats.rolling, values, 3, "median")
+
+def test_rolling_time_window():
+
+    dates = np.array(["2014-01-01T00:00", "2014-01-01T00:15", "2014-01-01T00:30", "2014-01-01T02:00", "2014-01-01T02:15"], dtype = "datetime64[m]")
+    values = np.array([1.0, 5.0, 2.0, 3.0, np.nan])
+
+    window = np.timedelta64(30, "m")
+    np.testing.assert_array_equal(nwispy_stats.rolling(values, window, statistic = "count", dates = dates), np.array([1, 2, 2, 1, 1]))
+    np.testing.assert_array_equal(nwispy_stats.rolling(values, window, statistic = "max", dates = dates), np.array([1.0, 5.0, 5.0, 3.0, 3.0]))
+    np.testing.assert_allclose(nwispy_stats.rolling(values, window, statistic = "mean", dates = dates), np.array([1.0, 3.0, 3.5, 3.0, 3.0]))
+
+    window = datetime.timedelta(hours = 3)
+    np.testing.assert_array_equal(nwispy_stats.rolling(values, window, statistic = "min", dates = dates), np.array([1.0, 1.0, 1.0, 1.0, 1.0]))
+
+    nose.tools.assert_raises(ValueError, nwispy_stats.rolling, values, window)
+
+def test_compute_low_flows():
+
+    dates = np.arange("2000-04-01", "2003-04-01", dtype = "datetime64[D]").astype("datetime64[m]")
+    values = np.full(len(dates), 100.0)
+    values[100:107] = 10.0
+    values[500:503] = 5.0
+    values[900] = np.nan
+
+    low_flows = nwispy_stats.compute_low_flows(dates, values, days = 7)
+
+    np.testing.assert_array_equal(low_flows["keys"], np.array([2000, 2001, 2002]))
+    np.testing.assert_allclose(low_flows["low_flows"], np.array([10.0, (3 * 5.0 + 4 * 100.0) / 7, 100.0]))
+    np.testing.assert_array_equal(low_flows["count"], np.array([359, 365, 358]))
+
+def test_compute_low_flow_frequency():
+
+    # symmetric logs have no skew; the low flow is a normal quantile of the logs
+    low_flows = 10 ** np.array([1.0, 1.5, 2.0, 2.5, 3.0])
+    expected = 10 ** (2.0 - 1.2815515655446004 * np.std(np.log10(low_flows), ddof = 1))
+
+    nose.tools.assert_almost_equals(nwispy_stats.compute_low_flow_frequency(low_flows, recurrence = 10), expected, places = 6)
+
+    nose.tools.assert_raises(ValueError, nwispy_stats.compute_low_flow_frequency, [1.0, 2.0])
+    nose.tools.assert_raises(ValueError, nwispy_stats.compute_low_flow_frequency, [1.0, 2.0, 0.0])
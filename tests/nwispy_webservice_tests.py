@@ -1,7 +1,19 @@
 import nose.tools
 from nose import with_setup
 
+import os
 import sys
+import shutil
+import tempfile
+import threading
+import socket
+import errno
+import urlparse
+import BaseHTTPServer
+import SocketServer
+import gzip
+import zlib
+import time
 import numpy as np
 import datetime
 from StringIO import StringIO
@@ -53,6 +65,45 @@ def setup():
         }
     ]
 
+    fixture["coalesced requests"] = [
+        {"data type": "dv", "site number": "03290500", "start date": "2012-07-02", "end date": "2012-07-03", "parameters": ["00060"]},
+        {"data type": "dv", "site number": "03298500", "start date": "1955-1-1", "end date": "1955-1-2", "parameters": ["80154"]},
+        {"data type": "dv", "site number": "03298500", "start date": "1955-01-02", "end date": "1955-01-03", "parameters": ["00060", "80155"]}
+    ]
+
+    fixture["coalesced file"] = \
+        """# retrieved: 2013-07-02 22:08:51 EDT       (sdww01)
+#
+# Data for the following 2 site(s) are contained in this file
+#    USGS 03290500 KENTUCKY RIVER AT LOCK 2 AT LOCKPORT, KY
+#    USGS 03298500 SALT RIVER AT SHEPHERDSVILLE, KY
+# -----------------------------------------------------------------------------------
+#
+# Data provided for site 03290500
+#    DD parameter statistic   Description
+#    06   00060     00003     Discharge, cubic feet per second (Mean)
+#    07   00065     00003     Gage height, feet (Mean)
+#
+agency_cd	site_no	datetime	06_00060_00003	06_00060_00003_cd	07_00065_00003	07_00065_00003_cd
+5s	15s	20d	14n	10s	14n	10s
+USGS	03290500	2012-07-01	171	A	4.3	A
+USGS	03290500	2012-07-02	190	A	4.4	A
+USGS	03290500	2012-07-03	164	A	4.2	A
+USGS	03290500	2012-07-04	151	A	4.1	A
+#
+# Data provided for site 03298500
+#    DD parameter statistic   Description
+#    05   00060     00003     Discharge, cubic feet per second (Mean)
+#    08   80154     00003     Suspended sediment concentration, milligrams per liter (Mean)
+#    09   80155     00003     Suspended sediment discharge, tons per day (Mean)
+#
+agency_cd	site_no	datetime	05_00060_00003	05_00060_00003_cd	08_80154_00003	08_80154_00003_cd	09_80155_00003	09_80155_00003_cd
+5s	15s	20d	14n	10s	14n	10s	14n	10s
+USGS	03298500	1955-01-01	1880	A	269	A	1360	A
+USGS	03298500	1955-01-02	1450	A	134	A	525	A
+USGS	03298500	1955-01-03	1160	A	80	A	250	A
+"""
+
 def teardown():
     """ Print to standard error when all tests are finished """
     
@@ -108,3 +159,575 @@ def test_endcode_url():
     nose.tools.assert_equals(actual_url[1], expected_url[1])
     nose.tools.assert_equals(actual_url[2], expected_url[2])
     nose.tools.assert_equals(actual_url[3], expected_url[3])
+
+
+class _NwisRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Stand-in for the NWIS webservice; responds to a post with the posted parameters """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path, query = urlparse.urlsplit(self.path)[2:4]
+        self.server.connections.add(self.client_address)
+        self.server.requests.append((query, self.headers.get("If-None-Match")))
+
+        if path.startswith("/moved/") or path.startswith("/loop/"):
+            location = self.server.redirect_url + path[len("/moved/"):] if path.startswith("/moved/") else path
+            self.send_response(301)
+            self.send_header("Location", location + "?" + query)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if path.startswith("/truncated/"):
+            # the connection is closed before the whole response is sent
+            self.close_connection = 1
+            self.send_response(200)
+            self.send_header("Content-Length", "100000")
+            self.end_headers()
+            self.wfile.write("# truncated\n" * 100)
+            return
+
+        if "site=99999999" in query:
+            self.send_response(400)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        etag = '"{0}"'.format(abs(hash(query)))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        response = "# path {0}\n{1}\n".format(path, query) * 1000
+        encoding = self.server.encoding if self.server.encoding and self.server.encoding in self.headers.get("Accept-Encoding", "") else None
+
+        if encoding == "gzip":
+            buf = StringIO()
+            with gzip.GzipFile(fileobj = buf, mode = "wb") as f:
+                f.write(response)
+            response = buf.getvalue()
+        elif encoding == "deflate":
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS if self.server.raw_deflate else zlib.MAX_WBITS)
+            response = compressor.compress(response) + compressor.flush()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(response)))
+        self.send_header("ETag", etag)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+class _NwisServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def _start_server():
+    """ Start a local stand-in webservice in a thread; return the server and its base url """
+
+    server = _NwisServer(("127.0.0.1", 0), _NwisRequestHandler)
+    server.connections = set()
+    server.requests = []
+    server.encoding = "gzip"
+    server.raw_deflate = False
+    server.failures = 0
+    server.redirect_url = "/nwis/"
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server, "http://127.0.0.1:{0}/nwis/".format(server.server_address[1])
+
+def test_download_files():
+
+    server, base_url = _start_server()
+    tempdir = tempfile.mkdtemp()
+
+    try:
+        downloads = []
+        for i, request in enumerate(fixture["data requests"][:3] * 4):
+            downloads.append({"url": nwispy_webservice.encode_url(request), "data type": request["data type"], "filename": "file_{0}.txt".format(i)})
+        downloads.append({"url": "site=99999999", "data type": "dv", "filename": "bad.txt"})
+
+        results = nwispy_webservice.download_files(downloads = downloads, file_destination = tempdir, max_workers = 3, base_url = base_url)
+
+        errors = dict(results)
+        nose.tools.assert_equals(len(results), 13)
+        nose.tools.assert_equals(errors[os.path.join(tempdir, "bad.txt")].code, 400)
+        nose.tools.assert_false(os.path.exists(os.path.join(tempdir, "bad.txt")))
+
+        for i, download in enumerate(downloads[:-1]):
+            filepath = os.path.join(tempdir, download["filename"])
+            nose.tools.assert_equals(errors[filepath], None)
+            with open(filepath, "r") as f:
+                expected = "# path /nwis/{0}/\n{1}\n".format(download["data type"], download["url"]) * 1000
+                nose.tools.assert_equals(f.read(), expected)
+
+        # each worker reuses its connection; a new connection is only opened after an error response
+        nose.tools.assert_true(len(server.connections) <= 4)
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tempdir)
+
+def test_iter_downloads():
+
+    server, base_url = _start_server()
+    tempdir = tempfile.mkdtemp()
+
+    try:
+        downloads = []
+        for i, request in enumerate(fixture["data requests"][:3] * 4):
+            downloads.append({"url": nwispy_webservice.encode_url(request), "data type": request["data type"], "filename": "file_{0}.txt".format(i)})
+
+        # each download is complete on disk when it is yielded
+        filepaths = []
+        for filepath, error in nwispy_webservice.iter_downloads(downloads = downloads, file_destination = tempdir, max_workers = 2, base_url = base_url, max_pending = 1):
+            nose.tools.assert_equals(error, None)
+            with open(filepath, "r") as f:
+                nose.tools.assert_equals(len(f.read().splitlines()), 2000)
+            filepaths.append(filepath)
+
+        nose.tools.assert_equals(sorted(filepaths), sorted(os.path.join(tempdir, download["filename"]) for download in downloads))
+
+        # stopping early stops the remaining downloads
+        shutil.rmtree(tempdir)
+        os.mkdir(tempdir)
+
+        results = nwispy_webservice.iter_downloads(downloads = downloads, file_destination = tempdir, max_workers = 2, base_url = base_url, max_pending = 1)
+        filepath, error = next(results)
+        results.close()
+
+        nose.tools.assert_true(os.path.exists(filepath))
+        nose.tools.assert_true(len(os.listdir(tempdir)) < len(downloads))
+        nose.tools.assert_false(any(thread.name.startswith("nwispy-download") for thread in threading.enumerate()))
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tempdir)
+
+def test_plan_requests():
+
+    requests = fixture["data requests"][:3] + fixture["coalesced requests"] + [
+        {"data type": "dv", "site number": "03298500", "start date": "1960-01-01", "end date": "1960-12-31", "parameters": ["00060"]},
+        {"data type": "dv", "site number": "03290500", "start date": "1960-01-01", "end date": "1960-12-31", "parameters": ["00060"]},
+        {"data type": "site", "site number": "03290500", "start date": "", "end date": "", "parameters": ""}
+    ]
+
+    plans = nwispy_webservice.plan_requests(requests)
+
+    # one plan for the site request, two dv plans for 03284000 and 03290500 at the same window, 
+    # one dv plan for 03298500 1955, one multi-site plan for 1960, and one iv plan
+    nose.tools.assert_equals(len(plans), 6)
+    nose.tools.assert_equals(sorted(request["site number"] for plan in plans for request in plan["requests"]), sorted(request["site number"] for request in requests))
+
+    plans = dict(((plan["data type"], plan["site number"], plan["start date"]), plan) for plan in plans)
+
+    plan = plans[("dv", "03284000", "2014-01-01")]
+    nose.tools.assert_equals(plan["end date"], "2014-01-15")
+    nose.tools.assert_equals(plan["parameters"], ["00060", "00065"])
+    nose.tools.assert_equals(len(plan["requests"]), 2)
+
+    plan = plans[("dv", "03298500", "1955-01-01")]
+    nose.tools.assert_equals(plan["end date"], "1955-01-03")
+    nose.tools.assert_equals(sorted(plan["parameters"]), ["00060", "80154", "80155"])
+
+    plan = plans[("dv", "03290500,03298500", "1960-01-01")]
+    nose.tools.assert_equals(nwispy_webservice.encode_url(plan), "parameterCD=00060&endDt=1960-12-31&startDt=1960-01-01&site=03290500%2C03298500&format=rdb")
+
+    plan = plans[("iv", "03284000", "2014-02-12")]
+    nose.tools.assert_equals(plan["requests"], [fixture["data requests"][2]])
+
+    # limit the number of sites in a planned request
+    plans = nwispy_webservice.plan_requests(requests, max_sites = 1)
+    nose.tools.assert_equals(len(plans), 7)
+
+def test_split_response_in():
+
+    requests = fixture["coalesced requests"]
+    outputs = [StringIO() for request in requests]
+
+    found = nwispy_webservice.split_response_in(filestream = StringIO(fixture["coalesced file"]), requests = requests, outputs = outputs)
+
+    nose.tools.assert_equals(found, [True, True, True])
+
+    actual = [output.getvalue().splitlines() for output in outputs]
+
+    nose.tools.assert_true("# Data for the following 1 site(s) are contained in this file" in actual[0])
+    nose.tools.assert_true("#    USGS 03290500 KENTUCKY RIVER AT LOCK 2 AT LOCKPORT, KY" in actual[0])
+    nose.tools.assert_false("#    USGS 03298500 SALT RIVER AT SHEPHERDSVILLE, KY" in actual[0])
+    nose.tools.assert_false("#    07   00065     00003     Gage height, feet (Mean)" in actual[0])
+    nose.tools.assert_equals([line for line in actual[0] if not line.startswith("#")], [
+                                              "agency_cd\tsite_no\tdatetime\t06_00060_00003\t06_00060_00003_cd",
+                                              "5s\t15s\t20d\t14n\t10s",
+                                              "USGS\t03290500\t2012-07-02\t190\tA",
+                                              "USGS\t03290500\t2012-07-03\t164\tA"])
+
+    nose.tools.assert_true("#    USGS 03298500 SALT RIVER AT SHEPHERDSVILLE, KY" in actual[1])
+    nose.tools.assert_false("#    USGS 03290500 KENTUCKY RIVER AT LOCK 2 AT LOCKPORT, KY" in actual[1])
+    nose.tools.assert_false("#    06   00060     00003     Discharge, cubic feet per second (Mean)" in actual[1])
+    nose.tools.assert_equals(actual[1][-4:], ["agency_cd\tsite_no\tdatetime\t08_80154_00003\t08_80154_00003_cd",
+                                              "5s\t15s\t20d\t14n\t10s",
+                                              "USGS\t03298500\t1955-01-01\t269\tA",
+                                              "USGS\t03298500\t1955-01-02\t134\tA"])
+
+    nose.tools.assert_equals(actual[2][-2:], ["USGS\t03298500\t1955-01-02\t1450\tA\t525\tA",
+                                              "USGS\t03298500\t1955-01-03\t1160\tA\t250\tA"])
+
+    # no data for a site that is not in the response
+    request = {"data type": "dv", "site number": "03284000", "start date": "2012-07-02", "end date": "2012-07-03", "parameters": ["00060"]}
+    found = nwispy_webservice.split_response_in(filestream = StringIO(fixture["coalesced file"]), requests = [request], outputs = [StringIO()])
+    nose.tools.assert_equals(found, [False])
+
+    # no data for parameters that are not in the response
+    request = {"data type": "dv", "site number": "03290500", "start date": "2012-07-02", "end date": "2012-07-03", "parameters": ["00010"]}
+    found = nwispy_webservice.split_response_in(filestream = StringIO(fixture["coalesced file"]), requests = [request], outputs = [StringIO()])
+    nose.tools.assert_equals(found, [False])
+
+def test_get_incremental_request():
+
+    request = {"data type": "iv", "site number": "03401385", "start date": "2014-03-12", "end date": "2014-03-19", "parameters": ["00065", "00010"]}
+    store_name = nwispy_webservice.get_store_name(request)
+
+    nose.tools.assert_equals(store_name, "03401385_iv_00065-00010.txt")
+
+    # no store yet
+    nose.tools.assert_true(nwispy_webservice.get_incremental_request(request, state = {}) is request)
+
+    # request only the missing tail; starting the local date before the last UTC time
+    state = {store_name: {"start date": "2014-03-12", "last": "2014-03-15 10:45"}}
+    incremental_request = nwispy_webservice.get_incremental_request(request, state = state)
+    nose.tools.assert_equals(incremental_request["start date"], "2014-03-14")
+    nose.tools.assert_equals(incremental_request["end date"], "2014-03-19")
+    nose.tools.assert_equals(request["start date"], "2014-03-12")
+
+    # request starts before the data in the store
+    state = {store_name: {"start date": "2014-03-14", "last": "2014-03-15 10:45"}}
+    nose.tools.assert_true(nwispy_webservice.get_incremental_request(request, state = state) is request)
+
+def test_append_file():
+
+    tempdir = tempfile.mkdtemp()
+    store_filepath = os.path.join(tempdir, "store.txt")
+    filepath = os.path.join(tempdir, "download.txt")
+
+    try:
+        with open(filepath, "w") as f:
+            f.write("# header\nagency_cd\tsite_no\tdatetime\ttz_cd\t02_00065\t02_00065_cd\n5s\t15s\t20d\t6s\t14n\t10s\n"
+                    "USGS\t03401385\t2014-03-15 10:30\tEDT\t0.63\tP\n"
+                    "USGS\t03401385\t2014-03-15 10:45\tEDT\t0.64\tP\n")
+
+        # the first download becomes the store
+        last = nwispy_webservice.append_file(store_filepath = store_filepath, filepath = filepath)
+        nose.tools.assert_equals(last, "2014-03-15 14:45")
+        nose.tools.assert_false(os.path.exists(filepath))
+
+        # only rows newer than the store are appended; columns are matched by name
+        with open(filepath, "w") as f:
+            f.write("# header\nagency_cd\tsite_no\tdatetime\ttz_cd\t02_00065_cd\t02_00065\n5s\t15s\t20d\t6s\t10s\t14n\n"
+                    "USGS\t03401385\t2014-03-15 10:45\tEDT\tP\t0.64\n"
+                    "USGS\t03401385\t2014-03-15 11:00\tEDT\tP\t0.65\n")
+
+        last = nwispy_webservice.append_file(store_filepath = store_filepath, filepath = filepath, last = last)
+        nose.tools.assert_equals(last, "2014-03-15 15:00")
+
+        with open(store_filepath, "r") as f:
+            rows = [line for line in f.read().splitlines() if line.startswith("USGS")]
+
+        nose.tools.assert_equals(rows, ["USGS\t03401385\t2014-03-15 10:30\tEDT\t0.63\tP",
+                                        "USGS\t03401385\t2014-03-15 10:45\tEDT\t0.64\tP",
+                                        "USGS\t03401385\t2014-03-15 11:00\tEDT\t0.65\tP"])
+    finally:
+        shutil.rmtree(tempdir)
+
+def test_append_file_daylight_saving_time():
+
+    tempdir = tempfile.mkdtemp()
+    store_filepath = os.path.join(tempdir, "store.txt")
+    filepath = os.path.join(tempdir, "download.txt")
+    header = "# header\nagency_cd\tsite_no\tdatetime\ttz_cd\t02_00065\t02_00065_cd\n5s\t15s\t20d\t6s\t14n\t10s\n"
+
+    try:
+        with open(filepath, "w") as f:
+            f.write(header + "USGS\t03401385\t2014-11-02 01:00\tEDT\t0.63\tP\n"
+                             "USGS\t03401385\t2014-11-02 01:15\tEDT\t0.64\tP\n")
+
+        last = nwispy_webservice.append_file(store_filepath = store_filepath, filepath = filepath)
+        nose.tools.assert_equals(last, "2014-11-02 05:15")
+
+        # the repeated hour after clocks fall back is newer than the store although its local times are not
+        with open(filepath, "w") as f:
+            f.write(header + "USGS\t03401385\t2014-11-02 01:15\tEDT\t0.64\tP\n"
+                             "USGS\t03401385\t2014-11-02 01:00\tEST\t0.65\tP\n"
+                             "USGS\t03401385\t2014-11-02 01:15\tEST\t0.66\tP\n")
+
+        last = nwispy_webservice.append_file(store_filepath = store_filepath, filepath = filepath, last = last)
+        nose.tools.assert_equals(last, "2014-11-02 06:15")
+
+        with open(store_filepath, "r") as f:
+            rows = [line for line in f.read().splitlines() if line.startswith("USGS")]
+
+        nose.tools.assert_equals(rows, ["USGS\t03401385\t2014-11-02 01:00\tEDT\t0.63\tP",
+                                        "USGS\t03401385\t2014-11-02 01:15\tEDT\t0.64\tP",
+                                        "USGS\t03401385\t2014-11-02 01:00\tEST\t0.65\tP",
+                                        "USGS\t03401385\t2014-11-02 01:15\tEST\t0.66\tP"])
+    finally:
+        shutil.rmtree(tempdir)
+
+def test_response_cache():
+
+    server, base_url = _start_server()
+    tempdir = tempfile.mkdtemp()
+
+    try:
+        cache = nwispy_webservice.ResponseCache(directory = os.path.join(tempdir, "cache"))
+        url = nwispy_webservice.encode_url(fixture["data requests"][0])
+        expected = "# path /nwis/dv/\n{0}\n".format(url) * 1000
+
+        def download(filename, cache):
+            filepath = nwispy_webservice.download_file(user_parameters_url = url, data_type = "dv", filename = filename,
+                                                       file_destination = tempdir, base_url = base_url, cache = cache)
+            with open(filepath, "r") as f:
+                return f.read()
+
+        # first download is requested and cached; a fresh cached response needs no request
+        nose.tools.assert_equals(download("file_0.txt", cache), expected)
+        nose.tools.assert_equals(download("file_1.txt", cache), expected)
+        nose.tools.assert_equals(len(server.requests), 1)
+
+        # a stale cached response is revalidated with a conditional request
+        cache.ttl = 0
+        nose.tools.assert_equals(download("file_2.txt", cache), expected)
+        nose.tools.assert_equals(len(server.requests), 2)
+        nose.tools.assert_equals(server.requests[1][1], '"{0}"'.format(abs(hash(url))))
+
+        # offline cache uses cached responses only
+        offline_cache = nwispy_webservice.ResponseCache(directory = os.path.join(tempdir, "cache"), offline = True)
+        nose.tools.assert_equals(download("file_3.txt", offline_cache), expected)
+        nose.tools.assert_equals(len(server.requests), 2)
+
+        empty_cache = nwispy_webservice.ResponseCache(directory = os.path.join(tempdir, "empty"), offline = True)
+        nose.tools.assert_raises(IOError, download, "file_4.txt", empty_cache)
+
+        # least recently used responses are removed when the cache is too large
+        cache.max_size = len(expected)
+        cache.store(url = "other url", filepath = os.path.join(tempdir, "file_0.txt"), headers = {})
+        nose.tools.assert_equals(cache.lookup(url), None)
+        nose.tools.assert_not_equals(cache.lookup("other url"), None)
+        nose.tools.assert_false(cache.lookup("other url")["provisional"])
+
+        # responses holding provisional data expire sooner
+        with open(os.path.join(tempdir, "provisional.txt"), "w") as f:
+            f.write("# Data-value qualification codes included in this output: \n#     P  Provisional data subject to revision.  \nagency_cd\n")
+        cache.max_size = 10 * len(expected)
+        cache.store(url = "provisional url", filepath = os.path.join(tempdir, "provisional.txt"), headers = {})
+        nose.tools.assert_true(cache.lookup("provisional url")["provisional"])
+
+        # the size of the cached responses is indexed when a cache is created, and kept as responses are stored
+        reopened_cache = nwispy_webservice.ResponseCache(directory = os.path.join(tempdir, "cache"), max_size = cache.max_size)
+        nose.tools.assert_equals(reopened_cache._total_size, cache._total_size)
+        nose.tools.assert_equals(sorted(reopened_cache._index), sorted([cache.get_key("other url"), cache.get_key("provisional url")]))
+
+        reopened_cache.store(url = "other url", filepath = os.path.join(tempdir, "file_0.txt"), headers = {})
+        nose.tools.assert_equals(reopened_cache._total_size, cache._total_size)
+
+        # storing a response that fits keeps the others; once too large, the least recently used are removed first
+        reopened_cache.max_size = 3 * len(expected)
+        reopened_cache.store(url = "third url", filepath = os.path.join(tempdir, "file_0.txt"), headers = {})
+        nose.tools.assert_not_equals(reopened_cache.lookup("provisional url"), None)
+
+        reopened_cache.store(url = "fourth url", filepath = os.path.join(tempdir, "file_0.txt"), headers = {})
+        nose.tools.assert_equals(reopened_cache.lookup("provisional url"), None)
+        nose.tools.assert_not_equals(reopened_cache.lookup("other url"), None)
+        nose.tools.assert_true(reopened_cache._total_size <= reopened_cache.max_size)
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tempdir)
+
+def test_download_file_compressed():
+
+    server, base_url = _start_server()
+    tempdir = tempfile.mkdtemp()
+
+    try:
+        url = nwispy_webservice.encode_url(fixture["data requests"][0])
+        expected = "# path /nwis/dv/\n{0}\n".format(url) * 1000
+
+        for encoding, raw_deflate in [(None, False), ("gzip", False), ("deflate", False), ("deflate", True)]:
+            server.encoding = encoding
+            server.raw_deflate = raw_deflate
+
+            # decompressed while downloaded
+            filepath = nwispy_webservice.download_file(user_parameters_url = url, data_type = "dv", filename = "file.txt", file_destination = tempdir, base_url = base_url)
+            with open(filepath, "rb") as f:
+                nose.tools.assert_equals(f.read(), expected)
+
+            # kept compressed on disk
+            filepath = nwispy_webservice.download_file(user_parameters_url = url, data_type = "dv", filename = "file.txt.gz", file_destination = tempdir, base_url = base_url)
+            with gzip.open(filepath, "rb") as f:
+                nose.tools.assert_equals(f.read(), expected)
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tempdir)
+
+def test_request_scheduler():
+
+    server, base_url = _start_server()
+    tempdir = tempfile.mkdtemp()
+
+    try:
+        url = nwispy_webservice.encode_url(fixture["data requests"][0])
+        scheduler = nwispy_webservice.RequestScheduler(max_retries = 2, backoff = 0.01, rate = None)
+
+        def download(scheduler):
+            return nwispy_webservice.download_file(user_parameters_url = url, data_type = "dv", filename = "file.txt",
+                                                   file_destination = tempdir, base_url = base_url, scheduler = scheduler)
+
+        # transient errors are retried
+        server.failures = 2
+        filepath = download(scheduler)
+        nose.tools.assert_true(os.path.exists(filepath))
+        nose.tools.assert_equals(len(server.requests), 3)
+
+        # retries are bounded
+        server.failures = 3
+        with nose.tools.assert_raises(nwispy_webservice.urllib2.HTTPError):
+            download(scheduler)
+        server.failures = 0
+
+        # errors that are not transient are not retried
+        nose.tools.assert_false(scheduler.is_retryable(nwispy_webservice.urllib2.HTTPError(url, 400, "Bad Request", None, None)))
+        nose.tools.assert_true(scheduler.is_retryable(nwispy_webservice.urllib2.HTTPError(url, 429, "Too Many Requests", None, None)))
+        nose.tools.assert_true(scheduler.is_retryable(nwispy_webservice.urllib2.URLError("connection refused")))
+
+        # backoff is bounded and jittered
+        delays = [scheduler.get_delay(attempt = 10, error = None) for i in range(100)]
+        nose.tools.assert_true(all(0 <= delay <= 10.24 for delay in delays))
+        nose.tools.assert_true(len(set(delays)) > 1)
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tempdir)
+
+def test_request_scheduler_rate():
+
+    scheduler = nwispy_webservice.RequestScheduler(rate = 50.0)
+
+    start = time.time()
+    for i in range(6):
+        scheduler.wait("waterservices.usgs.gov")
+    scheduler.wait("other.host")
+
+    nose.tools.assert_true(time.time() - start >= 0.1)
+
+def test_download_file_redirect():
+
+    server, base_url = _start_server()
+    other_server, other_base_url = _start_server()
+    tempdir = tempfile.mkdtemp()
+
+    try:
+        url = nwispy_webservice.encode_url(fixture["data requests"][0])
+        expected = "# path /nwis/dv/\n{0}\n".format(url) * 1000
+        moved_url = base_url.replace("/nwis/", "/moved/")
+
+        # a permanent redirect on the same host is followed on the same connection
+        filepath = nwispy_webservice.download_file(user_parameters_url = url, data_type = "dv", filename = "file.txt", file_destination = tempdir, base_url = moved_url)
+        with open(filepath, "r") as f:
+            nose.tools.assert_equals(f.read(), expected)
+        nose.tools.assert_equals(len(server.requests), 2)
+
+        # a redirect to another host is followed on a new connection
+        server.redirect_url = other_base_url
+        filepath = nwispy_webservice.download_file(user_parameters_url = url, data_type = "dv", filename = "file.txt", file_destination = tempdir, base_url = moved_url)
+        with open(filepath, "r") as f:
+            nose.tools.assert_equals(f.read(), expected)
+        nose.tools.assert_equals(len(other_server.requests), 1)
+
+        # redirects are followed a limited number of times
+        loop_url = base_url.replace("/nwis/", "/loop/")
+        with nose.tools.assert_raises(nwispy_webservice.urllib2.HTTPError) as context:
+            nwispy_webservice.download_file(user_parameters_url = url, data_type = "dv", filename = "file.txt", file_destination = tempdir, base_url = loop_url)
+        nose.tools.assert_equals(context.exception.code, 301)
+
+    finally:
+        for s in [server, other_server]:
+            s.shutdown()
+            s.server_close()
+        shutil.rmtree(tempdir)
+
+def test_download_file_truncated():
+
+    server, base_url = _start_server()
+    tempdir = tempfile.mkdtemp()
+
+    try:
+        url = nwispy_webservice.encode_url(fixture["data requests"][0])
+        expected = "# path /nwis/dv/\n{0}\n".format(url) * 1000
+        nwispy_webservice.download_file(user_parameters_url = url, data_type = "dv", filename = "file.txt", file_destination = tempdir, base_url = base_url)
+
+        # a response that fails while streamed leaves neither a partial file nor a changed output file
+        truncated_url = base_url.replace("/nwis/", "/truncated/")
+        nose.tools.assert_raises(nwispy_webservice.httplib.IncompleteRead, nwispy_webservice.download_file, user_parameters_url = url, data_type = "dv",
+                                 filename = "file.txt", file_destination = tempdir, base_url = truncated_url)
+
+        nose.tools.assert_equals(os.listdir(tempdir), ["file.txt"])
+        with open(os.path.join(tempdir, "file.txt"), "r") as f:
+            nose.tools.assert_equals(f.read(), expected)
+
+        nose.tools.assert_raises(nwispy_webservice.httplib.IncompleteRead, nwispy_webservice.download_file, user_parameters_url = url, data_type = "dv",
+                                 filename = "other.txt.gz", file_destination = tempdir, base_url = truncated_url)
+        nose.tools.assert_equals(os.listdir(tempdir), ["file.txt"])
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tempdir)
+
+def test_download_file_timeout():
+
+    # a server that accepts connections but never responds
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    base_url = "http://127.0.0.1:{0}/nwis/".format(listener.getsockname()[1])
+    tempdir = tempfile.mkdtemp()
+
+    try:
+        connection = nwispy_webservice.open_connection(base_url = base_url, timeout = 1.0)
+        start = time.time()
+        nose.tools.assert_raises(socket.timeout, nwispy_webservice.download_file, user_parameters_url = "site=03290500", data_type = "dv",
+                                 filename = "file.txt", file_destination = tempdir, connection = connection, base_url = base_url)
+
+        # a timed out request is not retried at once on a new connection; that is left to a scheduler's backoff
+        nose.tools.assert_true(time.time() - start < 1.8)
+        nose.tools.assert_false(nwispy_webservice._is_stale_connection(socket.timeout()))
+        nose.tools.assert_true(nwispy_webservice._is_stale_connection(socket.error(errno.ECONNRESET, "Connection reset by peer")))
+
+        # a timed out request is retried by a scheduler
+        nose.tools.assert_true(nwispy_webservice.RequestScheduler().is_retryable(socket.timeout()))
+
+    finally:
+        listener.close()
+        shutil.rmtree(tempdir)